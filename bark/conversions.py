@@ -14,28 +14,66 @@
 #    under the License.
 
 import abc
-from curses import ascii
 import os
+import re
 import thread
 import time
 import urlparse
 
+from bark import timecache
+from bark import wsgi
+
+# Characters which may be logged without escaping: printable ASCII,
+# other than the double quote and the backslash
+_plain = ''.join(chr(c) for c in range(0x20, 0x7f) if chr(c) not in '"\\')
+_needescape_re = re.compile('[^%s]' % re.escape(_plain))
+
+# Host URLs which urlparse would return unchanged, and which cannot
+# contain a password
+_simple_host_url_re = re.compile(r'https?://[^@\[\]]+\Z')
+
 
 class Modifier(object):
-    def __init__(self):
+    __slots__ = ('codes', 'reject', 'param')
+
+    def __init__(self, codes=None, reject=False, param=None):
         """
-        Initialize a Modifier object.
+        Initialize a Modifier object.  Modifiers are immutable value
+        objects, so that equal conversions may be shared.
+
+        :param codes: A list of the response codes.  If None or
+                      empty, all codes are accepted.
+        :param reject: If True, the listed codes will be rejected, and
+                       the conversion will format as "-"; if False,
+                       only the listed codes will be accepted, and the
+                       conversion will format as "-" for all the
+                       others.
+        :param param: The string value of the parameter for the
+                      conversion; used with e.g., %i to specify the
+                      desired header.
         """
 
         # These two work together; if 'reject' is True, only codes
         # that are NOT in 'codes' will format, otherwise, only codes
         # that ARE in 'codes' will format.
-        self.codes = set()
-        self.reject = True
+        codes = frozenset(codes or ())
+        object.__setattr__(self, 'codes', codes)
+        object.__setattr__(self, 'reject', reject if codes else True)
+        object.__setattr__(self, 'param', param)
+
+    def __setattr__(self, name, value):
+        """
+        Prohibit modification of the Modifier.
+        """
+
+        raise AttributeError("Modifier objects are immutable")
+
+    def __delattr__(self, name):
+        """
+        Prohibit modification of the Modifier.
+        """
 
-        # Parameter for the conversion; used with e.g., %i to specify
-        # desired header
-        self.param = None
+        raise AttributeError("Modifier objects are immutable")
 
     def __str__(self):
         """
@@ -57,29 +95,31 @@ class Modifier(object):
 
         return result
 
-    def set_codes(self, codes, reject=False):
+    def __eq__(self, other):
         """
-        Set the accepted or rejected codes codes list.
-
-        :param codes: A list of the response codes.
-        :param reject: If True, the listed codes will be rejected, and
-                       the conversion will format as "-"; if False,
-                       only the listed codes will be accepted, and the
-                       conversion will format as "-" for all the
-                       others.
+        Compare two Modifier objects for equality.
         """
 
-        self.codes = set(codes)
-        self.reject = reject
+        if not isinstance(other, Modifier):
+            return NotImplemented
+        return (self.codes == other.codes and
+                self.reject == other.reject and
+                self.param == other.param)
 
-    def set_param(self, param):
+    def __ne__(self, other):
+        """
+        Compare two Modifier objects for inequality.
         """
-        Set the parameter for the conversion.
 
-        :param param: The string value of the parameter.
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        """
+        Compute a hash of the Modifier.
         """
 
-        self.param = param
+        return hash((self.codes, self.reject, self.param))
 
     def accept(self, code):
         """
@@ -101,8 +141,44 @@ class EscapeDict(dict):
         return '\\x%02x' % ord(key)
 
 
+def _make_escape_table(escapes):
+    """
+    Build a translation table mapping each of the 256 possible
+    characters of a byte string to its escaped representation.
+
+    :param escapes: An EscapeDict giving the escaped representation
+                    of characters which need escaping.
+
+    :returns: A dictionary mapping characters to strings.
+    """
+
+    return dict((c, c if c in _plain else escapes[c])
+                for c in (chr(i) for i in range(256)))
+
+
+class _ConversionMeta(abc.ABCMeta):
+    """
+    Metaclass for Conversion.  Freezes each conversion once its
+    constructor returns, so subclasses may set their attributes in
+    __init__() as usual.
+    """
+
+    def __call__(cls, *args, **kwargs):
+        """
+        Construct and freeze a Conversion object.
+        """
+
+        conv = super(_ConversionMeta, cls).__call__(*args, **kwargs)
+        object.__setattr__(conv, '_frozen', True)
+        return conv
+
+
 class Conversion(object):
-    __metaclass__ = abc.ABCMeta
+    __metaclass__ = _ConversionMeta
+
+    # Conversions are numerous, so avoid a per-instance dictionary;
+    # subclasses should declare their own __slots__
+    __slots__ = ('conv_chr', 'modifier', '_frozen')
 
     _escapes = EscapeDict({
         "\b": '\\b',
@@ -114,13 +190,15 @@ class Conversion(object):
         '"': '\\"',
     })
 
+    _escape_table = _make_escape_table(_escapes)
+
     @staticmethod
     def _needescape(c):
         """
         Return True if character needs escaping, else False.
         """
 
-        return not ascii.isprint(c) or c == '"' or c == '\\' or ascii.isctrl(c)
+        return c not in _plain
 
     @classmethod
     def escape(cls, string):
@@ -133,12 +211,49 @@ class Conversion(object):
         :returns: The escaped version of the string.
         """
 
-        return ''.join([cls._escapes[c] if cls._needescape(c) else c
-                        for c in string.encode('utf8')])
+        # Escaping operates on the UTF-8 encoding
+        if isinstance(string, unicode):
+            string = string.encode('utf8')
+
+        # Most strings need no escaping at all; deleting all the
+        # plain characters leaves just those that do
+        count = len(string.translate(None, _plain))
+        if not count:
+            return string
+
+        # Substitute just the few characters needing escaping, or
+        # translate the whole string if there are many of them
+        if count * 8 < len(string):
+            return _needescape_re.sub(cls._escape_match, string)
+        return ''.join(map(cls._escape_table.__getitem__, string))
+
+    @classmethod
+    def _escape_match(cls, match):
+        """
+        Helper for escape().  Returns the escaped version of the
+        character matched by a regular expression.
+
+        :param match: The regular expression match object.
+
+        :returns: The escaped version of the matched character.
+        """
+
+        return cls._escape_table[match.group()]
+
+    # True if the result of constant() is only valid for the process
+    # which computed it, e.g., the process ID
+    per_process = False
+
+    # True if the conversion only needs the time the request started,
+    # as the 'start' key of its data; Formats capture a single start
+    # time for all such conversions instead of calling prepare()
+    needs_start = False
 
     def __init__(self, conv_chr, modifier):
         """
-        Initialize a Conversion object.
+        Initialize a Conversion object.  Conversions are immutable
+        once constructed, since equal conversions are shared between
+        formats.
 
         :param conv_chr: The conversion character.
         :param modifier: The format modifier applied to this
@@ -148,6 +263,24 @@ class Conversion(object):
         self.conv_chr = conv_chr
         self.modifier = modifier
 
+    def __setattr__(self, name, value):
+        """
+        Prohibit modification of the Conversion once constructed.
+        """
+
+        if getattr(self, '_frozen', False):
+            raise AttributeError("Conversion objects are immutable")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        """
+        Prohibit modification of the Conversion once constructed.
+        """
+
+        if getattr(self, '_frozen', False):
+            raise AttributeError("Conversion objects are immutable")
+        object.__delattr__(self, name)
+
     def __str__(self):
         """
         Construct a string representation of this conversion.
@@ -157,9 +290,39 @@ class Conversion(object):
             return "%%%s%s" % (self.modifier, self.conv_chr)
         return "%%%s(%s)" % (self.modifier, self.conv_chr)
 
+    def __eq__(self, other):
+        """
+        Compare two Conversion objects for equality.  Conversions of
+        the same class with the same conversion character and
+        modifier are equal, and may be used interchangeably.
+        """
+
+        if not isinstance(other, Conversion):
+            return NotImplemented
+        return (self.__class__ is other.__class__ and
+                self.conv_chr == other.conv_chr and
+                self.modifier == other.modifier)
+
+    def __ne__(self, other):
+        """
+        Compare two Conversion objects for inequality.
+        """
+
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        """
+        Compute a hash of the Conversion.
+        """
+
+        return hash((self.__class__, self.conv_chr, self.modifier))
+
     def prepare(self, request):
         """
-        Performs any preparation necessary for the Conversion.
+        Performs any preparation necessary for the Conversion.  A
+        Format only calls prepare() for conversions which override
+        it; the others are passed None as their data.
 
         :param request: The webob Request object describing the
                         request.
@@ -170,6 +333,19 @@ class Conversion(object):
 
         return {}
 
+    def constant(self):
+        """
+        Determine whether the Conversion produces the same result for
+        every request handled by this process.  Such conversions may
+        be folded into the static text of a compiled Format.  Note
+        that the modifier is not consulted.
+
+        :returns: The result of the conversion, or None if the result
+                  varies from request to request.
+        """
+
+        return None
+
     @abc.abstractmethod
     def convert(self, request, response, data):
         """
@@ -190,6 +366,8 @@ class Conversion(object):
 
 
 class StringConversion(Conversion):
+    __slots__ = ('string',)
+
     def __init__(self, string):
         """
         Initialize a string conversion.
@@ -207,14 +385,31 @@ class StringConversion(Conversion):
 
         return self.string
 
-    def append(self, text):
+    def __eq__(self, other):
+        """
+        Compare two StringConversion objects for equality.
+        """
+
+        if not isinstance(other, Conversion):
+            return NotImplemented
+        return (self.__class__ is other.__class__ and
+                self.string == other.string)
+
+    def __hash__(self):
         """
-        Append a string to the string in this StringConversion.
+        Compute a hash of the StringConversion.
+        """
+
+        return hash((self.__class__, self.string))
 
-        :param text: The string to be appended.
+    def constant(self):
         """
+        A StringConversion always produces its string.
 
-        self.string += text
+        :returns: The string.
+        """
+
+        return self.string
 
     def convert(self, request, response, data):
         """
@@ -235,6 +430,8 @@ class StringConversion(Conversion):
 
 
 class AddressConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -259,6 +456,8 @@ class AddressConversion(Conversion):
 
 
 class CookieConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -274,10 +473,23 @@ class CookieConversion(Conversion):
                   conversion.
         """
 
-        return self.escape(request.cookies.get(self.modifier.param, '-'))
+        value = wsgi.request_cookie(request.environ, self.modifier.param)
+        return '-' if value is None else self.escape(value)
 
 
 class EnvironmentConversion(Conversion):
+    __slots__ = ()
+
+    def constant(self):
+        """
+        The process environment does not vary from request to
+        request.
+
+        :returns: The result of the conversion.
+        """
+
+        return self.convert(None, None, None)
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -297,6 +509,8 @@ class EnvironmentConversion(Conversion):
 
 
 class FilenameConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -312,10 +526,12 @@ class FilenameConversion(Conversion):
                   conversion.
         """
 
-        return self.escape(request.path)
+        return self.escape(wsgi.request_path(request.environ))
 
 
 class FirstLineConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -331,8 +547,40 @@ class FirstLineConversion(Conversion):
                   conversion.
         """
 
+        environ = request.environ
+        host_url = wsgi.request_host_url(environ)
+        path = wsgi.request_path(environ)
+        url = host_url + path
+        qs = environ.get('QUERY_STRING', '')
+        if qs:
+            url += '?' + qs
+
+        # Only a URL with credentials in the authority needs to be
+        # chopped up; anything unusual takes the same path, so that
+        # the result is always identical.  That includes parameters
+        # in the last path segment and fragments, which urlparse
+        # drops if empty
+        if (not _simple_host_url_re.match(host_url) or
+                path and path[0] != '/' or
+                ';' in path.rpartition('/')[2] or '#' in qs):
+            url = self._mask_password(url)
+
+        return self.escape("%s %s %s" % (
+            environ.get('REQUEST_METHOD', 'GET'), url,
+            environ['SERVER_PROTOCOL']))
+
+    @staticmethod
+    def _mask_password(url):
+        """
+        Helper for convert().  Masks any password in a URL.
+
+        :param url: The URL.
+
+        :returns: The URL, with any password replaced by "XXXXXXXX".
+        """
+
         # Chop up the URL
-        uri = urlparse.urlparse(request.url)
+        uri = urlparse.urlparse(url)
 
         # If there's a password, recompute the URI without it
         if uri.password:
@@ -345,11 +593,12 @@ class FirstLineConversion(Conversion):
             uri = urlparse.ParseResult(uri[0], netloc, uri[2], uri[3],
                                        uri[4], uri[5])
 
-        return self.escape("%s %s %s" % (request.method, uri.geturl(),
-                                         request.environ['SERVER_PROTOCOL']))
+        return uri.geturl()
 
 
 class HostnameConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -365,10 +614,21 @@ class HostnameConversion(Conversion):
                   conversion.
         """
 
-        return self.escape(request.remote_addr or "")
+        return self.escape(request.environ.get('REMOTE_ADDR') or "")
 
 
 class KeepAliveConversion(Conversion):
+    __slots__ = ()
+
+    def constant(self):
+        """
+        The result of this conversion never varies.
+
+        :returns: The result of the conversion.
+        """
+
+        return self.convert(None, None, None)
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -388,6 +648,8 @@ class KeepAliveConversion(Conversion):
 
 
 class LocalAddressConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -408,6 +670,8 @@ class LocalAddressConversion(Conversion):
 
 
 class NoteConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -429,6 +693,29 @@ class NoteConversion(Conversion):
 
 
 class ProcessIDConversion(Conversion):
+    __slots__ = ()
+
+    @property
+    def per_process(self):
+        """
+        The process ID changes when the process forks.
+        """
+
+        return self.modifier.param in (None, 'pid')
+
+    def constant(self):
+        """
+        The process ID does not vary from request to request, although
+        the thread ID does.
+
+        :returns: The result of the conversion, or None if the result
+                  varies from request to request.
+        """
+
+        if self.modifier.param in ('tid', 'hextid'):
+            return None
+        return self.convert(None, None, None)
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -454,6 +741,8 @@ class ProcessIDConversion(Conversion):
 
 
 class ProtocolConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -473,6 +762,8 @@ class ProtocolConversion(Conversion):
 
 
 class QueryStringConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -488,12 +779,14 @@ class QueryStringConversion(Conversion):
                   conversion.
         """
 
-        qstr = request.query_string
+        qstr = request.environ.get('QUERY_STRING', '')
 
         return self.escape('?%s' % qstr) if qstr else ''
 
 
 class RemoteUserConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -509,16 +802,35 @@ class RemoteUserConversion(Conversion):
                   conversion.
         """
 
+        remote_user = request.environ.get('REMOTE_USER')
+
         # None specified
-        if request.remote_user is None:
+        if remote_user is None:
             return "-"
-        elif not request.remote_user:
+        elif not remote_user:
             # Empty string...
             return '""'
-        return self.escape(request.remote_user)
+        return self.escape(remote_user)
 
 
 class RequestHeaderConversion(Conversion):
+    __slots__ = ('key',)
+
+    def __init__(self, conv_chr, modifier):
+        """
+        Initialize a RequestHeaderConversion object.  The header name
+        is translated into a WSGI environment key once, here.
+
+        :param conv_chr: The conversion character.
+        :param modifier: The format modifier applied to this
+                         conversion.
+        """
+
+        super(RequestHeaderConversion, self).__init__(conv_chr, modifier)
+
+        self.key = (None if modifier.param is None else
+                    wsgi.header_key(modifier.param))
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -534,10 +846,12 @@ class RequestHeaderConversion(Conversion):
                   conversion.
         """
 
-        return self.escape(request.headers.get(self.modifier.param, ''))
+        return self.escape(request.environ.get(self.key, ''))
 
 
 class RequestMethodConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -553,10 +867,12 @@ class RequestMethodConversion(Conversion):
                   conversion.
         """
 
-        return self.escape(request.method)
+        return self.escape(request.environ.get('REQUEST_METHOD', 'GET'))
 
 
 class ResponseHeaderConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -576,6 +892,8 @@ class ResponseHeaderConversion(Conversion):
 
 
 class ResponseSizeConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -591,7 +909,9 @@ class ResponseSizeConversion(Conversion):
                   conversion.
         """
 
-        size = response.content_length
+        # The streaming middleware counts the bytes actually sent
+        size = request.environ.get('bark.bytes_sent',
+                                   response.content_length)
         if not size:
             size = "-" if self.conv_chr == 'b' else 0
 
@@ -599,6 +919,8 @@ class ResponseSizeConversion(Conversion):
 
 
 class ServerNameConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -618,6 +940,8 @@ class ServerNameConversion(Conversion):
 
 
 class PortConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -642,6 +966,10 @@ class PortConversion(Conversion):
 
 
 class ServeTimeConversion(Conversion):
+    __slots__ = ()
+
+    needs_start = True
+
     def prepare(self, request):
         """
         Performs any preparation necessary for the Conversion.
@@ -679,6 +1007,8 @@ class ServeTimeConversion(Conversion):
 
 
 class StatusConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -698,6 +1028,48 @@ class StatusConversion(Conversion):
 
 
 class TimeConversion(Conversion):
+    __slots__ = ('end', 'fmtstr', 'arith')
+
+    needs_start = True
+
+    # Fractional and integral times, as multiplier and field width
+    _arith = {
+        'sec': (1, 0),
+        'msec': (1000, 0),
+        'usec': (1000000, 0),
+        'msec_frac': (1000, 3),
+        'usec_frac': (1000000, 6),
+    }
+
+    def __init__(self, conv_chr, modifier):
+        """
+        Initialize a TimeConversion object.  The parameter is
+        interpreted once, here, rather than for every request.
+
+        :param conv_chr: The conversion character.
+        :param modifier: The format modifier applied to this
+                         conversion.
+        """
+
+        super(TimeConversion, self).__init__(conv_chr, modifier)
+
+        # Determine which time to use
+        fmtstr = modifier.param
+        self.end = False
+        if fmtstr == 'begin' or fmtstr == 'end':
+            self.end = fmtstr == 'end'
+            fmtstr = None
+        elif fmtstr is not None:
+            for prefix in ('begin:', 'end:'):
+                if fmtstr.startswith(prefix):
+                    self.end = prefix == 'end:'
+                    fmtstr = fmtstr[len(prefix):]
+                    break
+
+        # Next, determine the format to use
+        self.fmtstr = "[%d/%b/%Y:%H:%M:%S +0000]" if fmtstr is None else fmtstr
+        self.arith = self._arith.get(self.fmtstr)
+
     def prepare(self, request):
         """
         Performs any preparation necessary for the Conversion.
@@ -726,54 +1098,31 @@ class TimeConversion(Conversion):
                   conversion.
         """
 
-        # Determine which time to use
-        fmtstr = self.modifier.param
-        if fmtstr is None:
-            log_time = data['start']
-        elif fmtstr == 'begin' or fmtstr.startswith('begin:'):
-            log_time = data['start']
-            if fmtstr == 'begin':
-                fmtstr = None
-            else:
-                fmtstr = fmtstr[len('begin:'):]
-        elif fmtstr == 'end' or fmtstr.startswith('end:'):
-            log_time = time.time()
-            if fmtstr == 'end':
-                fmtstr = None
-            else:
-                fmtstr = fmtstr[len('end:'):]
-        else:
-            log_time = data['start']
+        log_time = time.time() if self.end else data['start']
 
-        # Next, determine the format to use
-        if fmtstr is None:
-            fmtstr = "[%d/%b/%Y:%H:%M:%S +0000]"
-        elif fmtstr in ('sec', 'msec', 'usec', 'msec_frac', 'usec_frac'):
-            mult = 1
-            fld_len = 0
+        # Seconds, milliseconds, or microseconds are just arithmetic
+        if self.arith:
+            mult, fld_len = self.arith
+            if fld_len:
+                return "%0*d" % (fld_len, int((log_time * mult) -
+                                              (int(log_time) * mult)))
+            return "%d" % (log_time * mult)
 
-            # Handle microseconds and milliseconds
-            if fmtstr.startswith('usec'):
-                mult = 1000000
-                fld_len = 6
-            elif fmtstr.startswith('msec'):
-                mult = 1000
-                fld_len = 3
+        return timecache.strftime(self.fmtstr, log_time)
 
-            # Adjust for request for fractions
-            if fmtstr.endswith('_frac'):
-                log_time = int((log_time * mult) - (int(log_time) * mult))
-            else:
-                log_time = int(log_time * mult)
-                fld_len = 0
 
-            # Return the formatted result
-            return "%0*d" % (fld_len, log_time)
+class UnavailableConversion(Conversion):
+    __slots__ = ()
 
-        return time.strftime(fmtstr, time.gmtime(log_time))
+    def constant(self):
+        """
+        The result of this conversion never varies.
 
+        :returns: The result of the conversion.
+        """
+
+        return self.convert(None, None, None)
 
-class UnavailableConversion(Conversion):
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -793,6 +1142,8 @@ class UnavailableConversion(Conversion):
 
 
 class URLConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -808,10 +1159,12 @@ class URLConversion(Conversion):
                   conversion.
         """
 
-        return self.escape(request.path)
+        return self.escape(wsgi.request_path(request.environ))
 
 
 class WSGIEnvironmentConversion(Conversion):
+    __slots__ = ()
+
     def convert(self, request, response, data):
         """
         Performs the desired Conversion.
@@ -828,3 +1181,41 @@ class WSGIEnvironmentConversion(Conversion):
         """
 
         return self.escape(str(request.environ.get(self.modifier.param, '-')))
+
+
+# The conversions provided by Bark.  These are the same as the
+# conversions published through the "bark.conversion" entry point
+# group, which is only consulted for conversions not listed here.
+registry = {
+    'a': AddressConversion,
+    'A': LocalAddressConversion,
+    'b': ResponseSizeConversion,
+    'B': ResponseSizeConversion,
+    'C': CookieConversion,
+    'D': ServeTimeConversion,
+    'e': EnvironmentConversion,
+    'f': FilenameConversion,
+    'h': HostnameConversion,
+    'H': ProtocolConversion,
+    'i': RequestHeaderConversion,
+    'k': KeepAliveConversion,
+    'l': UnavailableConversion,
+    'L': UnavailableConversion,
+    'm': RequestMethodConversion,
+    'n': NoteConversion,
+    'o': ResponseHeaderConversion,
+    'p': PortConversion,
+    'P': ProcessIDConversion,
+    'q': QueryStringConversion,
+    'r': FirstLineConversion,
+    'R': UnavailableConversion,
+    's': StatusConversion,
+    't': TimeConversion,
+    'T': ServeTimeConversion,
+    'u': RemoteUserConversion,
+    'U': URLConversion,
+    'v': ServerNameConversion,
+    'V': ServerNameConversion,
+    'X': UnavailableConversion,
+    'w': WSGIEnvironmentConversion,
+}
@@ -0,0 +1,171 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A lightweight reader for setuptools entry points.  Importing
+pkg_resources scans every installed distribution up front, which is
+costly at process startup; this module instead reads the
+"entry_points.txt" metadata files on sys.path, and only when an entry
+point is actually requested.
+"""
+
+import ConfigParser
+import os
+import StringIO
+import sys
+import zipfile
+
+
+# Maps entry point group names to lists of EntryPoint instances;
+# populated on first use
+_entry_points = None
+
+
+class EntryPoint(object):
+    def __init__(self, name, value):
+        """
+        Initialize an EntryPoint.
+
+        :param name: The name of the entry point.
+        :param value: The entry point specification, of the form
+                      "module:attr [extras]".
+        """
+
+        self.name = name
+
+        # Extras are not checked
+        spec = value.partition('[')[0]
+        module, _sep, attrs = spec.partition(':')
+        self.module = module.strip()
+        self.attrs = [attr for attr in attrs.strip().split('.') if attr]
+
+    def load(self):
+        """
+        Import the object the entry point refers to.
+
+        :returns: The object.
+        """
+
+        obj = __import__(self.module, fromlist=['__name__'])
+        for attr in self.attrs:
+            try:
+                obj = getattr(obj, attr)
+            except AttributeError as exc:
+                raise ImportError(str(exc))
+
+        return obj
+
+
+def _read(fp, result):
+    """
+    Read an "entry_points.txt" file.
+
+    :param fp: A file object to read the entry points from.
+    :param result: A dictionary mapping group names to lists of
+                   EntryPoint instances, to which the entry points
+                   are added.
+    """
+
+    parser = ConfigParser.RawConfigParser()
+    parser.optionxform = str  # Entry point names are case-sensitive
+    try:
+        parser.readfp(fp)
+    except ConfigParser.Error:
+        return
+
+    for group in parser.sections():
+        for name, value in parser.items(group):
+            result.setdefault(group, []).append(EntryPoint(name, value))
+
+
+def _metadata_dirs(path):
+    """
+    Find the metadata directories of the distributions in a sys.path
+    directory.
+
+    :param path: The directory.
+
+    :returns: A list of metadata directory names.
+    """
+
+    try:
+        entries = sorted(os.listdir(path))
+    except OSError:
+        return []
+
+    # The directory may itself be an unpacked egg
+    result = [os.path.join(path, 'EGG-INFO')]
+    for entry in entries:
+        if entry.endswith(('.egg-info', '.dist-info')):
+            result.append(os.path.join(path, entry))
+        elif entry.endswith('.egg'):
+            result.append(os.path.join(path, entry, 'EGG-INFO'))
+
+    return result
+
+
+def _scan():
+    """
+    Read the entry points of all the distributions on sys.path.
+
+    :returns: A dictionary mapping group names to lists of
+              EntryPoint instances.
+    """
+
+    result = {}
+    seen = set()
+    for path in sys.path:
+        path = os.path.abspath(path or os.curdir)
+        if path in seen:
+            continue
+        seen.add(path)
+
+        if os.path.isdir(path):
+            for metadata in _metadata_dirs(path):
+                try:
+                    with open(os.path.join(metadata,
+                                           'entry_points.txt')) as fp:
+                        _read(fp, result)
+                except IOError:
+                    continue
+        elif zipfile.is_zipfile(path):
+            # A zipped egg
+            try:
+                with zipfile.ZipFile(path) as zf:
+                    text = zf.read('EGG-INFO/entry_points.txt')
+            except KeyError:
+                continue
+            _read(StringIO.StringIO(text), result)
+
+    return result
+
+
+def iter_entry_points(group, name):
+    """
+    Find the entry points with a given name in a given group.  The
+    entry points are read the first time this function is called.
+
+    :param group: The entry point group name, e.g., "bark.handler".
+    :param name: The entry point name.
+
+    :returns: An iterator of EntryPoint instances.
+    """
+
+    global _entry_points
+
+    if _entry_points is None:
+        _entry_points = _scan()
+
+    return (ep for ep in _entry_points.get(group, []) if ep.name == name)
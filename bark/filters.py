@@ -0,0 +1,146 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import re
+
+from bark import wsgi
+
+
+# The options which configure a Filter
+_options = ('exclude_paths', 'exclude_methods', 'exclude_headers',
+            'exclude_status')
+
+
+def _split(text):
+    """
+    Split a comma-separated option value into a list, eliminating
+    spaces and empty entries.
+
+    :param text: The text of the option.
+
+    :returns: A list of the entries.
+    """
+
+    return [entry.strip() for entry in text.split(',') if entry.strip()]
+
+
+def parse(options):
+    """
+    Construct a Filter from the options of a log stream section.  The
+    recognized options are removed from the dictionary.
+
+    :param options: A dictionary of the section's options.
+
+    :returns: A Filter, or None if no filtering options are present.
+    """
+
+    # Remove all the options first, so none are left over on error
+    values = dict((opt, options.pop(opt)) for opt in _options
+                  if opt in options)
+    if not values:
+        return None
+
+    statuses = []
+    for code in _split(values.get('exclude_status', '')):
+        try:
+            statuses.append(int(code))
+        except ValueError:
+            raise ValueError("invalid status code %r" % code)
+
+    return Filter(paths=_split(values.get('exclude_paths', '')),
+                  methods=_split(values.get('exclude_methods', '')),
+                  headers=_split(values.get('exclude_headers', '')),
+                  statuses=statuses)
+
+
+class Filter(object):
+    def __init__(self, paths=(), methods=(), headers=(), statuses=()):
+        """
+        Initialize a Filter.  A Filter excludes requests from a log
+        stream.  Requests may be excluded based on the request alone,
+        before any formatting is done, or based on the response
+        status code, before the log message is formatted.
+
+        :param paths: A list of path prefixes, e.g., "/healthcheck".
+                      Requests for paths (including the script name)
+                      beginning with any of the prefixes are
+                      excluded.
+        :param methods: A list of request methods to exclude, e.g.,
+                        "OPTIONS".
+        :param headers: A list of the names of request headers.
+                        Requests which include any of the headers are
+                        excluded.
+        :param statuses: A list of response status codes to exclude.
+        """
+
+        # All the path prefixes are matched by a single regular
+        # expression
+        self.paths = list(paths)
+        self.path_re = (re.compile('|'.join(re.escape(path)
+                                            for path in self.paths))
+                        if self.paths else None)
+        self.methods = frozenset(method.upper() for method in methods)
+        self.header_keys = frozenset(wsgi.header_key(header)
+                                     for header in headers)
+        self.statuses = frozenset(statuses)
+
+    def __call__(self, environ, draws=None):
+        """
+        Decide whether a request should be logged, based on the
+        request alone.
+
+        :param environ: The WSGI environment.
+        :param draws: Ignored; allows a Filter to be consulted in the
+                      same way as a Sampler.
+
+        :returns: True if the request should be logged, False if it
+                  should be excluded.
+        """
+
+        if self.path_re and self.path_re.match(
+                environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')):
+            return False
+
+        if (self.methods and
+                environ.get('REQUEST_METHOD', 'GET') in self.methods):
+            return False
+
+        for key in self.header_keys:
+            if key in environ:
+                return False
+
+        return True
+
+    def accept(self, status):
+        """
+        Decide whether a request should be logged, based on the
+        response status code.
+
+        :param status: The response status code, as an integer.
+
+        :returns: True if the request should be logged, False if it
+                  should be excluded.
+        """
+
+        return status not in self.statuses
+
+    @property
+    def request_filter(self):
+        """
+        True if the Filter excludes any requests based on the request
+        alone.
+        """
+
+        return bool(self.path_re or self.methods or self.header_keys)
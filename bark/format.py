@@ -13,237 +13,465 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import pkg_resources
+import os
+import re
+import time
 
 from bark import conversions
+from bark import entrypoints
 
 
-class ParseState(object):
-    def __init__(self, fmt, format):
-        """
-        Initialize a parser state.
+# The maximum number of status codes for which a conditional format
+# will keep a specialized render function
+_max_status_renders = 100
 
-        :param fmt: An initial Format instance to parse into.
-        :param format: The full format string.
-        """
 
-        self.fmt = fmt
-        self.format = format
+# The modifiers of a conversion: any number of '<' and '>' (ignored,
+# for Apache compatibility) and '!' (reject the listed codes), any
+# number of 3-digit status codes, optionally separated by ',', and at
+# most one {parameter}.
+_modifiers = r'''
+    [<>!]*
+    (?:
+        \{(?P<param1>[^}]*)\}[<>!]*
+        (?:\d{3}(?:[<>!,]|\d{3})*)?
+      | \d{3}(?:[<>!,]|\d{3})*
+        (?:\{(?P<param2>[^}]*)\}(?:[<>!,]|\d{3})*)?
+    )?
+'''
 
-        self.state = ['string']
-        self.str_begin = 0
-        self.param_begin = None
-        self.conv_begin = None
-        self.modifier = None
-        self.codes = []
-        self.reject = False
-        self.ignore = 0
-        self.code_last = False
+# Tokenizes a format string into text, "%%", escapes, and
+# conversions.  The modifiers are matched within a lookahead so that
+# they are never backtracked into; a conversion which is not followed
+# by a conversion name is a bad format string.
+_token_re = re.compile(r'''
+    (?P<text>[^%\\]+)
+  | %%
+  | \\(?P<escape>.)?
+  | %(?=(?P<mods>''' + _modifiers + r'''))(?P=mods)
+    (?:\((?P<name>[^)]*)\)|(?P<chr>[^(]))?
+''', re.VERBOSE | re.DOTALL | re.UNICODE)
 
-    def __eq__(self, other):
-        """
-        Compare the parser state to a desired state.
+_code_re = re.compile(r'\d{3}', re.UNICODE)
 
-        :param other: The other state.
-        """
 
-        return self.state[-1] == other
+def _constant(conv, status=None):
+    """
+    Determine whether a conversion may be folded into the static text
+    of a compiled format.  Unless the response status code is known,
+    conversions with status code restrictions are never folded.
 
-    def pop_state(self, idx=None):
-        """
-        Pops off the most recent state.
+    :param conv: A bark.conversions.Conversion instance.
+    :param status: The response status code the format is being
+                   compiled for, or None if the format must handle
+                   any status code.
 
-        :param idx: If provided, specifies the index at which the next
-                    string begins.
-        """
+    :returns: The constant result of the conversion, or None if the
+              conversion must be called for each request.
+    """
 
-        self.state.pop()
+    mod = conv.modifier
+    if status is None:
+        if mod.codes or not mod.reject:
+            return None
+    elif not mod.accept(status):
+        return '-'
+    return conv.constant()
 
-        if idx is not None:
-            self.str_begin = idx
 
-    def check_ignore(self):
-        """
-        Returns True if the character should be ignored.
-        """
+def _conditional(convs):
+    """
+    Determine whether any of a list of conversions has status code
+    restrictions.
 
-        if self.ignore:
-            self.ignore -= 1
-            return True
-        return False
+    :param convs: A list of bark.conversions.Conversion instances.
 
-    def set_ignore(self, count):
-        """
-        Sets the number of characters to ignore.
-        """
+    :returns: True if the output depends on the response status code.
+    """
 
-        self.ignore += count
+    return any(conv.modifier.codes or not conv.modifier.reject
+               for conv in convs)
 
-    def add_text(self, end, next=None):
-        """
-        Adds the text from string beginning to the specified ending
-        index to the format.
 
-        :param end: The ending index of the string.
-        :param next: The next string begin index.  If None, the string
-                     index will not be updated.
-        """
+def _per_process(convs):
+    """
+    Determine whether any of the constants folded from a list of
+    conversions may only be valid in the current process.
 
-        if self.str_begin != end:
-            self.fmt.append_text(self.format[self.str_begin:end])
+    :param convs: A list of bark.conversions.Conversion instances.
 
-        if next is not None:
-            self.str_begin = next
+    :returns: True if the compiled format must be recompiled after a
+              fork.
+    """
 
-    def add_escape(self, idx, char):
-        """
-        Translates and adds the escape sequence.
+    return any(conv.per_process and conv.constant() is not None
+               for conv in convs)
 
-        :param idx: Provides the ending index of the escape sequence.
-        :param char: The actual character that was escaped.
-        """
 
-        self.fmt.append_text(self.fmt._unescape.get(
-            self.format[self.str_begin:idx], char))
+def _defined_by(cls, attr):
+    """
+    Determine how far down the method resolution order of a class an
+    attribute is defined.
 
-    def set_param(self, idx):
-        """
-        Adds the parameter to the conversion modifier.
-
-        :param idx: Provides the ending index of the parameter string.
-        """
-
-        self.modifier.set_param(self.format[self.param_begin:idx])
-
-    def set_conversion(self, idx):
-        """
-        Adds the conversion to the format.
-
-        :param idx: The ending index of the conversion name.
-        """
+    :param cls: The class to search.
+    :param attr: The name of the attribute.
 
-        # First, determine the name
-        if self.conv_begin:
-            name = self.format[self.conv_begin:idx]
-        else:
-            name = self.format[idx]
+    :returns: The index in the class's method resolution order of the
+              class defining the attribute, or None if no class
+              defines it.
+    """
 
-        # Next, add the status code modifiers, as needed
-        if self.codes:
-            self.modifier.set_codes(self.codes, self.reject)
+    for idx, klass in enumerate(cls.__mro__):
+        if attr in klass.__dict__:
+            return idx
+
+    return None
 
-        # Append the conversion to the format
-        self.fmt.append_conv(self.fmt._get_conversion(name, self.modifier))
 
-        # Clear the conversion data
-        self.param_begin = None
-        self.conv_begin = None
-        self.modifier = None
-        self.codes = []
-        self.reject = False
-        self.code_last = False
+def _shares_start(conv):
+    """
+    Determine whether a conversion may be given the shared request
+    start time instead of being prepared.  A subclass which overrides
+    prepare() below the class declaring needs_start must be prepared
+    normally, since its prepare() may compute more than the start
+    time.
 
-    def set_reject(self):
-        """
-        Sets the reject flag for the conversion being considered.
-        """
-
-        self.reject = True
-
-    def set_code(self, idx):
-        """
-        Sets a code to be filtered on for the conversion.  Note that
-        this also sets the 'code_last' attribute and configures to
-        ignore the remaining characters of the code.
+    :param conv: A bark.conversions.Conversion instance.
 
-        :param idx: The index at which the code _begins_.
+    :returns: True if the conversion only needs the start time.
+    """
 
-        :returns: True if the code is valid, False otherwise.
-        """
-
-        code = self.format[idx:idx + 3]
-
-        if len(code) < 3 or not code.isdigit():
-            return False
-
-        self.codes.append(int(code))
-        self.ignore = 2
-        self.code_last = True
-        return True
-
-    def end_state(self):
-        """
-        Wrap things up and add any final string content.
-        """
+    if not conv.needs_start:
+        return False
 
-        # Make sure we append any trailing text
-        if self.str_begin != len(self.format):
-            if len(self.state) > 1 or self.state[-1] != 'string':
-                self.fmt.append_text(
-                    "(Bad format string; ended in state %r)" % self.state[-1])
+    cls = type(conv)
+    return _defined_by(cls, 'needs_start') <= _defined_by(cls, 'prepare')
+
+
+def _prepare_plan(convs):
+    """
+    Determine which of a list of conversions must be prepared for
+    each request.  Conversions which only need the time the request
+    started share a single timestamp; conversions which do not
+    override Conversion.prepare() are not prepared at all, and their
+    data is None.
+
+    :param convs: A list of bark.conversions.Conversion instances.
+
+    :returns: A tuple of the data tuple to use if no conversion needs
+              preparation, a tuple of the indexes of the conversions
+              needing the start time, and a tuple of the indexes and
+              conversions which must be prepared.
+    """
+
+    timed = []
+    prepared = []
+    for idx, conv in enumerate(convs):
+        if _shares_start(conv):
+            timed.append(idx)
+        elif (getattr(conv.prepare, 'im_func', None) is not
+              conversions.Conversion.prepare.im_func):
+            prepared.append((idx, conv))
+
+    return (None,) * len(convs), tuple(timed), tuple(prepared)
+
+
+def _prepare(plan, request, start=None):
+    """
+    Prepare the data for a list of conversions.
+
+    :param plan: The plan returned by _prepare_plan().
+    :param request: The webob Request object describing the request.
+    :param start: The data for the conversions which need the time
+                  the request started.  If None, and any conversion
+                  needs it, it will be created.
+
+    :returns: A tuple of the values needed by the conversions.
+    """
+
+    empty, timed, prepared = plan
+
+    # Most formats need no preparation at all
+    if not (timed or prepared):
+        return empty
+
+    data = list(empty)
+    if timed:
+        if start is None:
+            start = {'start': time.time()}
+        for idx in timed:
+            data[idx] = start
+    for idx, conv in prepared:
+        data[idx] = conv.prepare(request)
+
+    return tuple(data)
+
+
+def _dispatch_status(compile_status, generic):
+    """
+    Construct a render function which dispatches to a render function
+    specialized for the response status code.  Specialized render
+    functions are compiled the first time a status code is seen, and
+    have all status code restrictions resolved, so that they never
+    consult the conversion modifiers.
+
+    :param compile_status: A callable taking a status code and
+                           returning a render function specialized
+                           for that status code.
+    :param generic: A render function able to handle any status
+                    code, used once specialized render functions have
+                    been compiled for _max_status_renders status
+                    codes.
+
+    :returns: A callable taking the request, the response, and a
+              data tuple.
+    """
+
+    renders = {}
+
+    def render(request, response, data):
+        status = response.status_code
+        try:
+            func = renders[status]
+        except KeyError:
+            if len(renders) < _max_status_renders:
+                func = renders[status] = compile_status(status)
             else:
-                self.fmt.append_text(self.format[self.str_begin:])
-
-        # Convenience return
-        return self.fmt
-
-    def conversion(self, idx):
-        """
-        Switches into the 'conversion' state, used to parse a %
-        conversion.
-
-        :param idx: The format string index at which the conversion
-                    begins.
-        """
-
-        self.state.append('conversion')
-        self.str_begin = idx
-        self.param_begin = None
-        self.conv_begin = None
-        self.modifier = conversions.Modifier()
-        self.codes = []
-        self.reject = False
-        self.code_last = False
-
-    def escape(self, idx):
-        """
-        Switches into the 'escape' state, used to parse \ escapes.
-
-        :param idx: The format string index at which the escape
-                    begins.
-        """
+                func = generic
+        return func(request, response, data)
+
+    # Expose the specialized render functions
+    render.renders = renders
+
+    return render
+
+
+def _filter_status(render, accepts):
+    """
+    Wrap a render function for several formats, so that the results
+    for formats which do not accept the response status code are
+    replaced with None.
+
+    :param render: A callable taking the request, the response, and a
+                   data tuple, and returning a tuple of formatted
+                   strings.
+    :param accepts: A list, aligned with the results, of callables
+                    taking a status code and returning True if the
+                    format accepts it, or None if it accepts any
+                    status code.
+
+    :returns: A callable taking the request, the response, and a
+              data tuple.
+    """
+
+    def render_filtered(request, response, data):
+        status = response.status_code
+        return tuple(None if accept and not accept(status) else result
+                     for accept, result in zip(accepts,
+                                               render(request, response,
+                                                      data)))
+
+    return render_filtered
+
+
+def _gen_call(namespace, conv, idx, status=None):
+    """
+    Generate the source for an expression calling a conversion.
+    Conversions which are accepted for every status code, or which
+    are being compiled for a known status code, are called without
+    consulting their modifiers.
+
+    :param namespace: The namespace dictionary for the generated
+                      function.  The conversion's convert() method
+                      and, if needed, its modifier's accept() method
+                      are added to it.
+    :param conv: The bark.conversions.Conversion instance.
+    :param idx: The index of the conversion's data in the data tuple.
+    :param status: The response status code the conversion is being
+                   compiled for, or None.
+
+    :returns: A tuple of the expression source and a boolean
+              indicating whether the expression refers to the
+              response status code.
+    """
+
+    namespace['_c%d' % idx] = conv.convert
+    call = '_c%d(request, response, data[%d])' % (idx, idx)
+
+    # Only consult the modifier if it could reject the conversion
+    if status is None and _conditional([conv]):
+        namespace['_a%d' % idx] = conv.modifier.accept
+        return "(%s if _a%d(status) else '-')" % (call, idx), True
+
+    return call, False
+
+
+def _gen_template(namespace, name, convs, args, status=None):
+    """
+    Generate the source for an expression assembling a formatted
+    string.  Static text and constant conversions are folded into a
+    single template string, and all the other conversion results are
+    interpolated into the template in one operation.
+
+    :param namespace: The namespace dictionary for the generated
+                      function.  The template string is added to it.
+    :param name: The name to give the template string.
+    :param convs: A list of bark.conversions.Conversion instances.
+    :param args: An iterator yielding the source of the expression
+                 for each conversion that is not a constant.
+    :param status: The response status code the template is being
+                   compiled for, or None.
+
+    :returns: The expression source.
+    """
+
+    text = []
+    template = []
+    values = []
+    for conv in convs:
+        # Static text gets folded into the template
+        const = _constant(conv, status)
+        if const is not None:
+            text.append(const)
+            template.append(const.replace('%', '%%'))
+        else:
+            text.append('%s')
+            template.append('%s')
+            values.append(next(args))
+
+    # With no conversions, it's just a string
+    if not values:
+        namespace[name] = ''.join(text)
+        return name
+
+    namespace[name] = ''.join(template)
+    return '%s %% (%s,)' % (name, ', '.join(values))
+
+
+def _gen_function(namespace, conditional, body):
+    """
+    Generate a render function.  Everything in the namespace is bound
+    as a default argument, so that lookups are of local variables.
+
+    :param namespace: The namespace dictionary for the generated
+                      function.
+    :param conditional: If True, the function body refers to the
+                        response status code.
+    :param body: A list of the source lines of the function body.
+
+    :returns: A callable taking the request, the response, and a
+              data tuple.
+    """
+
+    source = ['def render(request, response, data, %s):' % ', '.join(
+        '%s=%s' % (name, name) for name in sorted(namespace))]
+    if conditional:
+        source.append('status = response.status_code')
+    source.extend(body)
+
+    exec('\n    '.join(source), namespace)
+    return namespace['render']
+
+
+def _compile_render(convs, status=None):
+    """
+    Generate a render function for a list of conversions.
+
+    :param convs: A list of bark.conversions.Conversion instances.
+    :param status: If not None, the generated function is specialized
+                   for responses with this status code.
+
+    :returns: A callable taking the request, the response, and the
+              data tuple returned by Format.prepare(), and returning
+              the formatted string.
+    """
+
+    namespace = {}
+    args = []
+    conditional = False
+    for idx, conv in enumerate(convs):
+        if _constant(conv, status) is None:
+            call, cond = _gen_call(namespace, conv, idx, status)
+            args.append(call)
+            conditional |= cond
+
+    expr = _gen_template(namespace, '_tmpl', convs, iter(args), status)
+
+    return _gen_function(namespace, conditional, ['return %s' % expr])
+
+
+def _compile_shared(conv_lists, status=None, skip=()):
+    """
+    Generate a render function for several lists of conversions at
+    once.  Identical conversions appearing in more than one list (or
+    more than once in the same list) are computed only once, and the
+    result is shared by all the formatted strings.
+
+    :param conv_lists: A list of lists of bark.conversions.Conversion
+                       instances.
+    :param status: If not None, the generated function is specialized
+                   for responses with this status code.  The list of
+                   unique conversions does not depend on the status
+                   code.
+    :param skip: A set of the indexes of lists of conversions which
+                 are not to be formatted.  Their result is None, and
+                 conversions only they use are never called.  The
+                 list of unique conversions does not depend on this
+                 set.
+
+    :returns: A tuple of a list of the unique conversions and a
+              callable taking the request, the response, and a data
+              list (aligned with the list of unique conversions), and
+              returning a tuple of the formatted strings (aligned with
+              conv_lists).
+    """
+
+    namespace = {}
+    unique = []
+    body = []
+    conditional = False
+    indexes = {}
+    computed = set()
+    exprs = []
+    for num, convs in enumerate(conv_lists):
+        args = []
+        for conv in convs:
+            if _constant(conv) is not None:
+                continue
 
-        self.state.append('escape')
-        self.str_begin = idx
+            # Compute each unique conversion only once; equal
+            # conversions produce the same result
+            if conv not in indexes:
+                indexes[conv] = len(unique)
+                unique.append(conv)
 
-    def param(self, idx):
-        """
-        Switches into the 'param' state, used to parse parameters
-        enclosed by curly braces ('{}') within conversions.
+            if num in skip or _constant(conv, status) is not None:
+                continue
 
-        :param idx: The format string index at which the parameter
-                    name begins.
-        """
+            idx = indexes[conv]
+            if idx not in computed:
+                computed.add(idx)
+                call, cond = _gen_call(namespace, conv, idx, status)
+                body.append('_v%d = %s' % (idx, call))
+                conditional |= cond
 
-        self.state.append('param')
-        self.param_begin = idx
+            args.append('_v%d' % idx)
 
-    def conv(self, idx):
-        """
-        Switches into the 'conv' state, used to parse conversion
-        specifier names enclosed by parentheses ('()') within
-        conversions.
+        if num in skip:
+            exprs.append('None')
+        else:
+            exprs.append(_gen_template(namespace, '_tmpl%d' % num,
+                                       convs, iter(args), status))
 
-        :param idx: The format string index at which the conversion
-                    name begins.
-        """
+    body.append('return (%s)' % ''.join('%s, ' % expr for expr in exprs))
 
-        self.state.append('conv')
-        self.conv_begin = idx
+    return unique, _gen_function(namespace, conditional, body)
 
 
 class Format(object):
     _conversion_cache = {}
+    _interned = {}
+    _parse_cache = {}
     _unescape = {
         '\\n': '\n',
         '\\t': '\t',
@@ -260,36 +488,79 @@ class Format(object):
         :param modifier: The format modifier applied to this
                          conversion.
 
-        :returns: An instance of bark.conversions.Conversion.
+        :returns: An instance of bark.conversions.Conversion.  Equal
+                  conversions are shared, so the returned instance
+                  must not be modified.
         """
 
         # Do we need to look up the conversion?
         if conv_chr not in cls._conversion_cache:
-            for ep in pkg_resources.iter_entry_points('bark.conversion',
-                                                      conv_chr):
-                try:
-                    # Load the conversion class
-                    cls._conversion_cache[conv_chr] = ep.load()
-                    break
-                except (ImportError, pkg_resources.UnknownExtra):
-                    # Couldn't load it; odd...
-                    continue
-            else:
-                # Cache the negative result
-                cls._conversion_cache[conv_chr] = None
+            # Bark's own conversions don't need to be looked up
+            factory = conversions.registry.get(conv_chr)
+            if factory is None:
+                for ep in entrypoints.iter_entry_points('bark.conversion',
+                                                        conv_chr):
+                    try:
+                        # Load the conversion class
+                        factory = ep.load()
+                        break
+                    except ImportError:
+                        # Couldn't load it; odd...
+                        continue
+
+            # Cache the result, even if negative
+            cls._conversion_cache[conv_chr] = factory
 
         # Handle negative caching
-        if cls._conversion_cache[conv_chr] is None:
+        factory = cls._conversion_cache[conv_chr]
+        if factory is None:
             return conversions.StringConversion("(Unknown conversion '%%%s')" %
                                                 conv_chr)
 
-        # Instantiate the conversion
-        return cls._conversion_cache[conv_chr](conv_chr, modifier)
+        # Instantiate the conversion, unless we already have an
+        # equal one
+        key = (factory, conv_chr, modifier)
+        if key not in cls._interned:
+            cls._interned[key] = factory(conv_chr, modifier)
+        return cls._interned[key]
 
     @classmethod
-    def parse(cls, format):
+    def parse(cls, format, compile=True):
         """
         Parse a format string.  Factory function for the Format class.
+        Format strings are only parsed--and compiled--once; Formats
+        parsed from the same format string share their conversions
+        and compiled render function.
+
+        :param format: The format string to parse.
+        :param compile: If True (the default), the resulting Format
+                        will be compiled into a single render
+                        function.  If False, the Format will be
+                        interpreted conversion by conversion.
+
+        :returns: An instance of class Format.
+        """
+
+        # Look up the parsed format
+        if format not in cls._parse_cache:
+            cls._parse_cache[format] = cls._parse(format)
+        parsed = cls._parse_cache[format]
+
+        # Copy it, so appending to the result doesn't affect the cache
+        fmt = cls()
+        fmt.conversions = list(parsed.conversions)
+        if compile:
+            if parsed._render is None:
+                parsed.compile()
+            fmt._render = parsed._render
+            fmt._pid = parsed._pid
+
+        return fmt
+
+    @classmethod
+    def _parse(cls, format):
+        """
+        Parse a format string.
 
         :param format: The format string to parse.
 
@@ -302,67 +573,50 @@ class Format(object):
         if not format:
             return fmt
 
-        # Initialize the state for parsing
-        state = ParseState(fmt, format)
-
-        # Loop through the format string with a state-based parser
-        for idx, char in enumerate(format):
-            # Some characters get ignored
-            if state.check_ignore():
-                continue
-
-            if state == 'string':
-                if char == '%':
-                    # Handle '%%'
-                    if format[idx:idx + 2] == '%%':
-                        # Add one % to the string context
-                        state.add_text(idx + 1, idx + 2)
-                        state.set_ignore(1)
+        for match in _token_re.finditer(format):
+            text, escape, mods = match.group('text', 'escape', 'mods')
+
+            if text is not None:
+                fmt.append_text(text)
+            elif mods is None:
+                token = match.group()
+                if token == '%%':
+                    fmt.append_text('%')
+                elif escape is None:
+                    fmt.append_text("(Bad format string; ended in state %r)" %
+                                    'escape')
+                    break
+                else:
+                    fmt.append_text(cls._unescape.get(token, escape))
+            else:
+                # Pick apart the conversion
+                param = match.group('param1')
+                if param is None:
+                    param = match.group('param2')
+                name, char = match.group('name', 'chr')
+                if name is None:
+                    name = char
+
+                # Conversions must be complete
+                if name is None or (char == '{' and param is None):
+                    if char == '{':
+                        state = 'param'
+                    elif format.startswith('(', match.end()):
+                        state = 'conv'
                     else:
-                        state.add_text(idx)
-                        state.conversion(idx)
-                elif char == '\\':
-                    state.add_text(idx)
-                    state.escape(idx)
-            elif state == 'escape':
-                state.add_escape(idx + 1, char)
-                state.pop_state(idx + 1)
-            elif state == 'param':
-                if char == '}':
-                    state.set_param(idx)
-                    state.pop_state()
-            elif state == 'conv':
-                if char == ')':
-                    state.set_conversion(idx)
-                    state.pop_state()  # now in 'conversion'
-                    state.pop_state(idx + 1)  # now in 'string'
-            else:  # state == 'conversion'
-                if char in '<>':
-                    # Allowed for Apache compatibility, but ignored
-                    continue
-                elif char == '!':
-                    state.set_reject()
-                    continue
-                elif char == ',' and state.code_last:
-                    # Syntactically allowed ','
-                    continue
-                elif char.isdigit():
-                    # True if the code is valid
-                    if state.set_code(idx):
-                        continue
-                elif char == '{' and state.param_begin is None:
-                    state.param(idx + 1)
-                    continue
-                elif char == '(' and state.conv_begin is None:
-                    state.conv(idx + 1)
-                    continue
+                        state = 'conversion'
+                    fmt.append_text("(Bad format string; ended in state %r)" %
+                                    state)
+                    break
+
+                if param is not None:
+                    mods = mods.replace('{%s}' % param, '', 1)
+                codes = [int(code) for code in _code_re.findall(mods)]
+                modifier = conversions.Modifier(codes, '!' in mods, param)
 
-                # OK, we have a complete conversion
-                state.set_conversion(idx)
-                state.pop_state(idx + 1)
+                fmt.append_conv(cls._get_conversion(name, modifier))
 
-        # Finish the parse and return the completed format
-        return state.end_state()
+        return fmt
 
     def __init__(self):
         """
@@ -370,6 +624,9 @@ class Format(object):
         """
 
         self.conversions = []
+        self._render = None
+        self._pid = None
+        self._plan = None
 
     def __str__(self):
         """
@@ -385,13 +642,19 @@ class Format(object):
         :param text: The text to append.
         """
 
+        # Conversions may be shared, so replace rather than modify
         if (self.conversions and
                 isinstance(self.conversions[-1],
                            conversions.StringConversion)):
-            self.conversions[-1].append(text)
+            self.conversions[-1] = conversions.StringConversion(
+                self.conversions[-1].string + text)
         else:
             self.conversions.append(conversions.StringConversion(text))
 
+        # Any compiled render function and prepare plan are now stale
+        self._render = None
+        self._plan = None
+
     def append_conv(self, conv):
         """
         Append a conversion to the Format.
@@ -401,22 +664,56 @@ class Format(object):
 
         self.conversions.append(conv)
 
-    def prepare(self, request):
+        # Any compiled render function and prepare plan are now stale
+        self._render = None
+        self._plan = None
+
+    def compile(self):
         """
-        Performs any preparations necessary for the Format.
+        Compile the Format into a single render function, which will
+        be used by the convert() method.  The compiled Format
+        produces output identical to the interpreted Format.  Note
+        that appending text or conversions to the Format discards the
+        compiled render function.  Conversions which produce the same
+        result for every request, such as "%P", are folded into the
+        static text; if any of these depend on the process, the
+        Format is recompiled when used in a new process.  If any
+        conversion is restricted to certain status codes, a render
+        function specialized for each status code is compiled the
+        first time that status code is seen.
+
+        :returns: The Format, for convenience.
+        """
+
+        convs = self.conversions
+        self._render = _compile_render(convs)
+        if _conditional(convs):
+            self._render = _dispatch_status(
+                lambda status: _compile_render(convs, status), self._render)
+        self._pid = os.getpid() if _per_process(self.conversions) else None
+        return self
+
+    def prepare(self, request, start=None):
+        """
+        Performs any preparations necessary for the Format.  Only
+        the conversions which override Conversion.prepare() are
+        prepared.
 
         :param request: The webob Request object describing the
                         request.
+        :param start: Optional data for the conversions which need
+                      the time the request started, to share it with
+                      other Formats.
 
-        :returns: A list of dictionary values needed by the convert()
-                  method.
+        :returns: A tuple of dictionary values needed by the
+                  convert() method.  The value for a conversion
+                  which needs no preparation is None.
         """
 
-        data = []
-        for conv in self.conversions:
-            data.append(conv.prepare(request))
+        if self._plan is None:
+            self._plan = _prepare_plan(self.conversions)
 
-        return data
+        return _prepare(self._plan, request, start)
 
     def convert(self, request, response, data):
         """
@@ -426,13 +723,20 @@ class Format(object):
                         request.
         :param response: The webob Response object describing the
                          response.
-        :param data: The data dictionary list returned by the
+        :param data: The data dictionary tuple returned by the
                      prepare() method.
 
         :returns: A string, the results of which are the desired
                   conversion.
         """
 
+        # Use the compiled render function, if we have one
+        if self._render is not None:
+            # Folded constants may be stale after a fork
+            if self._pid is not None and self._pid != os.getpid():
+                self.compile()
+            return self._render(request, response, data)
+
         result = []
         for conv, datum in zip(self.conversions, data):
             # Only include conversion if it's allowed
@@ -442,3 +746,107 @@ class Format(object):
                 result.append('-')
 
         return ''.join(result)
+
+
+class FormatSet(object):
+    def __init__(self, formats, accepts=None):
+        """
+        Initialize a FormatSet.  A FormatSet formats the same request
+        and response with several Formats at once.  If all the
+        Formats are compiled, conversions which appear in more than
+        one Format are computed only once per request, and their
+        results are shared; otherwise, each Format is interpreted
+        independently.
+
+        :param formats: A sequence of Format instances.
+        :param accepts: An optional sequence, aligned with the
+                        Formats, of callables taking a response status
+                        code and returning True if the Format should
+                        be used for responses with that status code,
+                        or None if the Format should always be used.
+                        Formats not used for a response produce None,
+                        and conversions only they use are never
+                        called.
+        """
+
+        self.formats = list(formats)
+        self.accepts = (list(accepts) if accepts is not None else
+                        [None] * len(self.formats))
+        self.conversions = None
+        self._render = None
+        self._pid = None
+        self._plan = None
+
+        if all(fmt._render is not None for fmt in self.formats):
+            self.compile()
+
+    def compile(self):
+        """
+        Compile the Formats into a single render function.  As with
+        Format.compile(), the FormatSet is recompiled when used in a
+        new process if any of the folded constants depend on the
+        process.
+        """
+
+        conv_lists = [fmt.conversions for fmt in self.formats]
+        accepts = self.accepts
+        self.conversions, self._render = _compile_shared(conv_lists)
+        self._plan = _prepare_plan(self.conversions)
+        if any(accepts) or any(_conditional(convs) for convs in conv_lists):
+            def compile_status(status):
+                skip = frozenset(idx for idx, accept in enumerate(accepts)
+                                 if accept and not accept(status))
+                return _compile_shared(conv_lists, status, skip)[1]
+
+            generic = self._render
+            if any(accepts):
+                generic = _filter_status(generic, accepts)
+            self._render = _dispatch_status(compile_status, generic)
+        if any(_per_process(convs) for convs in conv_lists):
+            self._pid = os.getpid()
+        else:
+            self._pid = None
+
+    def prepare(self, request):
+        """
+        Performs any preparations necessary for the Formats.
+
+        :param request: The webob Request object describing the
+                        request.
+
+        :returns: A tuple of values needed by the convert() method.
+        """
+
+        if self._render is None:
+            # All the Formats share the request start time
+            start = {'start': time.time()}
+            return tuple(fmt.prepare(request, start) for fmt in self.formats)
+
+        return _prepare(self._plan, request)
+
+    def convert(self, request, response, data):
+        """
+        Performs the desired formatting.
+
+        :param request: The webob Request object describing the
+                        request.
+        :param response: The webob Response object describing the
+                         response.
+        :param data: The tuple returned by the prepare() method.
+
+        :returns: A tuple of strings, the results of formatting with
+                  each of the Formats, in order.  The result is None
+                  for Formats which do not accept the response status
+                  code.
+        """
+
+        if self._render is None:
+            return tuple(None if accept and not accept(response.status_code)
+                         else fmt.convert(request, response, datum)
+                         for fmt, accept, datum in zip(self.formats,
+                                                       self.accepts, data))
+
+        # Folded constants may be stale after a fork
+        if self._pid is not None and self._pid != os.getpid():
+            self.compile()
+        return self._render(request, response, data)
@@ -13,17 +13,44 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
+import codecs
+import errno
 import functools
 import inspect
 import logging
 import logging.handlers
+import os
+import Queue
 import sys
+import threading
 
-import pkg_resources
+from bark import entrypoints
 
 
 LOG = logging.getLogger('bark')
 
+# Handlers which must be closed when the process exits, so that no
+# queued or buffered messages are lost; a handler removes itself when
+# it is closed, so that it is not kept alive needlessly
+_exit_handlers = set()
+
+# Serializes restarting handlers after a fork(); the handlers' own
+# locks may have been held by threads which do not exist in the child
+_restart_lock = threading.Lock()
+
+
+def _close_at_exit():
+    """
+    Close the handlers which are still open when the process exits.
+    """
+
+    for handler in list(_exit_handlers):
+        handler.close()
+
+
+atexit.register(_close_at_exit)
+
 
 class SimpleFormatter(logging.Formatter):
     def format(self, record):
@@ -69,6 +96,165 @@ def wrap_log_handler(handler):
     return wrapper
 
 
+class StreamWriter(object):
+    """
+    A log handler which writes log messages to a stream, one per
+    line.  This produces the same output as wrapping a
+    logging.StreamHandler with wrap_log_handler(), but writes
+    directly to the stream, avoiding the cost of constructing and
+    formatting a logging.LogRecord for each message.
+    """
+
+    def __init__(self, stream):
+        """
+        Initialize a StreamWriter.
+
+        :param stream: The stream to write log messages to.
+        """
+
+        self.stream = stream
+
+    def write(self, msg):
+        """
+        Write a message to the stream.  Follows the Unicode handling
+        of logging.StreamHandler.
+
+        :param msg: The message to write.
+        """
+
+        stream = self.stream
+        try:
+            if isinstance(msg, unicode) and getattr(stream, 'encoding', None):
+                try:
+                    stream.write(u'%s\n' % msg)
+                except UnicodeEncodeError:
+                    stream.write((u'%s\n' % msg).encode(stream.encoding))
+            else:
+                stream.write('%s\n' % msg)
+        except UnicodeError:
+            stream.write('%s\n' % msg.encode('UTF-8'))
+        stream.flush()
+
+    def __call__(self, msg):
+        """
+        Emit a message.  As with the standard logging handlers,
+        errors are logged rather than raised.
+
+        :param msg: The message to emit.
+        """
+
+        try:
+            self.write(msg)
+        except Exception:
+            LOG.exception("Failed to emit log message")
+
+
+class FileWriter(StreamWriter):
+    """
+    A log handler which writes log messages to a named file.  The
+    direct write counterpart of logging.FileHandler.
+    """
+
+    def __init__(self, filename, mode='a', encoding=None, delay=False):
+        """
+        Initialize a FileWriter.
+
+        :param filename: The name of the file to write to.
+        :param mode: The mode to open the file with.
+        :param encoding: The character encoding of the file, if any.
+        :param delay: If True, the file is not opened until the
+                      first message is written.
+        """
+
+        self.filename = os.path.abspath(filename)
+        self.mode = mode
+        self.encoding = encoding
+
+        super(FileWriter, self).__init__(None)
+        if not delay:
+            self.open()
+
+    def open(self):
+        """
+        Open the file.
+        """
+
+        if self.encoding is None:
+            self.stream = open(self.filename, self.mode)
+        else:
+            self.stream = codecs.open(self.filename, self.mode,
+                                      self.encoding)
+
+    def write(self, msg):
+        """
+        Write a message to the file, opening it if necessary.
+
+        :param msg: The message to write.
+        """
+
+        if self.stream is None:
+            self.open()
+
+        super(FileWriter, self).write(msg)
+
+
+class WatchedFileWriter(FileWriter):
+    """
+    A log handler which writes log messages to a named file.  If the
+    file has changed since the last log message was written, it will
+    be closed and reopened.  The direct write counterpart of
+    logging.handlers.WatchedFileHandler.
+    """
+
+    def __init__(self, filename, mode='a', encoding=None, delay=False):
+        """
+        Initialize a WatchedFileWriter.
+
+        :param filename: The name of the file to write to.
+        :param mode: The mode to open the file with.
+        :param encoding: The character encoding of the file, if any.
+        :param delay: If True, the file is not opened until the
+                      first message is written.
+        """
+
+        self.dev, self.ino = -1, -1
+        super(WatchedFileWriter, self).__init__(filename, mode=mode,
+                                                encoding=encoding,
+                                                delay=delay)
+
+    def open(self):
+        """
+        Open the file and remember its identity.
+        """
+
+        super(WatchedFileWriter, self).open()
+        sres = os.fstat(self.stream.fileno())
+        self.dev, self.ino = sres.st_dev, sres.st_ino
+
+    def write(self, msg):
+        """
+        Write a message to the file, first reopening it if it has
+        been moved or removed.
+
+        :param msg: The message to write.
+        """
+
+        if self.stream is not None:
+            try:
+                sres = os.stat(self.filename)
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+                sres = None
+
+            if not sres or sres.st_dev != self.dev or sres.st_ino != self.ino:
+                self.stream.flush()
+                self.stream.close()
+                self.stream = None
+
+        super(WatchedFileWriter, self).write(msg)
+
+
 def arg_types(**kwargs):
     """
     Mark the expected types of certain arguments.  Arguments for which
@@ -220,7 +406,7 @@ def stdout_handler(name, logname):
     Similar to logging.StreamHandler with a stream of sys.stdout.
     """
 
-    return wrap_log_handler(logging.StreamHandler(sys.stdout))
+    return StreamWriter(sys.stdout)
 
 
 def stderr_handler(name, logname):
@@ -230,7 +416,7 @@ def stderr_handler(name, logname):
     Similar to logging.StreamHandler with a stream of sys.stderr.
     """
 
-    return wrap_log_handler(logging.StreamHandler(sys.stderr))
+    return StreamWriter(sys.stderr)
 
 
 @arg_types(delay=boolean)
@@ -242,8 +428,7 @@ def file_handler(name, logname, filename, mode='a', encoding=None,
     Similar to logging.FileHandler.
     """
 
-    return wrap_log_handler(logging.FileHandler(
-        filename, mode=mode, encoding=encoding, delay=delay))
+    return FileWriter(filename, mode=mode, encoding=encoding, delay=delay)
 
 
 @arg_types(delay=boolean)
@@ -257,8 +442,209 @@ def watched_file_handler(name, logname, filename, mode='a', encoding=None,
     Similar to logging.handlers.WatchedFileHandler.
     """
 
-    return wrap_log_handler(logging.handlers.WatchedFileHandler(
-        filename, mode=mode, encoding=encoding, delay=delay))
+    return WatchedFileWriter(filename, mode=mode, encoding=encoding,
+                             delay=delay)
+
+
+class BufferedFileHandler(object):
+    """
+    A log handler which collects log messages in a buffer and writes
+    them to a file in large chunks.  Each chunk is written with a
+    single os.write() on a file descriptor opened with O_APPEND.  The
+    buffer is written out when it grows past a size threshold, at
+    regular intervals by a flusher thread, and on process exit.
+    Write errors never reach the caller; they are logged and counted
+    in the 'errors' attribute.
+    """
+
+    def __init__(self, filename, encoding=None, bufsize=65536,
+                 interval=1.0):
+        """
+        Initialize a BufferedFileHandler.
+
+        :param filename: The name of the file to write to.
+        :param encoding: The character encoding to use for unicode
+                         messages.  Defaults to UTF-8.
+        :param bufsize: The number of bytes to collect before writing
+                        them out.
+        :param interval: The maximum number of seconds a message may
+                         wait in the buffer.  If 0, the buffer is
+                         only written out when full or on exit.
+        """
+
+        self.filename = filename
+        self.encoding = encoding or 'utf-8'
+        self.bufsize = bufsize
+        self.interval = interval
+        self.closed = False
+        self.errors = 0
+
+        self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o666)
+
+        self.start()
+
+        # Make sure all buffered messages are written on exit
+        _exit_handlers.add(self)
+
+    def start(self):
+        """
+        Start the flusher thread, with an empty buffer and a fresh
+        lock.
+        """
+
+        self.lock = threading.Lock()
+        self.buf = []
+        self.buflen = 0
+        self.flushlen = self.bufsize
+        self.stop = threading.Event()
+        self.thread = None
+        self.pid = os.getpid()
+
+        if self.interval > 0 and not self.closed:
+            self.thread = threading.Thread(target=self._flusher,
+                                           args=(self.stop,),
+                                           name='bark-file-flusher')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _flusher(self, stop):
+        """
+        The body of the flusher thread.  Writes out the buffer every
+        'interval' seconds until told to stop.
+
+        :param stop: An event which will be set when the thread
+                     should stop.
+        """
+
+        while not stop.wait(self.interval):
+            self.flush()
+
+    def _failed(self):
+        """
+        Record a failure to write to the file.  Called from an
+        exception handler.
+        """
+
+        self.errors += 1
+        LOG.exception("Failed to write log messages to %r" % self.filename)
+
+    def _write(self, data):
+        """
+        Write data to the file, retrying partial writes.
+
+        :param data: The bytes to write.
+
+        :returns: The bytes which were not written, if the write
+                  failed; otherwise, an empty string.
+        """
+
+        try:
+            while data:
+                written = os.write(self.fd, data)
+                data = data[written:]
+        except Exception:
+            self._failed()
+
+        return data
+
+    def __call__(self, msg):
+        """
+        Add a message to the buffer, writing the buffer out if it has
+        grown large enough.
+
+        :param msg: The message to emit.
+        """
+
+        if isinstance(msg, unicode):
+            msg = msg.encode(self.encoding)
+        line = msg + '\n'
+
+        # The parent process owns anything already buffered, and
+        # threads do not survive a fork(), so start over; this must be
+        # done before the lock is touched
+        if self.pid != os.getpid():
+            with _restart_lock:
+                if self.pid != os.getpid():
+                    self.start()
+
+        with self.lock:
+            # Once closed, write messages directly
+            if self.closed:
+                self._write(line)
+                return
+
+            self.buf.append(line)
+            self.buflen += len(line)
+            if self.buflen >= self.flushlen:
+                self._flush()
+
+    def _flush(self):
+        """
+        Write out the buffer.  Must be called with the lock held.  If
+        the write fails, the unwritten messages are kept for the next
+        attempt, and the buffer must grow by another 'bufsize' bytes
+        before the next attempt from __call__(); once more than 16
+        times 'bufsize' bytes are waiting, they are discarded.
+        """
+
+        if self.buf:
+            data = self._write(''.join(self.buf))
+            if data and len(data) <= 16 * self.bufsize:
+                self.buf = [data]
+                self.buflen = len(data)
+                self.flushlen = self.buflen + self.bufsize
+            else:
+                self.buf = []
+                self.buflen = 0
+                self.flushlen = self.bufsize
+
+    def flush(self):
+        """
+        Write out any buffered messages.
+        """
+
+        if self.pid == os.getpid():
+            with self.lock:
+                self._flush()
+
+    def close(self):
+        """
+        Stop the flusher thread and write out any buffered messages.
+        The file remains open, and messages received after the handler
+        is closed are written directly.
+        """
+
+        if self.closed:
+            return
+        _exit_handlers.discard(self)
+
+        # The buffer and the lock of a handler which was never used
+        # since a fork() belong to the parent process
+        if self.pid != os.getpid():
+            self.closed = True
+            return
+
+        if self.thread:
+            self.stop.set()
+            self.thread.join()
+
+        with self.lock:
+            self._flush()
+            self.closed = True
+
+
+@arg_types(bufsize=int, interval=float)
+def buffered_file_handler(name, logname, filename, encoding=None,
+                          bufsize=65536, interval=1.0):
+    """
+    A Bark logging handler logging output to a named file.  Messages
+    are buffered and written out when 'bufsize' bytes have
+    accumulated, every 'interval' seconds, and on process exit.
+    """
+
+    return BufferedFileHandler(filename, encoding=encoding,
+                               bufsize=bufsize, interval=interval)
 
 
 @arg_types(maxBytes=int, backupCount=int, delay=boolean)
@@ -380,6 +766,246 @@ def http_handler(name, logname, host, url, method="GET"):
         host, url, method=method))
 
 
+class AsyncHandler(object):
+    """
+    A log handler which hands log messages off to a bounded queue.  A
+    dedicated writer thread takes the messages off the queue and
+    emits them with another handler, so that a slow log destination
+    does not delay the processing of requests.
+    """
+
+    # Marks the end of the messages for the writer thread
+    _stop = object()
+
+    def __init__(self, handler, maxsize=1000, overflow='block'):
+        """
+        Initialize an AsyncHandler and start its writer thread.
+
+        :param handler: The handler to emit the messages with.
+        :param maxsize: The maximum number of messages in the queue.
+        :param overflow: What to do with a message when the queue is
+                         full.  If "block", wait for room in the
+                         queue; if "drop-newest", discard the message;
+                         and if "drop-oldest", discard the oldest
+                         message in the queue to make room.
+        """
+
+        self.handler = handler
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.errors = 0
+        self.closing = False
+        self.closed = False
+
+        self.start()
+
+        # Make sure all queued messages are emitted on exit
+        _exit_handlers.add(self)
+
+    def start(self):
+        """
+        Start the writer thread, with a fresh queue and lock.  A
+        closed handler gets no writer thread.
+        """
+
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue(self.maxsize)
+        self.thread = None
+        self.pid = os.getpid()
+
+        if not self.closed:
+            self.thread = threading.Thread(target=self._writer,
+                                           args=(self.queue,),
+                                           name='bark-async-writer')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _writer(self, queue):
+        """
+        The body of the writer thread.  Emits messages from the queue
+        until told to stop.
+
+        :param queue: The queue to take messages from.
+        """
+
+        while True:
+            msg = queue.get()
+            try:
+                if msg is self._stop:
+                    return
+
+                self._emit(msg)
+            finally:
+                queue.task_done()
+
+    def _emit(self, msg):
+        """
+        Emit a message with the handler, logging and counting any
+        errors.
+
+        :param msg: The message to emit.
+        """
+
+        try:
+            self.handler(msg)
+        except Exception:
+            self.errors += 1
+            LOG.exception("Failed to emit log message")
+
+    def _drain(self):
+        """
+        Emit any messages left in the queue once the writer thread
+        has stopped.  Must be called with the lock held.
+        """
+
+        while True:
+            try:
+                msg = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            self.queue.task_done()
+            self._emit(msg)
+
+    def __call__(self, msg):
+        """
+        Queue a message for the writer thread.
+
+        :param msg: The message to emit.
+        """
+
+        # Threads do not survive a fork(), and the queue and the lock
+        # may have been held by one, so start over before touching
+        # either
+        if self.pid != os.getpid():
+            with _restart_lock:
+                if self.pid != os.getpid():
+                    self.start()
+
+        # Once closed, emit messages directly; the lock keeps them
+        # from being emitted concurrently with those drained by
+        # close()
+        if self.closed:
+            with self.lock:
+                self.handler(msg)
+            return
+
+        if self.overflow == 'block':
+            self.queue.put(msg)
+        else:
+            try:
+                self.queue.put_nowait(msg)
+            except Queue.Full:
+                self._overflow(msg)
+
+        # If the handler was closed while the message was being
+        # queued, the writer thread may never see it
+        if self.closed:
+            with self.lock:
+                self._drain()
+
+    def _overflow(self, msg):
+        """
+        Handle a message which does not fit in the queue.
+
+        :param msg: The message to emit.
+        """
+
+        with self.lock:
+            self.dropped += 1
+            if self.overflow == 'drop-oldest':
+                # Make room by discarding the oldest message, but
+                # never the writer thread's stop marker; it goes back
+                # on the end of the queue in place of the message
+                try:
+                    if self.queue.get_nowait() is self._stop:
+                        msg = self._stop
+                    self.queue.task_done()
+                except Queue.Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(msg)
+                except Queue.Full:
+                    pass
+
+    def flush(self):
+        """
+        Wait until all the queued messages have been emitted.
+        """
+
+        if (self.pid == os.getpid() and self.thread and
+                self.thread.is_alive()):
+            self.queue.join()
+
+    def close(self):
+        """
+        Emit all the queued messages and stop the writer thread.
+        Messages received after the handler is closed are emitted
+        directly.
+        """
+
+        # The queue and the lock of a handler which was never used
+        # since a fork() belong to the parent process
+        if self.pid != os.getpid():
+            self.closing = self.closed = True
+            _exit_handlers.discard(self)
+            return
+
+        with self.lock:
+            if self.closing:
+                return
+            self.closing = True
+        _exit_handlers.discard(self)
+
+        if self.thread and self.thread.is_alive():
+            self.queue.put(self._stop)
+            self.thread.join()
+
+        # Only now may messages be emitted directly; any queued after
+        # the stop marker are emitted first
+        with self.lock:
+            self.closed = True
+            self._drain()
+
+
+@arg_types(maxsize=int,
+           overflow=choice('block', 'drop-newest', 'drop-oldest'))
+def async_handler(name, logname, target, maxsize=1000, overflow='block',
+                  **kwargs):
+    """
+    A Bark logging handler which emits log messages from a background
+    thread, using the log stream type named by 'target'.  Messages
+    are held in a queue of at most 'maxsize' messages; 'overflow'
+    controls what happens when the queue is full.  All other
+    arguments are passed to the 'target' log stream type.
+    """
+
+    return AsyncHandler(get_handler(target, logname, kwargs),
+                        maxsize=maxsize, overflow=overflow)
+
+
+# The handlers provided by Bark.  These are the same as the handlers
+# published through the "bark.handler" entry point group, which is
+# only consulted for handlers not listed here.
+registry = {
+    'null': null_handler,
+    'stdout': stdout_handler,
+    'stderr': stderr_handler,
+    'file': file_handler,
+    'watched_file': watched_file_handler,
+    'buffered_file': buffered_file_handler,
+    'rotating_file': rotating_file_handler,
+    'timed_rotating_file': timed_rotating_file_handler,
+    'socket': socket_handler,
+    'datagram': datagram_handler,
+    'syslog': syslog_handler,
+    'nt_event_log': nt_event_log_handler,
+    'smtp': smtp_handler,
+    'http': http_handler,
+    'async': async_handler,
+}
+
+
 def _lookup_handler(name):
     """
     Look up the implementation of a named handler.  Broken out for
@@ -390,12 +1016,16 @@ def _lookup_handler(name):
     :returns: A factory function for the log handler.
     """
 
+    # Bark's own handlers don't need to be looked up
+    if name in registry:
+        return registry[name]
+
     # Look up and load the handler factory
-    for ep in pkg_resources.iter_entry_points('bark.handler', name):
+    for ep in entrypoints.iter_entry_points('bark.handler', name):
         try:
             # Load and return the handler factory
             return ep.load()
-        except (ImportError, pkg_resources.UnknownExtra):
+        except ImportError:
             # Couldn't load it...
             continue
 
@@ -16,11 +16,12 @@
 import ConfigParser
 import logging
 
-import webob.dec
-
+import bark.filters
 import bark.format
 import bark.handlers
 import bark.proxy
+import bark.sampling
+import bark.wsgi
 
 
 LOG = logging.getLogger('bark')
@@ -39,6 +40,8 @@ def bark_filter(global_conf, **local_conf):
 
     # First, parse the configuration
     conf_file = None
+    compile = True
+    streaming = False
     sections = {}
     for key, value in local_conf.items():
         # 'config' key causes a load of a configuration file; settings
@@ -46,6 +49,18 @@ def bark_filter(global_conf, **local_conf):
         # configuration file, however
         if key == 'config':
             conf_file = value
+        elif key == 'compile':
+            # Allows falling back to interpreted formats
+            try:
+                compile = bark.handlers.boolean(value)
+            except ValueError as exc:
+                LOG.warn("Cannot understand 'compile' option: %s" % exc)
+        elif key == 'streaming':
+            # Selects the streaming middleware
+            try:
+                streaming = bark.handlers.boolean(value)
+            except ValueError as exc:
+                LOG.warn("Cannot understand 'streaming' option: %s" % exc)
         elif '.' in key:
             sect, _sep, opt = key.partition('.')
             sect_dict = sections.setdefault(sect, {})
@@ -65,6 +80,8 @@ def bark_filter(global_conf, **local_conf):
     # OK, the configuration is all read; next step is to turn the
     # configuration into logging handlers
     handlers = {}
+    samplers = {}
+    filters = {}
     proxies = None
     for sect, sect_dict in sections.items():
         if sect == 'proxies':
@@ -78,7 +95,8 @@ def bark_filter(global_conf, **local_conf):
 
         # First, determine the logging format
         try:
-            format = bark.format.Format.parse(sect_dict.pop('format'))
+            format = bark.format.Format.parse(sect_dict.pop('format'),
+                                              compile=compile)
         except KeyError:
             LOG.warn("No format specified for log %r; skipping." % sect)
             continue
@@ -86,6 +104,27 @@ def bark_filter(global_conf, **local_conf):
         # Next, determine the handler type
         handle_type = sect_dict.pop('type', 'file')
 
+        # Determine whether to sample the log stream
+        sample = sect_dict.pop('sample', None)
+        sample_header = sect_dict.pop('sample_header', None)
+        sample_note = sect_dict.pop('sample_note', None)
+        sampler = None
+        if sample is not None:
+            try:
+                sampler = bark.sampling.Sampler(
+                    bark.sampling.rate(sample), sample_header, sample_note)
+            except ValueError as exc:
+                LOG.warn("Cannot understand 'sample' option for log %r: %s" %
+                         (sect, exc))
+
+        # Determine which requests to exclude from the log stream
+        try:
+            filt = bark.filters.parse(sect_dict)
+        except ValueError as exc:
+            LOG.warn("Cannot understand filter options for log %r: %s" %
+                     (sect, exc))
+            filt = None
+
         # Now, let's construct a handler; this will be a callable
         # taking the formatted message to log
         try:
@@ -97,17 +136,23 @@ def bark_filter(global_conf, **local_conf):
 
         # We now have a handler and a format; bundle them up
         handlers[sect] = (format, handler)
+        if sampler:
+            samplers[sect] = sampler
+        if filt:
+            filters[sect] = filt
 
     # Construct the wrapper which is going to instantiate the
     # middleware
+    middleware = StreamingBarkMiddleware if streaming else BarkMiddleware
+
     def wrapper(app):
-        return BarkMiddleware(app, handlers, proxies)
+        return middleware(app, handlers, proxies, samplers, filters)
 
     return wrapper
 
 
 class BarkMiddleware(object):
-    def __init__(self, app, handlers, proxies):
+    def __init__(self, app, handlers, proxies, samplers=None, filters=None):
         """
         Initialize the Bark middleware.
 
@@ -119,38 +164,303 @@ class BarkMiddleware(object):
                         useragent IP address in the face of proxy
                         forwarding.  If None, proxy handling is
                         disabled.
+        :param samplers: A dictionary of Sampler objects, keyed by the
+                         names of the log streams to be sampled.
+                         Optional.
+        :param filters: A dictionary of Filter objects, keyed by the
+                        names of the log streams to be filtered.
+                        Optional.
         """
 
         self.app = app
         self.handlers = handlers
         self.proxies = proxies
+        self.samplers = samplers or {}
+        self.filters = filters or {}
+
+        # Bundle the formats together, so conversions common to
+        # several log streams are only computed once; the status code
+        # filters are applied by the FormatSet
+        names = list(handlers)
+        self._accepts = [self.filters[name].accept
+                         if name in self.filters and
+                         self.filters[name].statuses else None
+                         for name in names]
+        self.formats = bark.format.FormatSet(
+            (handlers[name][0] for name in names), self._accepts)
+        self.emitters = [handlers[name][1] for name in names]
+
+        # The filters and samplers consulted before formatting, with
+        # the indexes of their log streams; filters come first, so
+        # that the samplers only count the requests they could log
+        self._selectors = []
+        for idx, name in enumerate(names):
+            if name in self.filters and self.filters[name].request_filter:
+                self._selectors.append((idx, self.filters[name]))
+            if name in self.samplers:
+                self._selectors.append((idx, self.samplers[name]))
 
-    @webob.dec.wsgify
-    def __call__(self, request):
+        # The FormatSets and handlers to use for each subset of
+        # dropped log streams
+        self._subsets = {frozenset(): (self.formats, self.emitters)}
+
+    def __call__(self, environ, start_response):
         """
         Process a WSGI request, emitting log output as appropriate.
+        No webob objects are constructed unless a conversion needs
+        them; see bark.wsgi.
+
+        :param environ: The WSGI environment.
+        :param start_response: The WSGI start_response callable.
+        """
+
+        request, streams, data, captured, app_iter = self.start(
+            environ, start_response)
+
+        # Nothing to do if the request was sampled out
+        if not streams:
+            return app_iter
+
+        # If the application hasn't started the response yet, run it
+        # until it does
+        if not captured:
+            orig_iter = app_iter
+            try:
+                app_iter = list(orig_iter)
+            finally:
+                if hasattr(orig_iter, 'close'):
+                    orig_iter.close()
+
+        # Now, format and log the messages
+        status, headers = captured or ('500 Internal Server Error', [])
+        response = bark.wsgi.Response(status, headers, app_iter)
+        self.emit(request, response, streams, data)
 
-        :param request: The Request object provided by WebOb.
+        return response.app_iter
+
+    def start(self, environ, start_response, sent=None):
         """
+        Prepare the formatters for a request, then call the
+        application.
+
+        :param environ: The WSGI environment.
+        :param start_response: The WSGI start_response callable.
+        :param sent: If not None, a list whose single element counts
+                     the bytes of the response body sent; the bytes
+                     the application passes to the write() callable
+                     returned by start_response() are added to it.
 
-        data = {}
+        :returns: A tuple of the Request object describing the
+                  request, the log streams selected by select(), the
+                  data returned by the prepare() method of their
+                  FormatSet, a list which will contain the status
+                  and the headers passed to start_response() once the
+                  application has called it, and the application's
+                  iterator.
+        """
+
+        request = bark.wsgi.Request(environ)
 
         # Determine the useragent IP
         if self.proxies:
             self.proxies(request)
 
-        # Start by preparing all the formatters
-        for log, (format, handler) in self.handlers.items():
-            data[log] = format.prepare(request)
+        # Select the log streams, then prepare their formatters
+        streams = self.select(environ)
+        data = streams[0].prepare(request) if streams else None
+
+        # Capture the status and headers as they pass by
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers]
+            write = start_response(status, headers, exc_info)
+            if sent is None or not streams:
+                return write
+
+            # Count the bytes written outside the application's
+            # iterator
+            def counting_write(data):
+                write(data)
+                sent[0] += len(data)
+
+            return counting_write
 
         # Now, let's call the application
-        response = request.get_response(self.app)
+        app_iter = self.app(environ, capture)
 
-        # Now, format and log the messages
-        for log, (format, handler) in self.handlers.items():
-            result = format.convert(request, response, data[log])
+        return request, streams, data, captured, app_iter
+
+    def select(self, environ):
+        """
+        Select the log streams which should log a request, consulting
+        the filters and the samplers.  This is done before any
+        formatting, so that requests which are filtered or sampled
+        out cost almost nothing.
+
+        :param environ: The WSGI environment.
+
+        :returns: A tuple of the FormatSet for the selected log
+                  streams and the list of their handlers, or None if
+                  no log stream should log the request.
+        """
+
+        if not self._selectors:
+            return self._subsets[frozenset()]
+
+        draws = {}
+        dropped = set()
+        for idx, selector in self._selectors:
+            if idx not in dropped and not selector(environ, draws):
+                dropped.add(idx)
+        dropped = frozenset(dropped)
+
+        try:
+            return self._subsets[dropped]
+        except KeyError:
+            pass
+
+        # Bundle up the formats of the remaining log streams
+        kept = [idx for idx in range(len(self.emitters))
+                if idx not in dropped]
+        streams = None
+        if kept:
+            streams = (
+                bark.format.FormatSet(
+                    [self.formats.formats[idx] for idx in kept],
+                    [self._accepts[idx] for idx in kept]),
+                [self.emitters[idx] for idx in kept],
+            )
+
+        return self._subsets.setdefault(dropped, streams)
+
+    def emit(self, request, response, streams, data):
+        """
+        Format and emit the log messages for a request.
+
+        :param request: The Request object describing the request.
+        :param response: The Response object describing the
+                         response.
+        :param streams: The log streams selected by select().
+        :param data: The data returned by the prepare() method of
+                     the FormatSet of the log streams.
+        """
+
+        if not streams:
+            return
+
+        formats, emitters = streams
+        results = formats.convert(request, response, data)
+        for handler, result in zip(emitters, results):
+            # Skip log streams which exclude the status code
+            if result is None:
+                continue
 
             # Emit with the handler
             handler(result)
 
-        return response
+
+class StreamingBarkMiddleware(BarkMiddleware):
+    def __call__(self, environ, start_response):
+        """
+        Process a WSGI request, emitting log output as appropriate.
+        Unlike BarkMiddleware, the response body is never buffered;
+        instead, the application's iterator is wrapped, so that the
+        bytes actually sent may be counted, and the log messages are
+        emitted when the iterator is closed.  This makes the response
+        size (e.g., "%b") and the time taken to serve the request
+        (e.g., "%D") reflect the full response.
+
+        :param environ: The WSGI environment.
+        :param start_response: The WSGI start_response callable.
+        """
+
+        # The application may use the write() callable before it
+        # returns its iterator, so the count must exist first
+        sent = [0]
+        request, streams, data, captured, app_iter = self.start(
+            environ, start_response, sent)
+
+        # Nothing to do if the request was sampled out
+        if not streams:
+            return app_iter
+
+        return LoggingAppIter(self, request, streams, data, captured,
+                              app_iter, sent)
+
+
+class LoggingAppIter(object):
+    def __init__(self, middleware, request, streams, data, captured,
+                 app_iter, sent=None):
+        """
+        Initialize a LoggingAppIter.  Wraps an application's iterator
+        to count the bytes of the response body, and emits the log
+        messages when closed.
+
+        :param middleware: The StreamingBarkMiddleware.
+        :param request: The Request object describing the request.
+        :param streams: The log streams selected by the middleware.
+        :param data: The data returned by the prepare() method of
+                     the FormatSet of the log streams.
+        :param captured: A list which will contain the status and
+                         the headers passed to start_response(), once
+                         the application has called it.
+        :param app_iter: The application's iterator.
+        :param sent: A list whose single element counts the bytes of
+                     the response body sent, shared with the write()
+                     callable returned by start_response().  If None,
+                     a new count is started.
+        """
+
+        self.middleware = middleware
+        self.request = request
+        self.streams = streams
+        self.data = data
+        self.captured = captured
+        self.app_iter = app_iter
+        self.sent = [0] if sent is None else sent
+        self.closed = False
+
+    @property
+    def bytes_sent(self):
+        """
+        The number of bytes of the response body sent, whether
+        yielded by the application's iterator or passed to the
+        write() callable.
+        """
+
+        return self.sent[0]
+
+    def __iter__(self):
+        """
+        Iterate over the response body, counting the bytes sent.
+        """
+
+        sent = self.sent
+        for chunk in self.app_iter:
+            sent[0] += len(chunk)
+            yield chunk
+
+    def close(self):
+        """
+        Close the application's iterator, then emit the log messages.
+        """
+
+        # Only log the request once
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            # The application may have failed before starting the
+            # response
+            status, headers = self.captured or (
+                '500 Internal Server Error', [])
+            response = bark.wsgi.Response(status, headers)
+            self.request.environ['bark.bytes_sent'] = self.bytes_sent
+
+            self.middleware.emit(self.request, response, self.streams,
+                                 self.data)
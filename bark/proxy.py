@@ -13,51 +13,472 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import bisect
+import collections
 import itertools
 import logging
+import re
+import socket
+import struct
+import threading
 
-import netaddr
+from bark import wsgi
 
 
 LOG = logging.getLogger('bark')
 
 
+# Networks whose addresses may never be introduced by a proxy, unless
+# explicitly accepted
 _martian = [
-    netaddr.ip.IPV4_LOOPBACK,
-    netaddr.ip.IPV4_MULTICAST,
-    netaddr.ip.IPV4_6TO4,
-    netaddr.ip.IPV6_LOOPBACK,
-    netaddr.ip.IPV6_MULTICAST,
+    '127.0.0.0/8',
+    '224.0.0.0/4',
+    '192.88.99.0/24',
+    '::1',
+    'ff00::/8',
 ]
-_internal = [net for net in itertools.chain(
-    netaddr.ip.IPV4_PRIVATE, netaddr.ip.IPV6_PRIVATE)
-    if not isinstance(net, netaddr.IPRange)]
+
+# Reserved internal networks
+_internal = [
+    '10.0.0.0/8',
+    '100.64.0.0/10',
+    '172.16.0.0/12',
+    '192.0.0.0/24',
+    '192.168.0.0/16',
+    '198.18.0.0/15',
+    'fc00::/7',
+    'fec0::/10',
+]
+
+# A sentinel distinguishing uncached proxy resolution results
+_uncached = object()
+
+# The number of bits in an address of each IP version
+_bits = {4: 32, 6: 128}
+
+# Only these characters can appear in an IP address; checking for them
+# rejects garbage, such as "unknown", without raising an exception
+_addr_re = re.compile(r'[0-9A-Fa-f.:Xx]+\Z')
+
+
+def _parse_addr(addr):
+    """
+    Helper function to convert an address string into a tuple of the
+    IP version and the integer value of the address.  IPv4 addresses
+    are interpreted as by inet_aton(), just as netaddr does.
+
+    :param addr: The address string, with no surrounding whitespace.
+
+    :returns: A tuple of the IP version and the integer value of the
+              address, or None if the address cannot be parsed.
+    """
+
+    if not _addr_re.match(addr):
+        return None
+
+    try:
+        if ':' in addr:
+            high, low = struct.unpack('!QQ', socket.inet_pton(
+                socket.AF_INET6, addr))
+            return 6, high << 64 | low
+
+        return 4, struct.unpack('!I', socket.inet_aton(addr))[0]
+    except socket.error:
+        return None
 
 
 def _parse_ip(addr):
     """
-    Helper function to convert an address into an IPAddress object.
-    Canonicalizes IPv6-mapped (or compatible) IPv4 addresses into IPv4
-    addresses.  Returns None if the address cannot be parsed.
+    Helper function to convert an address into a tuple of the IP
+    version and the integer value of the address.  Canonicalizes
+    IPv6-mapped (or compatible) IPv4 addresses into IPv4 addresses.
+    Returns None if the address cannot be parsed.
     """
 
     # Parse the IP address
-    try:
-        address = netaddr.IPAddress(addr.strip())
-    except (ValueError, netaddr.AddrFormatError):
+    address = _parse_addr(addr.strip())
+    if address is None:
         return None
 
     # Canonicalize it, if possible
-    if address.version == 6:
-        try:
-            return address.ipv4()
-        except netaddr.AddrConversionError:
-            pass
+    version, value = address
+    if version == 6 and (value >> 32) in (0, 0xffff):
+        return 4, value & 0xffffffff
 
     return address
 
 
+def _parse_net(net):
+    """
+    Helper function to convert an address or a CIDR network
+    expression into a range of addresses.  As with _parse_ip(),
+    networks lying entirely within the IPv6-mapped (or compatible)
+    IPv4 address space are canonicalized into IPv4 networks.  Any
+    host bits set in a CIDR network address are ignored.
+
+    :param net: The address or CIDR network expression.  A netaddr
+                IPNetwork or IPRange object may also be passed.
+
+    :returns: A tuple of the IP version and the integer values of
+              the first and last addresses in the network, or None if
+              the network cannot be parsed.
+    """
+
+    # For convenience, accept netaddr objects describing ranges
+    if not isinstance(net, basestring):
+        try:
+            version, first, last = net.version, net.first, net.last
+        except AttributeError:
+            return None
+    else:
+        addr, sep, prefix = net.strip().partition('/')
+        address = _parse_addr(addr.strip())
+        if address is None:
+            return None
+        version, first = address
+
+        # Apply the prefix length
+        bits = _bits[version]
+        if sep:
+            prefix = prefix.strip()
+            if not prefix.isdigit() or int(prefix) > bits:
+                return None
+            hostmask = (1 << (bits - int(prefix))) - 1
+        else:
+            hostmask = 0
+        first &= ~hostmask
+        last = first | hostmask
+
+    # Canonicalize it, if possible
+    if version == 6 and (first >> 32) == (last >> 32) and \
+            (first >> 32) in (0, 0xffff):
+        return 4, first & 0xffffffff, last & 0xffffffff
+
+    return version, first, last
+
+
+def _format_ip(addr):
+    """
+    Helper function to convert a tuple of the IP version and the
+    integer value of an address, as returned by _parse_ip(), into
+    its string representation.
+    """
+
+    version, value = addr
+    if version == 4:
+        return socket.inet_ntoa(struct.pack('!I', value))
+
+    return socket.inet_ntop(socket.AF_INET6, struct.pack(
+        '!QQ', value >> 64, value & 0xffffffffffffffff))
+
+
+# Tokenizes an RFC 7239 Forwarded header: a parameter, with its value
+# either quoted or not, a separator, or a stray character
+_forwarded_re = re.compile(r'\s*(?:([^\s=;,"]+)\s*=\s*'
+                           r'(?:"((?:[^"\\]|\\.)*)"|([^\s;,"]*))|'
+                           r'([;,])|(\S))')
+_quoted_pair_re = re.compile(r'\\(.)')
+
+# The parameters of a Forwarded element, other than "for", that are
+# stored in notes
+_forwarded_notes = ('by', 'host', 'proto')
+
+
+def _parse_forwarded(header):
+    """
+    Helper function to parse the value of an RFC 7239 Forwarded
+    header, in a single pass.  Empty elements are ignored.
+
+    :param header: The value of the header.
+
+    :returns: A list of the forwarded elements, in order.  Each
+              element is a tuple of a dictionary mapping the
+              lowercased parameter names to their values, or None if
+              the element is malformed, and the offset of the end of
+              the element in the header.
+    """
+
+    elements = []
+    params = {}
+    end = 0
+    for match in _forwarded_re.finditer(header):
+        name, quoted, token, sep, stray = match.groups()
+        if sep == ',':
+            if params is None or params:
+                elements.append((params, end))
+            params = {}
+        elif sep is None:
+            end = match.end()
+            if stray or params is None:
+                params = None
+            elif quoted is None:
+                params[name.lower()] = token
+            else:
+                params[name.lower()] = _quoted_pair_re.sub(r'\1', quoted)
+
+    if params is None or params:
+        elements.append((params, end))
+
+    return elements
+
+
+def _forwarded_node(node):
+    """
+    Helper function to extract the IP address from the node
+    identifier of a Forwarded element, e.g., "192.0.2.43:47011" or
+    "[2001:db8:cafe::17]:4711".  Obfuscated and unknown identifiers
+    are returned unchanged, and will not parse as IP addresses.
+
+    :param node: The node identifier.
+
+    :returns: The IP address, as a string.
+    """
+
+    if node.startswith('['):
+        addr, sep, port = node[1:].partition(']')
+        if not sep or (port and not port.startswith(':')):
+            return ''
+        return addr
+    elif node.count(':') == 1:
+        return node.partition(':')[0]
+
+    return node
+
+
+# The full address space, and the martian and internal networks,
+# parsed once and shared by all proxies
+_everything = tuple((version, 0, (1 << bits) - 1)
+                    for version, bits in sorted(_bits.items()))
+_martian_ranges = tuple(_parse_net(net) for net in _martian)
+_internal_ranges = tuple(_parse_net(net) for net in _internal)
+
+# The kinds of proxies, by modifier, and their restrictive and
+# prohibit_internal flags
+_proxy_kinds = {
+    None: (False, True),
+    'restrict': (True, True),
+    'internal': (False, False),
+}
+
+
+def _modifier(entry, names):
+    """
+    Helper function to split a modifier, such as "restrict()", from
+    a configuration entry.
+
+    :param entry: The configuration entry.
+    :param names: A sequence of the names of the recognized
+                  modifiers.
+
+    :returns: A tuple of the name of the modifier, or None if the
+              entry has no recognized modifier, and the entry with
+              the modifier removed.
+    """
+
+    if entry.endswith(')'):
+        for name in names:
+            if entry.startswith(name + '('):
+                return name, entry[len(name) + 1:-1]
+
+    return None, entry
+
+
+def _read_list(filename):
+    """
+    Helper function to read a list of entries from a file, one per
+    line.  Blank lines are ignored, as is anything following a "#".
+
+    :param filename: The name of the file to read.
+
+    :returns: A list of the entries.
+    """
+
+    with open(filename) as f:
+        return [entry for entry in
+                (line.partition('#')[0].strip() for line in f)
+                if entry]
+
+
+def _merge_ranges(ranges):
+    """
+    Helper function to sort a list of address ranges, merging any
+    that overlap or adjoin.
+
+    :param ranges: A list of address ranges, as returned by
+                   _parse_net().
+
+    :returns: A dictionary mapping the IP version to a tuple of sorted
+              lists of the first and the last addresses of the merged
+              ranges of that version, as integers.
+    """
+
+    merged = dict((version, ([], [])) for version in _bits)
+    for version, first, last in sorted(ranges):
+        firsts, lasts = merged[version]
+        if lasts and first <= lasts[-1] + 1:
+            if last > lasts[-1]:
+                lasts[-1] = last
+        else:
+            firsts.append(first)
+            lasts.append(last)
+
+    return merged
+
+
+def _compile_intervals(groups, resolve):
+    """
+    Helper function to compile lists of address ranges into an
+    interval index.  The address space of each IP version is divided
+    into intervals at the boundaries of the ranges, within which
+    every address belongs to the same lists; the intervals are
+    identified by their starting addresses, in sorted order.
+
+    :param groups: A list of lists of address ranges, as returned by
+                   _parse_net().
+    :param resolve: A callable computing the value of an interval.
+                    It is passed a list of booleans indicating
+                    whether the interval is in each list of ranges,
+                    and is called only once for each combination.
+
+    :returns: A dictionary mapping the IP version to a tuple of a
+              sorted tuple of the starting addresses of the
+              intervals, as integers, and a tuple of the values of
+              the intervals.  Neighboring intervals with the same
+              value are merged.
+    """
+
+    results = {}
+
+    def value(member):
+        key = tuple(member)
+        if key not in results:
+            results[key] = resolve(list(member))
+        return results[key]
+
+    nets = [_merge_ranges(ranges) for ranges in groups]
+
+    index = {}
+    for version, bits in sorted(_bits.items()):
+        size = 1 << bits
+
+        if len(groups) == 1:
+            # A single list alternates between its networks and the
+            # gaps between them, which were merged already
+            inside = value([True])
+            outside = value([False])
+            firsts, lasts = nets[0][version]
+            starts = [0]
+            values = [outside]
+            if inside != outside:
+                for first, last in zip(firsts, lasts):
+                    if first:
+                        starts.append(first)
+                        values.append(inside)
+                    else:
+                        values[0] = inside
+                    if last + 1 < size:
+                        starts.append(last + 1)
+                        values.append(outside)
+
+            index[version] = (tuple(starts), tuple(values))
+            continue
+
+        # Sweep across the boundaries of all the networks, in order,
+        # noting where each list's networks begin and end
+        bounds = []
+        for group, merged in enumerate(nets):
+            firsts, lasts = merged[version]
+            bounds.extend((first, group, True) for first in firsts)
+            bounds.extend((last + 1, group, False) for last in lasts
+                          if last + 1 < size)
+        bounds.sort()
+
+        # Resolve each interval, merging neighbors with the same
+        # result
+        member = [False] * len(groups)
+        starts = []
+        values = []
+        start = 0
+        i = 0
+        while True:
+            while i < len(bounds) and bounds[i][0] == start:
+                member[bounds[i][1]] = bounds[i][2]
+                i += 1
+
+            result = value(member)
+            if not values or values[-1] != result:
+                starts.append(start)
+                values.append(result)
+
+            if i == len(bounds):
+                break
+            start = bounds[i][0]
+
+        index[version] = (tuple(starts), tuple(values))
+
+    return index
+
+
+def _compile_index(accepted, excluded):
+    """
+    Helper function to compile lists of accepted and excluded
+    address ranges into an interval index.  The address space of
+    each IP version is divided into intervals, within which every
+    address is either permitted or not; the intervals are identified
+    by their starting addresses, in sorted order.
+
+    :param accepted: A list of the accepted address ranges, as
+                     returned by _parse_net().
+    :param excluded: A list of the excluded address ranges, as
+                     returned by _parse_net().
+
+    :returns: A dictionary mapping the IP version to a tuple of a
+              sorted tuple of the starting addresses of the
+              intervals, as integers, and a tuple of booleans
+              indicating whether the addresses in each interval are
+              permitted.
+    """
+
+    return _compile_intervals([accepted, excluded],
+                              lambda member: member[0] and not member[1])
+
+
+def _default_ranges(restrictive, prohibit_internal):
+    """
+    Helper function to determine the initial address ranges of a
+    proxy.  See Proxy for the meanings of the arguments.
+
+    :returns: A tuple of lists of the accepted and the excluded
+              address ranges.
+    """
+
+    if restrictive:
+        # Only allow specifically allowed IPs
+        accepted = []
+    else:
+        # Allow all IPs except those excluded
+        accepted = list(_everything)
+
+    # Always exclude martians
+    excluded = list(_martian_ranges)
+    if prohibit_internal:
+        # But we allow internals
+        excluded.extend(_internal_ranges)
+
+    return accepted, excluded
+
+
+# The indexes of proxies with no rules of their own, by their
+# restrictive and prohibit_internal flags; there are few enough that
+# all such proxies can share them
+_default_indexes = dict(
+    (flags, _compile_index(*_default_ranges(*flags)))
+    for flags in itertools.product((False, True), repeat=2))
+
+
 class Proxy(object):
+    __slots__ = ('address', 'accepted', 'excluded', '_index')
+
     def __init__(self, address, restrictive=False, prohibit_internal=True):
         """
         Initialize a Proxy object.  Sets the IP address of the proxy
@@ -80,65 +501,166 @@ class Proxy(object):
         """
 
         self.address = address
+        self.accepted, self.excluded = _default_ranges(restrictive,
+                                                       prohibit_internal)
 
-        if restrictive:
-            # Only allow specifically allowed IPs
-            self.accepted = netaddr.IPSet()
-        else:
-            # Allow all IPs except those excluded
-            self.accepted = netaddr.IPSet(['0.0.0.0/0', '::/0'])
-
-        # Always exclude martians
-        self.excluded = netaddr.IPSet(_martian)
-        if prohibit_internal:
-            # But we allow internals
-            for net in _internal:
-                self.excluded.add(net)
+        # Until rules are added, the index need not be compiled
+        self._index = _default_indexes[restrictive, prohibit_internal]
 
     def __contains__(self, addr):
         """
-        Tests whether an address is permitted for this proxy.
+        Tests whether an address is permitted for this proxy.  The
+        address must be in accepted and not in excluded; rather than
+        consulting both sets, the answer is looked up in an interval
+        index compiled from them, so the cost does not depend on the
+        number of rules.
 
-        :param addr: The address to test.  Must be an IPAddress
-                     object.
+        :param addr: The address to test.  Should be a tuple of the
+                     IP version and the integer value of the
+                     address, as returned by _parse_ip(); strings
+                     are also accepted.
 
         :returns: True if the address is permitted for this proxy.
         """
 
-        # Address must be in accepted and not in excluded
-        return addr in self.accepted and addr not in self.excluded
+        if isinstance(addr, basestring):
+            addr = _parse_ip(addr)
+            if addr is None:
+                return False
+
+        self.compile()
+
+        version, value = addr
+        starts, permitted = self._index[version]
+        return permitted[bisect.bisect_right(starts, value) - 1]
+
+    def compile(self):
+        """
+        Compile the interval index used to test addresses, if the
+        rules have changed since it was last compiled.  This is done
+        when the proxy configuration is loaded, so the cost is not
+        paid by a request; if the proxy is changed afterwards, the
+        index is recompiled when next needed.
+        """
+
+        if self._index is None:
+            self._index = _compile_index(self.accepted, self.excluded)
 
     def restrict(self, addr):
         """
         Drop an address from the set of addresses this proxy is
         permitted to introduce.
 
-        :param addr: The address to remove.
+        :param addr: The address or CIDR network to remove.
         """
 
         # Remove the address from the set
-        ip_addr = _parse_ip(addr)
-        if ip_addr is None:
+        ip_net = _parse_net(addr)
+        if ip_net is None:
             LOG.warn("Cannot restrict address %r from proxy %s: "
                      "invalid address" % (addr, self.address))
         else:
-            self.excluded.add(addr)
+            self.excluded.append(ip_net)
+            self._index = None
 
     def accept(self, addr):
         """
         Add an address to the set of addresses this proxy is permitted
         to introduce.
 
-        :param addr: The address to add.
+        :param addr: The address or CIDR network to add.
         """
 
         # Add the address to the set
-        ip_addr = _parse_ip(addr)
-        if ip_addr is None:
+        ip_net = _parse_net(addr)
+        if ip_net is None:
             LOG.warn("Cannot add address %r to proxy %s: "
                      "invalid address" % (addr, self.address))
         else:
-            self.accepted.add(addr)
+            self.accepted.append(ip_net)
+            self._index = None
+
+    def extend(self, accepted=(), excluded=()):
+        """
+        Add address ranges in bulk to the sets of addresses this
+        proxy is and is not permitted to introduce.
+
+        :param accepted: A list of the address ranges to add, as
+                         returned by _parse_net().
+        :param excluded: A list of the address ranges to remove, as
+                         returned by _parse_net().
+        """
+
+        if accepted or excluded:
+            self.accepted.extend(accepted)
+            self.excluded.extend(excluded)
+            self._index = None
+
+
+class ResultCache(object):
+    def __init__(self, size):
+        """
+        Initialize a ResultCache.  A ResultCache is a bounded cache
+        of proxy resolution results, discarding the least recently
+        used result when full.  It is safe to use from multiple
+        threads.
+
+        :param size: The maximum number of results to cache.
+        """
+
+        self.size = size
+
+        # Counters for the cache hits and misses
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Return the number of cached results.
+        """
+
+        return len(self._cache)
+
+    def get(self, key, default=None):
+        """
+        Look up a cached result, marking it as the most recently used.
+
+        :param key: The key to look up.
+        :param default: The value to return if the key is not cached.
+
+        :returns: The cached result, or the default.
+        """
+
+        with self._lock:
+            try:
+                value = self._cache.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            # Reinsert it, making it the most recently used
+            self._cache[key] = value
+            self.hits += 1
+
+        return value
+
+    def put(self, key, value):
+        """
+        Cache a result, discarding the least recently used result if
+        the cache is full.
+
+        :param key: The key to cache the result under.
+        :param value: The result to cache.
+        """
+
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = value
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
 
 
 class ProxyConfig(object):
@@ -154,30 +676,49 @@ class ProxyConfig(object):
         # KeyError if not configured, which will trigger
         # bark_factory() to log an appropriate warning
         self.header = config['header']
+        self.header_key = wsgi.header_key(self.header)
+
+        # The standard Forwarded header has its own syntax
+        self.forwarded = self.header.lower() == 'forwarded'
+
+        # Set up the optional cache of resolution results
+        self.cache = None
+        if 'cache_size' in config:
+            try:
+                cache_size = int(config['cache_size'])
+                if cache_size < 0:
+                    raise ValueError("cache size %d is negative" %
+                                     cache_size)
+            except ValueError as exc:
+                LOG.warn("Cannot understand 'cache_size' option for "
+                         "proxies: %s" % exc)
+            else:
+                if cache_size:
+                    self.cache = ResultCache(cache_size)
+
+        # Rules in a file only apply to proxies loaded from a file
+        if 'rules_file' in config and 'proxies_file' not in config:
+            LOG.warn("Ignoring 'rules_file' option for proxies: no "
+                     "'proxies_file' option is set")
 
         # Next, determine what the acceptable proxies are
-        if 'proxies' not in config:
+        if 'proxies' not in config and 'proxies_file' not in config:
             self.proxies = None
+            self.ranges = None
             self.pseudo_proxy = Proxy('0.0.0.0/0')
+            self.pseudo_proxy.compile()
             return
 
         # We have a list of proxies, so process it
         self.proxies = {}
+        self.ranges = None
         self.pseudo_proxy = None
 
-        for pxy_addr in (pxy.strip() for pxy in config['proxies'].split(',')):
+        entries = config['proxies'].split(',') if 'proxies' in config else []
+        for pxy_addr in (pxy.strip() for pxy in entries):
             # Determine what kind of proxy is desired
-            if pxy_addr.startswith('restrict(') and pxy_addr[-1] == ')':
-                restrictive = True
-                prohibit_internal = True
-                pxy_addr = pxy_addr[9:-1]
-            elif pxy_addr.startswith('internal(') and pxy_addr[-1] == ')':
-                restrictive = False
-                prohibit_internal = False
-                pxy_addr = pxy_addr[9:-1]
-            else:
-                restrictive = False
-                prohibit_internal = True
+            kind, pxy_addr = _modifier(pxy_addr, ('restrict', 'internal'))
+            restrictive, prohibit_internal = _proxy_kinds[kind]
 
             # Now create the proxy
             addr = _parse_ip(pxy_addr)
@@ -185,23 +726,106 @@ class ProxyConfig(object):
                 LOG.warn("Cannot understand proxy IP address %r" % pxy_addr)
                 continue
 
-            proxy = Proxy(addr, restrictive, prohibit_internal)
+            proxy = Proxy(_format_ip(addr), restrictive, prohibit_internal)
             self.proxies[addr] = proxy
 
             # Check if there are any IP rules for the proxy
             if pxy_addr in config:
                 for rule in (r.strip() for r in config[pxy_addr].split(',')):
                     # Determine what kind of rule is desired
-                    update = proxy.accept
-                    if rule.startswith('restrict(') and rule[-1] == ')':
+                    kind, rule = _modifier(rule, ('restrict', 'accept'))
+                    if kind == 'restrict':
                         update = proxy.restrict
-                        rule = rule[9:-1]
-                    elif rule.startswith('accept(') and rule[-1] == ')':
-                        rule = rule[7:-1]
+                    else:
+                        update = proxy.accept
 
                     # Add the rule to the proxy
                     update(rule)
 
+        # Load proxies in bulk from a file
+        if 'proxies_file' in config:
+            self.load(config['proxies_file'], config.get('rules_file'))
+
+        # Compile the proxies' indexes now, rather than on the first
+        # request through each
+        for proxy in self.proxies.values():
+            proxy.compile()
+
+    def load(self, proxies_file, rules_file=None):
+        """
+        Load proxies in bulk from a file, containing the addresses or
+        CIDR networks of the proxies, one per line, each optionally
+        using the "restrict()" or "internal()" modifier.  Rather than
+        creating a Proxy for each entry, the proxies of each kind
+        share a Proxy, along with its rules; an address matching
+        several entries uses the most restrictive.  Proxies
+        configured individually take precedence.
+
+        :param proxies_file: The name of the file listing the
+                             proxies.
+        :param rules_file: The name of a file listing the rules for
+                           the proxies, one per line, each optionally
+                           using the "accept()" or "restrict()"
+                           modifier.  Optional.
+        """
+
+        try:
+            entries = _read_list(proxies_file)
+        except IOError as exc:
+            LOG.warn("Cannot read proxies file %r: %s" % (proxies_file, exc))
+            return
+
+        # Collect the networks of each kind of proxy
+        groups = {}
+        for entry in entries:
+            kind, pxy_net = _modifier(entry, ('restrict', 'internal'))
+            net = _parse_net(pxy_net)
+            if net is None:
+                LOG.warn("Cannot understand proxy IP address %r in %r" %
+                         (pxy_net, proxies_file))
+                continue
+            groups.setdefault(kind, []).append(net)
+
+        # Create the shared proxies
+        proxies = dict((kind, Proxy(proxies_file, *_proxy_kinds[kind]))
+                       for kind in groups)
+
+        # Add the shared rules
+        if rules_file:
+            try:
+                rules = _read_list(rules_file)
+            except IOError as exc:
+                LOG.warn("Cannot read rules file %r: %s" % (rules_file, exc))
+                rules = []
+
+            accepted = []
+            excluded = []
+            for entry in rules:
+                kind, rule = _modifier(entry, ('restrict', 'accept'))
+                net = _parse_net(rule)
+                if net is None:
+                    LOG.warn("Cannot understand rule %r in %r" %
+                             (rule, rules_file))
+                    continue
+                if kind == 'restrict':
+                    excluded.append(net)
+                else:
+                    accepted.append(net)
+
+            for proxy in proxies.values():
+                proxy.extend(accepted, excluded)
+
+        for proxy in proxies.values():
+            proxy.compile()
+
+        # Compile the index of the proxies, most restrictive first
+        order = [kind for kind in ('restrict', None, 'internal')
+                 if kind in groups]
+        self.ranges = _compile_intervals(
+            [groups[kind] for kind in order],
+            lambda member: next((proxies[kind] for kind, found in
+                                 zip(order, member) if found), None))
+
     def __call__(self, request):
         """
         Handle proxy information in the request.
@@ -212,23 +836,140 @@ class ProxyConfig(object):
                   otherwise.  The return value is solely for testing.
         """
 
+        environ = request.environ
+
         # Does the header exist?  Do we have the client address?
-        if (self.header not in request.headers or
-                'REMOTE_ADDR' not in request.environ):
+        if self.header_key not in environ or 'REMOTE_ADDR' not in environ:
             return False
 
+        # Resolve the proxy chain; the result depends only on the
+        # client address and the header value, so it may be cached
+        remote_addr = environ['REMOTE_ADDR']
+        header = environ[self.header_key]
+        if self.cache is None:
+            result = self.resolve(remote_addr, header)
+        else:
+            key = (remote_addr, header)
+            result = self.cache.get(key, _uncached)
+            if result is _uncached:
+                result = self.resolve(remote_addr, header)
+                self.cache.put(key, result)
+
+        if result is None:
+            return False
+
+        # Update the request to contain all the information
+        useragent_ip, proxy_ip_list, useragents, notes = result
+
+        # Start with the useragent_ip
+        environ['bark.useragent_ip'] = useragent_ip
+
+        # Next, set up the notes and store the proxy-ip-list
+        environ.setdefault('bark.notes', {})
+        environ['bark.notes']['remoteip-proxy-ip-list'] = proxy_ip_list
+        if notes:
+            environ['bark.notes'].update(notes)
+
+        # Finally, update the useragents header
+        if useragents:
+            environ[self.header_key] = useragents
+        else:
+            del environ[self.header_key]
+
+        return True
+
+    def resolve(self, remote_addr, header):
+        """
+        Resolve a proxy chain.
+
+        :param remote_addr: The address of the client connection.
+        :param header: The value of the proxy header.
+
+        :returns: None if a useragent could not be computed.
+                  Otherwise, a tuple of the useragent IP address, the
+                  comma-separated list of the validated proxies, the
+                  remaining value of the proxy header, which will be
+                  empty if every entry was validated, and a
+                  dictionary of additional notes, or None.
+        """
+
         # Parse the REMOTE_ADDR into an address
-        proxy_ip = _parse_ip(request.environ['REMOTE_ADDR'])
+        proxy_ip = _parse_ip(remote_addr)
         if proxy_ip is None:
-            return False
+            return None
+
+        if self.forwarded:
+            return self.resolve_forwarded(proxy_ip, header)
 
         # First step in proxy calculation is to grab the proxy header
         # value
-        useragents = [a.strip() for a in
-                      request.headers[self.header].split(',')]
+        useragents = [a.strip() for a in header.split(',')]
         useragents = [a for a in useragents if a]
         if not useragents:
-            return False
+            return None
+
+        useragent_ip, proxy_list = self.walk(proxy_ip, useragents)
+
+        return (_format_ip(useragent_ip),
+                ','.join(_format_ip(pxy) for pxy in proxy_list),
+                ','.join(useragents), None)
+
+    def resolve_forwarded(self, proxy_ip, header):
+        """
+        Resolve a proxy chain described by an RFC 7239 Forwarded
+        header.  The "by", "host", and "proto" parameters of the
+        element introducing the useragent are stored in the notes
+        "forwarded-by", "forwarded-host", and "forwarded-proto".
+
+        :param proxy_ip: The address of the client connection, as
+                         returned by _parse_ip().
+        :param header: The value of the Forwarded header.
+
+        :returns: As for resolve().
+        """
+
+        elements = _parse_forwarded(header)
+        if not elements:
+            return None
+
+        # Extract the useragent addresses; malformed elements, or
+        # elements without a "for" parameter, won't parse
+        useragents = [_forwarded_node(params.get('for', ''))
+                      if params else '' for params, end in elements]
+
+        useragent_ip, proxy_list = self.walk(proxy_ip, useragents)
+
+        # Collect the notes from the element introducing the
+        # useragent, if any
+        remaining = len(useragents)
+        notes = None
+        if remaining < len(elements):
+            params = elements[remaining][0]
+            notes = dict(('forwarded-%s' % name, params[name])
+                         for name in _forwarded_notes if name in params)
+
+        # The remaining elements are kept as they were
+        return (_format_ip(useragent_ip),
+                ','.join(_format_ip(pxy) for pxy in proxy_list),
+                header[:elements[remaining - 1][1]] if remaining else '',
+                notes)
+
+    def walk(self, proxy_ip, useragents):
+        """
+        Walk a proxy chain from right to left, validating each
+        useragent against the proxy introducing it.
+
+        :param proxy_ip: The address of the client connection, as
+                         returned by _parse_ip().
+        :param useragents: A list of the useragent addresses listed
+                           in the proxy header, as strings.  The
+                           validated useragents are removed from the
+                           list.
+
+        :returns: A tuple of the address of the validated useragent
+                  and a list of the addresses of the validated
+                  proxies, from left to right.
+        """
 
         # Now, let's build the proxy list
         proxy_list = []
@@ -260,24 +1001,8 @@ class ProxyConfig(object):
         # At this point, useragents has been stripped of the validated
         # user agents, useragent_ip contains the validated user agent
         # IP, and proxy_list contains a list (ordered right to left)
-        # of the proxies...update the request to contain all the
-        # information
-
-        # Start with the useragent_ip
-        request.environ['bark.useragent_ip'] = str(useragent_ip)
-
-        # Next, set up the notes and store the proxy-ip-list
-        request.environ.setdefault('bark.notes', {})
-        request.environ['bark.notes']['remoteip-proxy-ip-list'] = ','.join(
-            str(pxy) for pxy in proxy_list)
-
-        # Finally, update the useragents header
-        if useragents:
-            request.headers[self.header] = ','.join(useragents)
-        else:
-            del request.headers[self.header]
-
-        return True
+        # of the proxies
+        return useragent_ip, proxy_list
 
     def validate(self, proxy_ip, client_ip):
         """
@@ -295,10 +1020,16 @@ class ProxyConfig(object):
         # First, look up the proxy
         if self.pseudo_proxy:
             proxy = self.pseudo_proxy
-        elif proxy_ip not in self.proxies:
-            return False
-        else:
+        elif proxy_ip in self.proxies:
             proxy = self.proxies[proxy_ip]
+        elif self.ranges:
+            version, value = proxy_ip
+            starts, proxies = self.ranges[version]
+            proxy = proxies[bisect.bisect_right(starts, value) - 1]
+            if proxy is None:
+                return False
+        else:
+            return False
 
         # Now, verify that the client is valid
         return client_ip in proxy
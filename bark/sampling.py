@@ -0,0 +1,123 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import threading
+import zlib
+
+from bark import wsgi
+
+
+def rate(text):
+    """
+    A special argument type that interprets a sampling rate.  The
+    rate may be given as a fraction, e.g., "0.01", or as a
+    percentage, e.g., "1%".
+
+    :param text: The text of the rate.
+
+    :returns: The rate, as a float between 0.0 and 1.0.
+    """
+
+    text = text.strip()
+    if text.endswith('%'):
+        value = float(text[:-1]) / 100.0
+    else:
+        value = float(text)
+
+    if not 0.0 <= value <= 1.0:
+        raise ValueError("sampling rate %r is not between 0 and 1" % text)
+
+    return value
+
+
+class Sampler(object):
+    def __init__(self, rate, header=None, note=None):
+        """
+        Initialize a Sampler.  A Sampler decides, before any
+        formatting is done, whether a request should be logged to a
+        log stream, keeping approximately the given fraction of
+        requests.
+
+        The decision is made by comparing a 32-bit draw against a
+        threshold.  If a header or note is specified and present in
+        the request, the draw is the CRC-32 of its value, so that a
+        request--e.g., one with a given request ID--is kept or dropped
+        consistently.  Otherwise, the draw is a random number.  Draws
+        are shared by all the Samplers for a request, so a request
+        kept by a stream with a given rate is also kept by every
+        stream with a higher rate.
+
+        :param rate: The fraction of requests to keep, between 0.0
+                     and 1.0.
+        :param header: The name of a request header to hash, e.g.,
+                       "X-Request-Id".  Optional.
+        :param note: The name of a note to hash.  Only used if no
+                     header is specified.  Optional.
+        """
+
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError("sampling rate %r is not between 0 and 1" %
+                             rate)
+
+        self.rate = rate
+        self.threshold = int(round(rate * (1 << 32)))
+        self.header_key = wsgi.header_key(header) if header else None
+        self.note = None if header else note
+
+        # Counters for the requests kept and dropped
+        self.kept = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, draws):
+        """
+        Decide whether a request should be logged.
+
+        :param environ: The WSGI environment.
+        :param draws: A dictionary shared by all the Samplers for the
+                      request, caching the draws by key.
+
+        :returns: True if the request should be logged, False if it
+                  should be dropped.
+        """
+
+        # Select the key for the draw; None means a random draw
+        if self.header_key:
+            key = environ.get(self.header_key)
+        elif self.note:
+            key = environ.get('bark.notes', {}).get(self.note)
+        else:
+            key = None
+
+        try:
+            draw = draws[key]
+        except KeyError:
+            if key is None:
+                draw = random.getrandbits(32)
+            elif isinstance(key, unicode):
+                draw = zlib.crc32(key.encode('utf8')) & 0xffffffff
+            else:
+                draw = zlib.crc32(key) & 0xffffffff
+            draws[key] = draw
+
+        keep = draw < self.threshold
+        with self._lock:
+            if keep:
+                self.kept += 1
+            else:
+                self.dropped += 1
+
+        return keep
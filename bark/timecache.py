@@ -0,0 +1,122 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import re
+import time
+
+
+# The number of seconds for which the output of each strftime()
+# directive remains unchanged.  Directives not listed here, including
+# any unrecognized directives, are assumed to change every second.
+_granularity = {
+    '%': 86400,
+    'a': 86400, 'A': 86400, 'b': 86400, 'B': 86400, 'C': 86400,
+    'd': 86400, 'D': 86400, 'e': 86400, 'F': 86400, 'g': 86400,
+    'G': 86400, 'h': 86400, 'j': 86400, 'm': 86400, 'n': 86400,
+    't': 86400, 'u': 86400, 'U': 86400, 'V': 86400, 'w': 86400,
+    'W': 86400, 'x': 86400, 'y': 86400, 'Y': 86400, 'z': 86400,
+    'Z': 86400,
+    'H': 3600, 'I': 3600, 'k': 3600, 'l': 3600, 'p': 3600, 'P': 3600,
+    'M': 60, 'R': 60,
+}
+_directive_re = re.compile(r'%[-_0^#]?[0-9]*[EO]?(.)')
+
+
+def granularity(fmtstr):
+    """
+    Determine the natural granularity of a strftime() format string;
+    that is, the number of seconds for which the formatted time
+    remains unchanged.  Only UTC times are considered, so day
+    boundaries always fall on multiples of 86400 seconds.
+
+    :param fmtstr: The strftime() format string.
+
+    :returns: The granularity, in seconds.  This will be 1, 60, 3600,
+              or 86400.
+    """
+
+    return min([_granularity.get(d, 1)
+                for d in _directive_re.findall(fmtstr)] or [86400])
+
+
+class TimeCache(object):
+    def __init__(self, maxsize=1024):
+        """
+        Initialize a TimeCache.  A TimeCache caches the results of
+        formatting UTC times with time.strftime(), keyed by the
+        format string and the time, in units of the format string's
+        natural granularity.  A TimeCache may be shared between
+        threads; no locking is necessary, since the worst a race can
+        do is format the same time twice.
+
+        :param maxsize: The maximum number of formatted times to
+                        cache.  When the cache grows beyond this
+                        size, it is emptied.
+        """
+
+        self.maxsize = maxsize
+        self.cache = {}
+        self.granularities = {}
+
+    def strftime(self, fmtstr, timestamp):
+        """
+        Format a time.  Equivalent to time.strftime(fmtstr,
+        time.gmtime(timestamp)).
+
+        :param fmtstr: The strftime() format string.
+        :param timestamp: The time to format, in seconds since the
+                          epoch.
+
+        :returns: The formatted time.
+        """
+
+        # Determine the time slot for the format string
+        try:
+            gran = self.granularities[fmtstr]
+        except KeyError:
+            gran = self.granularities[fmtstr] = granularity(fmtstr)
+        key = (fmtstr, int(timestamp // gran))
+
+        # Have we already formatted a time in this slot?
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+
+        # Keep the cache bounded
+        if len(self.cache) >= self.maxsize:
+            self.cache.clear()
+
+        result = self.cache[key] = time.strftime(fmtstr,
+                                                 time.gmtime(timestamp))
+        return result
+
+
+# A TimeCache shared by all the time-based conversions
+_cache = TimeCache()
+
+
+def strftime(fmtstr, timestamp):
+    """
+    Format a time using the shared TimeCache.  Equivalent to
+    time.strftime(fmtstr, time.gmtime(timestamp)).
+
+    :param fmtstr: The strftime() format string.
+    :param timestamp: The time to format, in seconds since the epoch.
+
+    :returns: The formatted time.
+    """
+
+    return _cache.strftime(fmtstr, timestamp)
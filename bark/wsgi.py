@@ -0,0 +1,415 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Lightweight request and response objects built directly on the WSGI
+environment and the status and headers passed to start_response().
+Bark's own conversions only need the WSGI environment, the status
+code, and the response headers, so building webob Request and
+Response objects for every request is wasted effort.  These objects
+provide that information, and only construct the equivalent webob
+object if some other attribute--e.g., one used by an extension
+conversion--is requested.
+"""
+
+import collections
+import re
+import string
+import urllib
+
+import webob
+import webob.cookies
+
+
+# Characters which are not quoted in the path; matches webob
+_path_safe = "/~!$&'()*+,;=:@"
+
+# Characters legal in unquoted cookie names and values, and the
+# pattern for an unquoted cookie value; matches webob
+_cookie_chars = (string.ascii_letters + string.digits +
+                 "_~!@#$%^&*()+=-`.?|:/{}<>'")
+_cookie_value = (r"(\w{3},\s[\w\d-]{9,11}\s[\d:]{8}\sGMT|[%s]*)" %
+                 re.escape(_cookie_chars))
+
+# Compiled patterns for locating individual cookies, by cookie name
+_cookie_res = {}
+
+# Cookie names which can be scanned for; webob ends a name at its
+# first "=", and never finds names containing other characters
+_cookie_name_re = re.compile(r'[%s]+\Z' %
+                             re.escape(_cookie_chars.replace('=', '')))
+
+# Whitespace after an "=", which webob skips, so that the following
+# text--which may look like another cookie--is a value
+_cookie_space_re = re.compile(r'=\s')
+
+# Request header names which do not map to HTTP_* keys; matches webob
+_header_keys = {
+    'CONTENT-TYPE': 'CONTENT_TYPE',
+    'CONTENT-LENGTH': 'CONTENT_LENGTH',
+    'CONTENT_TYPE': 'HTTP_CONTENT_TYPE',
+    'CONTENT_LENGTH': 'HTTP_CONTENT_LENGTH',
+}
+
+
+def header_key(name):
+    """
+    Determine the key of the WSGI environment containing a request
+    header.
+
+    :param name: The name of the header, e.g., "User-Agent".
+
+    :returns: The WSGI environment key, e.g., "HTTP_USER_AGENT".
+    """
+
+    name = name.upper()
+    if name in _header_keys:
+        return _header_keys[name]
+    return 'HTTP_' + name.replace('-', '_')
+
+
+def request_path(environ):
+    """
+    Compute the path of a request, without host or query string.  The
+    result is identical to webob's Request.path.
+
+    :param environ: The WSGI environment.
+
+    :returns: The quoted path.
+    """
+
+    return (urllib.quote(environ.get('SCRIPT_NAME', ''), _path_safe) +
+            urllib.quote(environ.get('PATH_INFO', ''), _path_safe))
+
+
+def request_host_url(environ):
+    """
+    Compute the scheme and authority portion of the URL of a request.
+    The result is identical to webob's Request.host_url.
+
+    :param environ: The WSGI environment.
+
+    :returns: The URL of the host, e.g., "http://example.com:8080".
+    """
+
+    scheme = environ.get('wsgi.url_scheme')
+    host = environ.get('HTTP_HOST')
+    if host is not None:
+        if ':' in host and host[-1] != ']':
+            host, port = host.rsplit(':', 1)
+        else:
+            port = None
+    else:
+        host = environ.get('SERVER_NAME')
+        port = environ.get('SERVER_PORT')
+    if (scheme == 'https' and port == '443' or
+            scheme == 'http' and port == '80'):
+        port = None
+
+    url = scheme + '://' + host
+    if port:
+        url += ':%s' % port
+
+    return url
+
+
+def request_url(environ):
+    """
+    Compute the full URL of a request, including the query string.
+    The result is identical to webob's Request.url.
+
+    :param environ: The WSGI environment.
+
+    :returns: The URL.
+    """
+
+    url = request_host_url(environ) + request_path(environ)
+
+    qs = environ.get('QUERY_STRING')
+    if qs:
+        url += '?' + qs
+
+    return url
+
+
+def _cookie_re(name):
+    """
+    Retrieve the compiled regular expression which locates a given
+    cookie in a Cookie header.  The pattern begins with the literal
+    cookie name, which allows the regular expression engine to skip
+    quickly through the header.
+
+    :param name: The name of the cookie.
+
+    :returns: The compiled regular expression.  Group 1 contains the
+              value of the cookie.
+    """
+
+    try:
+        return _cookie_res[name]
+    except KeyError:
+        regex = re.compile(r'%s\s*=\s*%s' % (re.escape(name), _cookie_value))
+        return _cookie_res.setdefault(name, regex)
+
+
+def _cookie_complex(header):
+    """
+    Determine whether a Cookie header is too complex to be scanned for
+    a single cookie, in which case it must be parsed by webob.
+
+    :param header: The Cookie header.
+
+    :returns: True if the header must be parsed by webob, False if it
+              may be scanned.
+    """
+
+    # Quoted or escaped values may contain anything, including text
+    # that looks like another cookie
+    if '"' in header or '\\' in header or _cookie_space_re.search(header):
+        return True
+
+    # A date value ends at "GMT", even if more text follows it; the
+    # search is much faster than a regular expression
+    start = header.find('GMT')
+    while start >= 0:
+        end = start + 3
+        if (start and header[start - 1] in string.whitespace and
+                end < len(header) and header[end] in _cookie_chars):
+            return True
+        start = header.find('GMT', end)
+
+    return False
+
+
+def request_cookie(environ, name):
+    """
+    Retrieve the value of a single request cookie.  Rather than
+    parsing the entire Cookie header, which may be several kilobytes
+    long, the header is scanned for just the requested cookie.  The
+    result is memoized in the WSGI environment, so that looking up
+    the same cookie again--e.g., for another log stream--is cheap.
+    The result is the same as that of webob's Request.cookies; headers
+    which are not simple enough to scan are parsed by webob.
+
+    :param environ: The WSGI environment.
+    :param name: The name of the cookie.
+
+    :returns: The value of the cookie, or None if the cookie is not
+              present.
+    """
+
+    header = environ.get('HTTP_COOKIE', '')
+
+    # Discard the memoized values if the header has changed; whether
+    # the header is too complex to scan is determined when needed
+    cached_header, cookies, hard = environ.get('bark.cookies',
+                                               (None, None, None))
+    if cached_header != header:
+        cookies = {}
+        hard = None
+    elif name in cookies:
+        return cookies[name]
+
+    if name not in header:
+        value = None
+    else:
+        if hard is None:
+            hard = _cookie_complex(header)
+
+        if hard or not _cookie_name_re.match(name):
+            # Let webob sort out the hard cases
+            value = webob.cookies.RequestCookies(environ).get(name)
+        else:
+            # A match preceded by a character legal in cookie names or
+            # values is the tail end of some other cookie; as with
+            # webob, if a cookie appears more than once, the last
+            # value is used
+            value = None
+            for match in _cookie_re(name).finditer(header):
+                start = match.start()
+                if not start or header[start - 1] not in _cookie_chars:
+                    value = match.group(1)
+
+    cookies[name] = value
+    environ['bark.cookies'] = (header, cookies, hard)
+    return value
+
+
+class Request(object):
+    __slots__ = ('environ', '_request')
+
+    def __init__(self, environ):
+        """
+        Initialize a Request.
+
+        :param environ: The WSGI environment.
+        """
+
+        self.environ = environ
+        self._request = None
+
+    def __getattr__(self, name):
+        """
+        Look up any other attribute on the equivalent webob Request,
+        constructing it if necessary.
+
+        :param name: The name of the attribute.
+
+        :returns: The value of the attribute.
+        """
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._request is None:
+            self._request = webob.Request(self.environ)
+        return getattr(self._request, name)
+
+
+class ResponseHeaders(collections.Mapping):
+    def __init__(self, headerlist):
+        """
+        Initialize a ResponseHeaders.  Provides case-insensitive,
+        read-only access to the response headers; as with webob, if a
+        header appears more than once, the last value is used.
+
+        :param headerlist: A list of (name, value) tuples.
+        """
+
+        self._headers = dict((name.lower(), value)
+                             for name, value in headerlist)
+
+    def __getitem__(self, name):
+        """
+        Retrieve the value of a header.
+
+        :param name: The name of the header.
+
+        :returns: The value of the header.
+        """
+
+        return self._headers[name.lower()]
+
+    def __contains__(self, name):
+        """
+        Determine whether a header is present.
+
+        :param name: The name of the header.
+
+        :returns: True if the header is present.
+        """
+
+        return name.lower() in self._headers
+
+    def __iter__(self):
+        """
+        Iterate over the (lower-cased) header names.
+        """
+
+        return iter(self._headers)
+
+    def __len__(self):
+        """
+        Return the number of distinct headers.
+        """
+
+        return len(self._headers)
+
+
+class Response(object):
+    __slots__ = ('status', 'headerlist', '_app_iter', '_headers',
+                 '_response')
+
+    def __init__(self, status, headerlist, app_iter=None):
+        """
+        Initialize a Response.
+
+        :param status: The status string passed to start_response(),
+                       e.g., "200 OK".
+        :param headerlist: The list of headers passed to
+                           start_response().
+        :param app_iter: The response body iterator, if it is
+                         available.
+        """
+
+        self.status = status
+        self.headerlist = headerlist
+        self._app_iter = app_iter
+        self._headers = None
+        self._response = None
+
+    def __getattr__(self, name):
+        """
+        Look up any other attribute on the equivalent webob Response,
+        constructing it if necessary.
+
+        :param name: The name of the attribute.
+
+        :returns: The value of the attribute.
+        """
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._response is None:
+            self._response = webob.Response(
+                status=self.status, headerlist=list(self.headerlist),
+                app_iter=[] if self._app_iter is None else self._app_iter)
+        return getattr(self._response, name)
+
+    @property
+    def app_iter(self):
+        """
+        The response body iterator.  If the webob Response has been
+        constructed, its iterator is used, as it may have consumed the
+        original.
+        """
+
+        if self._response is not None:
+            return self._response.app_iter
+        return self._app_iter
+
+    @property
+    def status_code(self):
+        """
+        The status code, as an integer.
+        """
+
+        return int(self.status.split()[0])
+
+    @property
+    def headers(self):
+        """
+        The response headers, as a case-insensitive mapping.
+        """
+
+        if self._headers is None:
+            self._headers = ResponseHeaders(self.headerlist)
+        return self._headers
+
+    @property
+    def content_length(self):
+        """
+        The value of the Content-Length header, as an integer, or None
+        if it is missing or invalid.  As with webob, if the header
+        appears more than once, the last value is used.
+        """
+
+        for name, value in reversed(self.headerlist):
+            if name.lower() == 'content-length':
+                try:
+                    return int(value) if value else None
+                except ValueError:
+                    return None
+
+        return None
@@ -0,0 +1,106 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Microbenchmarks for cookie extraction with large, real-world Cookie
+headers.  Run from the top of the source tree with "python -m
+benchmarks.cookie".
+"""
+
+import webob.cookies
+
+from bark import wsgi
+from benchmarks import util
+
+
+# A typical mix of analytics, advertising, consent, and session
+# cookies, padded out with opaque tokens to the desired size
+BASE = [
+    ('_ga', 'GA1.2.1234567890.1690000000'),
+    ('_gid', 'GA1.2.987654321.1697000000'),
+    ('_fbp', 'fb.1.1690000000000.1234567890'),
+    ('OptanonConsent', 'isIABGlobal=false&datestamp=Tue+Oct+17+2023+10%3A'
+     '00%3A00+GMT%2B0000&version=202308.1.0&hosts=&consentId=0123abcd-'
+     '4567-89ef-0123-456789abcdef&interactionCount=1&landingPath=NotLan'
+     'dingPage&groups=C0001%3A1%2CC0002%3A1%2CC0003%3A1%2CC0004%3A1'),
+    ('AMCV_0123456789ABCDEF%40AdobeOrg', '-1124106680%7CMCIDTS%7C19647%7C'
+     'MCMID%7C01234567890123456789012345678901234567%7CvVersion%7C5.2.0'),
+]
+
+
+def cookie_header(size, quoted=False):
+    """
+    Construct a Cookie header of approximately the given size.  The
+    logged cookies, "session" and "user", appear at the end.
+
+    :param size: The approximate size of the header, in bytes.
+    :param quoted: If True, include a cookie with a quoted value.
+
+    :returns: The header.
+    """
+
+    cookies = list(BASE)
+    if quoted:
+        cookies.append(('prefs', '"{lang: en, theme: dark}"'))
+    i = 0
+    while len('; '.join('%s=%s' % c for c in cookies)) < size - 100:
+        cookies.append(('tok%d' % i, ('%032x' % (i * 7919)) * 4))
+        i += 1
+    cookies.append(('session', '3f2a9c0e5b7d4e1f8a6c2b9d0e7f1a3c'))
+    cookies.append(('user', 'jdoe'))
+    return '; '.join('%s=%s' % c for c in cookies)
+
+
+def webob_cookies(header):
+    """
+    Look up the logged cookies by parsing the entire header with
+    webob, for comparison.
+    """
+
+    environ = {'HTTP_COOKIE': header}
+    cookies = webob.cookies.RequestCookies(environ)
+    return cookies.get('session'), cookies.get('user')
+
+
+def bark_cookies(header):
+    """
+    Look up the logged cookies by scanning the header for just those
+    cookies.
+    """
+
+    environ = {'HTTP_COOKIE': header}
+    return (wsgi.request_cookie(environ, 'session'),
+            wsgi.request_cookie(environ, 'user'))
+
+
+def main():
+    for name, header in [('4 KB', cookie_header(4096)),
+                         ('8 KB', cookie_header(8192)),
+                         ('8 KB quoted', cookie_header(8192, True))]:
+        assert webob_cookies(header) == bark_cookies(header)
+        util.bench('%s (webob)' % name, lambda: webob_cookies(header),
+                   number=1000)
+        util.bench('%s (scan)' % name, lambda: bark_cookies(header),
+                   number=1000)
+
+    # Subsequent lookups, e.g., by other log streams, are memoized
+    environ = {'HTTP_COOKIE': cookie_header(8192)}
+    wsgi.request_cookie(environ, 'session')
+    util.bench('8 KB (memoized)',
+               lambda: wsgi.request_cookie(environ, 'session'))
+
+
+if __name__ == '__main__':
+    main()
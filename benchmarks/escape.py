@@ -0,0 +1,63 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Microbenchmarks for Conversion.escape().  Run from the top of the
+source tree with "python -m benchmarks.escape".
+"""
+
+from curses import ascii
+
+from bark import conversions
+from benchmarks import util
+
+
+def curses_escape(string):
+    """
+    The original, character-by-character escape() implementation, for
+    comparison.
+    """
+
+    escapes = conversions.Conversion._escapes
+    return ''.join([escapes[c] if (not ascii.isprint(c) or c == '"' or
+                                   c == '\\' or ascii.isctrl(c)) else c
+                    for c in string.encode('utf8')])
+
+
+INPUTS = [
+    ('clean', 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+     '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'),
+    ('clean cookie', '; '.join('cookie%d=%s' % (i, 'x' * 40)
+                               for i in range(40))),
+    ('mixed', 'Mozilla/5.0 "Quoted Agent" \\ with\ttabs and '
+     'https://example.com/referer?q="value"'),
+    ('unicode', u'Mozilla/5.0 (caf\xe9; \u3f26) Gecko'),
+    ('hostile', ''.join(chr(i) for i in range(128)) * 8),
+    ('hostile bytes', ''.join(chr(i) for i in range(256)) * 4),
+]
+
+
+def main():
+    for name, string in INPUTS:
+        # The original implementation cannot handle non-ASCII bytes
+        if isinstance(string, unicode) or max(string) < '\x80':
+            util.bench('%s (original)' % name,
+                       lambda: curses_escape(string), number=500)
+        util.bench('%s (table)' % name,
+                   lambda: conversions.Conversion.escape(string))
+
+
+if __name__ == '__main__':
+    main()
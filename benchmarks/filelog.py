@@ -0,0 +1,54 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Microbenchmarks for the file log stream types.  Run from the top of
+the source tree with "python -m benchmarks.filelog".
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from bark import handlers
+from benchmarks import util
+
+
+MESSAGE = ('10.0.0.1 - - [18/Oct/2026:12:00:00 +0000] '
+           '"GET /sample/path?i=j HTTP/1.1" 200 1234')
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        emit = handlers.wrap_log_handler(logging.FileHandler(
+            os.path.join(tmpdir, 'logging.log')))
+        util.bench('file (logging.FileHandler)', lambda: emit(MESSAGE))
+
+        emit = handlers.file_handler('file', 'bench',
+                                     os.path.join(tmpdir, 'file.log'))
+        util.bench('file', lambda: emit(MESSAGE))
+
+        emit = handlers.buffered_file_handler(
+            'buffered_file', 'bench', os.path.join(tmpdir, 'buffered.log'))
+        util.bench('buffered_file', lambda: emit(MESSAGE))
+        emit.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
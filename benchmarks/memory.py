@@ -0,0 +1,109 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Memory benchmarks: the footprint of the parsed Formats for a filter
+with many log streams, and the data allocated for each request.  Run
+from the top of the source tree with "python -m benchmarks.memory".
+"""
+
+import sys
+import types
+
+import webob
+
+from bark import format
+
+
+# A configuration with many log streams, several sharing formats
+FORMATS = [
+    '%h %l %u %t "%r" %>s %b',
+    '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-agent}i"',
+    '%h "%r" %s %400,501{User-Agent}i %!200{Referer}i %D',
+    '%P %{tid}P %m %U%q %{X-Request-Id}i %T',
+]
+SECTIONS = 48
+
+# Objects shared with the rest of the process, which are not counted
+_SKIP = (type, types.ModuleType, types.FunctionType, types.MethodType,
+         types.BuiltinFunctionType, types.CodeType)
+
+
+def sizeof(obj, seen=None):
+    """
+    Compute the total size of an object and the objects it refers to,
+    counting each object only once.
+
+    :param obj: The object to measure.
+    :param seen: A set of the IDs of objects already counted.
+
+    :returns: A tuple of the size, in bytes, and the number of
+              objects counted.
+    """
+
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, _SKIP):
+        return 0, 0
+    seen.add(id(obj))
+
+    size, count = sys.getsizeof(obj), 1
+    if isinstance(obj, dict):
+        refs = [item for pair in obj.items() for item in pair]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        refs = list(obj)
+    else:
+        refs = []
+        if hasattr(obj, '__dict__'):
+            refs.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            for slot in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, slot):
+                    refs.append(getattr(obj, slot))
+
+    for ref in refs:
+        ref_size, ref_count = sizeof(ref, seen)
+        size += ref_size
+        count += ref_count
+
+    return size, count
+
+
+def report(name, size, count):
+    print "%-40s %10d bytes %6d objects" % (name, size, count)
+
+
+def main():
+    fmts = [FORMATS[i % len(FORMATS)] for i in range(SECTIONS)]
+
+    # Footprint of the parsed Formats
+    formats = [format.Format.parse(fmt) for fmt in fmts]
+    report('%d formats' % SECTIONS, *sizeof(formats))
+    fset = format.FormatSet(formats)
+    report('format set', *sizeof(fset))
+
+    request = webob.Request.blank('/sample/path?i=j')
+    request.environ['REMOTE_ADDR'] = '10.0.0.1'
+    request.headers['User-Agent'] = 'Mozilla/5.0'
+
+    # Allocations for each request, interpreted and compiled
+    interpreted = format.FormatSet([format.Format.parse(fmt, compile=False)
+                                    for fmt in fmts])
+    for name, obj in (('interpreted', interpreted), ('compiled', fset)):
+        report('prepare (%s)' % name, *sizeof(obj.prepare(request)))
+
+
+if __name__ == '__main__':
+    main()
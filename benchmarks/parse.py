@@ -0,0 +1,49 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Microbenchmarks for Format.parse().  Run from the top of the source
+tree with "python -m benchmarks.parse".
+"""
+
+from bark import format
+from benchmarks import util
+from tests.unit import parse_reference
+
+
+FORMATS = [
+    ('common', '%h %l %u %t "%r" %>s %b'),
+    ('combined', '%h %l %u %t "%r" %>s %b "%{Referer}i" '
+     '"%{User-agent}i"'),
+    ('conditional', '%h "%r" %!200,304{Referer}i %400,501{User-agent}i '
+     '%{tenant}n\\t%(custom)'),
+]
+
+
+def main():
+    for name, fmt in FORMATS:
+        util.bench('%s (reference)' % name,
+                   lambda: parse_reference.parse(format.Format(), fmt),
+                   number=2000)
+        util.bench('%s (tokenizer)' % name,
+                   lambda: format.Format._parse(fmt),
+                   number=2000)
+        util.bench('%s (cached)' % name,
+                   lambda: format.Format.parse(fmt),
+                   number=2000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Microbenchmarks for proxy address parsing and validation with many
+address rules.  Run from the top of the source tree with "python -m
+benchmarks.proxy".  Requires netaddr, for comparison.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+
+import netaddr
+
+from bark import proxy
+from bark import wsgi
+from benchmarks import util
+
+
+def netaddr_parse_ip(addr):
+    """
+    The original address parser, building netaddr objects, for
+    comparison.
+    """
+
+    try:
+        address = netaddr.IPAddress(addr.strip())
+    except (ValueError, netaddr.AddrFormatError):
+        return None
+
+    if address.version == 6:
+        try:
+            return address.ipv4()
+        except netaddr.AddrConversionError:
+            pass
+
+    return address
+
+
+def add_rules(pxy, count, rng):
+    """
+    Add address rules to a proxy: mostly accepted /24 networks, with
+    some restricted /28 networks carved out of them.
+
+    :param pxy: The Proxy to add the rules to.
+    :param count: The number of rules.
+    :param rng: A random.Random instance.
+    """
+
+    for i in range(count):
+        net = '%d.%d.%d.0' % (rng.randint(1, 223), rng.randint(0, 255),
+                              rng.randint(0, 255))
+        if i % 4:
+            pxy.accept('%s/24' % net)
+        else:
+            pxy.restrict('%s/28' % net)
+
+
+def networks(count, rng, prefix):
+    """
+    Generate random public IPv4 networks.
+
+    :param count: The number of networks.
+    :param rng: A random.Random instance.
+    :param prefix: The prefix length of the networks.
+
+    :returns: A list of the networks, in CIDR notation.
+    """
+
+    return ['%d.%d.%d.0/%d' % (rng.randint(11, 99), rng.randint(0, 255),
+                               rng.randint(0, 255), prefix)
+            for i in range(count)]
+
+
+def ipset(ranges):
+    """
+    Build a netaddr IPSet from a list of address ranges, for
+    comparison.
+    """
+
+    result = netaddr.IPSet()
+    for version, first, last in ranges:
+        result.add(netaddr.IPRange(netaddr.IPAddress(first, version),
+                                   netaddr.IPAddress(last, version)))
+    return result
+
+
+def main():
+    addrs = ['203.0.113.7', '::ffff:203.0.113.7', '2001:db8::7', 'unknown']
+    for addr in addrs:
+        util.bench('parse %s (netaddr)' % addr,
+                   lambda: netaddr_parse_ip(addr))
+        util.bench('parse %s' % addr, lambda: proxy._parse_ip(addr))
+
+    rng = random.Random(42)
+    probes = [(4, rng.getrandbits(32)) for i in range(100)]
+    ipaddrs = [netaddr.IPAddress(value, version)
+               for version, value in probes]
+
+    for count in (10, 1000, 5000):
+        pxy = proxy.Proxy('10.0.0.1', True)
+        add_rules(pxy, count, rng)
+        accepted = ipset(pxy.accepted)
+        excluded = ipset(pxy.excluded)
+
+        util.bench('%d rules (compile)' % count,
+                   lambda: proxy._compile_index(pxy.accepted, pxy.excluded),
+                   number=1, repeat=1)
+        util.bench('%d rules (IPSet)' % count,
+                   lambda: [addr in accepted and addr not in excluded
+                            for addr in ipaddrs],
+                   number=100)
+        util.bench('%d rules (index)' % count,
+                   lambda: [addr in pxy for addr in probes], number=100)
+
+    # Multi-hop chains through internal proxies to a client
+    config = {
+        'header': 'X-Forwarded-For',
+        'proxies': ', '.join('internal(10.0.0.%d)' % i for i in range(1, 6)),
+    }
+    chain = '203.0.113.7, 10.0.0.5, 10.0.0.4, 10.0.0.3, 10.0.0.2'
+    for cache_size in (None, '1000'):
+        if cache_size:
+            config['cache_size'] = cache_size
+        pc = proxy.ProxyConfig(config)
+        add_rules(pc.proxies[proxy._parse_ip('10.0.0.1')], 5000, rng)
+
+        def forwarded():
+            environ = {'REMOTE_ADDR': '10.0.0.1',
+                       'HTTP_X_FORWARDED_FOR': chain}
+            pc(wsgi.Request(environ))
+
+        util.bench('5-hop chain%s' % (' (cached)' if cache_size else ''),
+                   forwarded)
+
+    # The same chain in a Forwarded header
+    config = {
+        'header': 'Forwarded',
+        'proxies': ', '.join('internal(10.0.0.%d)' % i for i in range(1, 6)),
+    }
+    pc = proxy.ProxyConfig(config)
+    chain = ('for="203.0.113.7:4711";proto=https;host=example.com, '
+             'for=10.0.0.5, for=10.0.0.4, for=10.0.0.3, for=10.0.0.2')
+
+    def forwarded():
+        environ = {'REMOTE_ADDR': '10.0.0.1', 'HTTP_FORWARDED': chain}
+        pc(wsgi.Request(environ))
+
+    util.bench('5-hop chain (Forwarded)', forwarded)
+
+    # Bulk loading of proxies from files, against listing individual
+    # proxy addresses
+    tmpdir = tempfile.mkdtemp()
+    try:
+        proxies_file = os.path.join(tmpdir, 'proxies.txt')
+        rules_file = os.path.join(tmpdir, 'rules.txt')
+        for count in (10000, 50000):
+            proxy_nets = networks(count, rng, 24)
+            with open(proxies_file, 'w') as f:
+                f.write('\n'.join(proxy_nets))
+            with open(rules_file, 'w') as f:
+                f.write('\n'.join(networks(count, rng, 16)))
+
+            config = {
+                'header': 'X-Forwarded-For',
+                'proxies': ', '.join(net[:-3] for net in proxy_nets),
+            }
+            util.bench('%d individual proxies' % count,
+                       lambda: proxy.ProxyConfig(config), number=1)
+
+            config = {
+                'header': 'X-Forwarded-For',
+                'proxies_file': proxies_file,
+            }
+            util.bench('%d proxies from a file' % count,
+                       lambda: proxy.ProxyConfig(config), number=1)
+
+            config['rules_file'] = rules_file
+            util.bench('%d proxies and rules from files' % count,
+                       lambda: proxy.ProxyConfig(config), number=1)
+
+        pc = proxy.ProxyConfig(config)
+        probes = [(proxy._parse_ip(net[:-3]), (4, rng.getrandbits(32)))
+                  for net in rng.sample(proxy_nets, 100)]
+        util.bench('validate 100 via file-loaded ranges',
+                   lambda: [pc.validate(pxy, client)
+                            for pxy, client in probes], number=100)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Microbenchmarks for rendering log messages with a Format.  Run from
+the top of the source tree with "python -m benchmarks.render".
+"""
+
+import webob
+
+from bark import format
+from benchmarks import util
+
+
+FORMATS = [
+    ('common', '%h %l %u %t "%r" %>s %b'),
+    ('conditional', '%h "%r" %s %400,501{User-Agent}i %!200{Referer}i'),
+    ('constant', '%P %l %k %{HOME}e %m %U'),
+]
+
+
+def main():
+    request = webob.Request.blank('/sample/path?i=j')
+    request.environ['REMOTE_ADDR'] = '10.0.0.1'
+    request.headers['User-Agent'] = 'Mozilla/5.0'
+    request.headers['Referer'] = 'http://example.com/'
+    response = webob.Response('This is a response.')
+
+    for name, fmt in FORMATS:
+        interpreted = format.Format.parse(fmt, compile=False)
+        data = interpreted.prepare(request)
+        util.bench('%s (interpreted)' % name,
+                   lambda: interpreted.convert(request, response, data))
+
+        compiled = format.Format.parse(fmt)
+        data = compiled.prepare(request)
+        util.bench('%s (compiled)' % name,
+                   lambda: compiled.convert(request, response, data))
+
+
+if __name__ == '__main__':
+    main()
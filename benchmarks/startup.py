@@ -0,0 +1,77 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmarks for process startup: the time taken to import the Bark
+middleware, and to construct a filter from a configuration.  Each
+measurement is made in a fresh interpreter.  Run from the top of the
+source tree with "python -m benchmarks.startup".
+"""
+
+import subprocess
+import sys
+
+
+SCRIPT = """
+import time
+start = time.time()
+%s
+print '%%.6f' %% (time.time() - start)
+"""
+
+CONSTRUCT = """
+import bark.middleware
+start = time.time()
+bark.middleware.bark_filter(
+    {}, **{
+        'access.type': 'null',
+        'access.format': '%h %l %u %t "%r" %>s %b',
+        'error.type': 'null',
+        'error.format': '%{X-Custom}i %D %P %{User-Agent}i',
+    })
+"""
+
+STATEMENTS = [
+    ('import pkg_resources (reference)', 'import pkg_resources'),
+    ('import bark.middleware', 'import bark.middleware'),
+    ('construct filter', CONSTRUCT),
+]
+
+
+def run(statement, repeat=5):
+    """
+    Time a statement in fresh interpreters and report the best time.
+
+    :param statement: The statement to time.  It may reset the
+                      'start' variable to exclude setup from the
+                      timing.
+    :param repeat: The number of interpreters to time it in.
+
+    :returns: The best time, in seconds.
+    """
+
+    script = SCRIPT % statement
+    return min(float(subprocess.check_output([sys.executable, '-c', script]))
+               for i in range(repeat))
+
+
+def main():
+    for name, statement in STATEMENTS:
+        best = run(statement)
+        print "%-40s %10.3f msec" % (name, best * 1000)
+
+
+if __name__ == '__main__':
+    main()
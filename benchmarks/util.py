@@ -0,0 +1,33 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import timeit
+
+
+def bench(name, func, number=10000, repeat=3):
+    """
+    Time a callable and report the best time per call.
+
+    :param name: The name of the benchmark, for the report.
+    :param func: A callable of no arguments to time.
+    :param number: The number of calls per timing run.
+    :param repeat: The number of timing runs.
+
+    :returns: The best time per call, in seconds.
+    """
+
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print "%-40s %10.3f usec" % (name, best * 1000000)
+    return best
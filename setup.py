@@ -86,6 +86,7 @@ setup(
             'stderr = bark.handlers:stderr_handler',
             'file = bark.handlers:file_handler',
             'watched_file = bark.handlers:watched_file_handler',
+            'buffered_file = bark.handlers:buffered_file_handler',
             'rotating_file = bark.handlers:rotating_file_handler',
             'timed_rotating_file = bark.handlers:timed_rotating_file_handler',
             'socket = bark.handlers:socket_handler',
@@ -94,6 +95,7 @@ setup(
             'nt_event_log = bark.handlers:nt_event_log_handler',
             'smtp = bark.handlers:smtp_handler',
             'http = bark.handlers:http_handler',
+            'async = bark.handlers:async_handler',
         ],
     },
 )
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
 import time
 
 import mock
@@ -61,14 +62,45 @@ class Application(object):
         return "This is a response."
 
 
+# A streaming application, which doesn't set Content-Length
+def streaming_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    for i in range(10):
+        yield 'chunk %d\n' % i
+
+
+# A streaming application, which uses the write() callable
+def writing_app(environ, start_response):
+    write = start_response('200 OK', [('Content-Type', 'text/plain')])
+    for i in range(5):
+        write('write %d\n' % i)
+    return ['chunk %d\n' % i for i in range(5)]
+
+
 # Now, construct a mock WSGI stack
-def construct(delay=None, proxies=None, **kwargs):
+def construct(delay=None, proxies=None, compile=None, streaming=None,
+              app=None, sample=None, exclude=None, **kwargs):
     # Build the configuration
     local_conf = {}
+    if compile is not None:
+        local_conf['compile'] = compile
+    if streaming is not None:
+        local_conf['streaming'] = streaming
     for logname, format in kwargs.items():
         local_conf['%s.format' % logname] = format
         local_conf['%s.type' % logname] = 'memory'
 
+    # Add sampling rates
+    if sample:
+        for logname, rate in sample.items():
+            local_conf['%s.sample' % logname] = rate
+
+    # Add filters
+    if exclude:
+        for logname, options in exclude.items():
+            for opt, value in options.items():
+                local_conf['%s.exclude_%s' % (logname, opt)] = value
+
     # Add proxy information
     if proxies:
         for key, value in proxies.items():
@@ -80,7 +112,8 @@ def construct(delay=None, proxies=None, **kwargs):
         filt = middleware.bark_filter({}, **local_conf)
 
     # Construct the application
-    app = Application(delay=delay)
+    if app is None:
+        app = Application(delay=delay)
 
     # Return the stack
     return filt(app)
@@ -103,6 +136,125 @@ class BarkFunctionTest(unittest2.TestCase):
 
         self.assertEqual(msgs, ['GET /sample/path?i=j HTTP/1.0 -> 200 19'])
 
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_streaming(self):
+        stack = construct(streaming='true', app=streaming_app,
+                          basic='%m %U%q %H -> %s %b %B %{Content-Length}o')
+        environ = webob.Request.blank('/sample/path?i=j').environ
+        start_response = mock.Mock()
+
+        app_iter = stack(environ, start_response)
+        body = ''.join(app_iter)
+
+        self.assertEqual(MemoryHandler.get('basic'), [])
+
+        app_iter.close()
+
+        self.assertEqual(body, ''.join('chunk %d\n' % i for i in range(10)))
+        start_response.assert_called_once_with(
+            '200 OK', [('Content-Type', 'text/plain')], None)
+        self.assertEqual(MemoryHandler.get('basic'), [
+            'GET /sample/path?i=j HTTP/1.0 -> 200 80 80 ',
+        ])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_streaming_write(self):
+        stack = construct(streaming='true', app=writing_app,
+                          basic='%m %U%q %H -> %s %b %B')
+        environ = webob.Request.blank('/sample/path?i=j').environ
+        written = []
+        start_response = mock.Mock(return_value=written.append)
+
+        app_iter = stack(environ, start_response)
+        body = ''.join(app_iter)
+        app_iter.close()
+
+        self.assertEqual(''.join(written),
+                         ''.join('write %d\n' % i for i in range(5)))
+        self.assertEqual(body, ''.join('chunk %d\n' % i for i in range(5)))
+        self.assertEqual(MemoryHandler.get('basic'), [
+            'GET /sample/path?i=j HTTP/1.0 -> 200 80 80',
+        ])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_streaming_buffered(self):
+        stack = construct(streaming='true', basic='%m %U%q %H -> %s %B')
+        req = webob.Request.blank('/sample/path?i=j')
+        resp = req.get_response(stack)
+
+        # Consuming the body closes the application iterator
+        self.assertEqual(resp.body, 'This is a response.')
+
+        msgs = MemoryHandler.get('basic')
+
+        self.assertEqual(msgs, ['GET /sample/path?i=j HTTP/1.0 -> 200 19'])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_shared(self):
+        stack = construct(access='%h "%r" %s %b',
+                          audit='%h "%r" %s %{X-Audit}i',
+                          metrics='%s %b')
+        req = webob.Request.blank('/sample/path?i=j')
+        req.environ['REMOTE_ADDR'] = '10.0.0.1'
+        req.headers['X-Audit'] = 'audited'
+        resp = req.get_response(stack)
+
+        self.assertEqual(MemoryHandler.get('access'), [
+            '10.0.0.1 "GET http://localhost/sample/path?i=j HTTP/1.0" 200 19',
+        ])
+        self.assertEqual(MemoryHandler.get('audit'), [
+            '10.0.0.1 "GET http://localhost/sample/path?i=j HTTP/1.0" 200 '
+            'audited',
+        ])
+        self.assertEqual(MemoryHandler.get('metrics'), ['200 19'])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_interpreted(self):
+        fmt = '100%% %h "%r" %s %!200s %200,404{User-Agent}i %{HOST}i\\t%b'
+        compiled = construct(compiled=fmt)
+        interpreted = construct(compile='false', interpreted=fmt)
+
+        for stack in (compiled, interpreted):
+            req = webob.Request.blank('/sample/path?i=j')
+            req.environ['REMOTE_ADDR'] = '10.0.0.1'
+            req.headers['User-Agent'] = 'Agent "Smith"'
+            resp = req.get_response(stack)
+
+        self.assertEqual(MemoryHandler.get('compiled'),
+                         MemoryHandler.get('interpreted'))
+        self.assertEqual(MemoryHandler.get('compiled'), [
+            '100% 10.0.0.1 "GET http://localhost/sample/path?i=j HTTP/1.0" '
+            '200 - Agent \\"Smith\\" localhost:80\t19',
+        ])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_constants(self):
+        stack = construct(basic='%P %l %k %m %{tid}P')
+        req = webob.Request.blank('/sample/path?i=j')
+        resp = req.get_response(stack)
+
+        pid, rest = MemoryHandler.get('basic')[0].split(' ', 1)
+
+        self.assertEqual(pid, str(os.getpid()))
+        self.assertTrue(rest.startswith('- 0 GET '))
+
+        # After a fork, the child must log its own process ID
+        rfd, wfd = os.pipe()
+        child = os.fork()
+        if not child:  # pragma: nocover
+            try:
+                req = webob.Request.blank('/sample/path?i=j')
+                resp = req.get_response(stack)
+                os.write(wfd, MemoryHandler.get('basic')[-1])
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        msg = os.read(rfd, 1024)
+        os.close(rfd)
+        os.waitpid(child, 0)
+
+        self.assertEqual(msg.split(' ', 1)[0], str(child))
+
     @mock.patch.dict(format.Format._conversion_cache)
     def test_proxy(self):
         proxies = {
@@ -171,3 +323,93 @@ class BarkFunctionTest(unittest2.TestCase):
             '10.5.23.5 10.5.23.1 10.5.23.4,10.5.23.3,10.5.23.2,10.5.23.1 '
             '10.5.23.7,10.5.23.6'
         ])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_proxy_forwarded(self):
+        proxies = {
+            'header': 'Forwarded',
+            'proxies': 'internal(10.5.23.1), internal(10.5.23.2)',
+        }
+        stack = construct(proxies=proxies,
+                          forwarded=("%a %{c}a %{remoteip-proxy-ip-list}n "
+                                     "%{forwarded-proto}n "
+                                     "%{forwarded-host}n %{Forwarded}i"))
+
+        req = webob.Request.blank('/sample/path?i=j')
+        req.environ['REMOTE_ADDR'] = '10.5.23.1'
+        req.headers['Forwarded'] = (
+            'for=10.5.23.7, for="[2001:db8::7]:4711";proto=https;'
+            'host=example.com, for=10.5.23.2')
+        resp = req.get_response(stack)
+
+        self.assertEqual(MemoryHandler.get('forwarded'), [
+            '2001:db8::7 10.5.23.1 10.5.23.2,10.5.23.1 https example.com '
+            'for=10.5.23.7',
+        ])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_proxy_cache(self):
+        proxies = {
+            'header': 'X-Forwarded-For',
+            'proxies': 'internal(10.5.23.1), internal(10.5.23.2)',
+            'cache_size': '10',
+        }
+        stack = construct(proxies=proxies,
+                          cache="%a %{remoteip-proxy-ip-list}n")
+
+        for i in range(3):
+            req = webob.Request.blank('/sample/path?i=j')
+            req.environ['REMOTE_ADDR'] = '10.5.23.1'
+            req.headers['x-forwarded-for'] = '10.5.23.7,10.5.23.2'
+            resp = req.get_response(stack)
+
+        self.assertEqual(MemoryHandler.get('cache'), [
+            '10.5.23.7 10.5.23.2,10.5.23.1',
+        ] * 3)
+        self.assertEqual(stack.proxies.cache.hits, 2)
+        self.assertEqual(stack.proxies.cache.misses, 1)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_sample(self):
+        stack = construct(sample={'none': '0', 'all': '100%'},
+                          none='%m %U', all='%m %U', full='%m %U')
+
+        for i in range(3):
+            req = webob.Request.blank('/sample/path?i=j')
+            resp = req.get_response(stack)
+
+        self.assertEqual(MemoryHandler.get('none'), [])
+        self.assertEqual(MemoryHandler.get('all'), ['GET /sample/path'] * 3)
+        self.assertEqual(MemoryHandler.get('full'), ['GET /sample/path'] * 3)
+        self.assertEqual(stack.samplers['none'].dropped, 3)
+        self.assertEqual(stack.samplers['all'].kept, 3)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_sample_all_dropped(self):
+        stack = construct(sample={'none': '0'}, none='%m %U')
+
+        req = webob.Request.blank('/sample/path?i=j')
+        resp = req.get_response(stack)
+
+        self.assertEqual(resp.body, 'This is a response.')
+        self.assertEqual(MemoryHandler.get('none'), [])
+        self.assertEqual(stack.samplers['none'].dropped, 1)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_exclude(self):
+        exclude = {
+            'access': {'paths': '/healthcheck, /static/'},
+            'errors': {'status': '200, 304'},
+        }
+        for compile in ('true', 'false'):
+            MemoryHandler.clear()
+            stack = construct(exclude=exclude, compile=compile,
+                              access='%m %U %s', errors='%U %s')
+
+            for path in ('/healthcheck', '/static/app.js', '/sample/path'):
+                req = webob.Request.blank(path)
+                resp = req.get_response(stack)
+
+            self.assertEqual(MemoryHandler.get('access'),
+                             ['GET /sample/path 200'])
+            self.assertEqual(MemoryHandler.get('errors'), [])
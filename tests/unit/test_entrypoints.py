@@ -0,0 +1,187 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import zipfile
+
+import mock
+import unittest2
+
+from bark import entrypoints
+from bark import handlers
+
+
+ENTRY_POINTS = """
+[bark.handler]
+test = bark.handlers:null_handler
+Test = bark.handlers:stdout_handler [extra]
+
+[bark.conversion]
+a = bark.conversions:AddressConversion
+"""
+
+
+class EntryPointTest(unittest2.TestCase):
+    def test_init(self):
+        ep = entrypoints.EntryPoint('name', ' some.module:Class.attr [x] ')
+
+        self.assertEqual(ep.name, 'name')
+        self.assertEqual(ep.module, 'some.module')
+        self.assertEqual(ep.attrs, ['Class', 'attr'])
+
+    def test_init_module(self):
+        ep = entrypoints.EntryPoint('name', 'some.module')
+
+        self.assertEqual(ep.module, 'some.module')
+        self.assertEqual(ep.attrs, [])
+
+    def test_load(self):
+        ep = entrypoints.EntryPoint('name', 'bark.entrypoints:EntryPoint.load')
+
+        self.assertEqual(ep.load(), entrypoints.EntryPoint.load)
+
+    def test_load_module(self):
+        ep = entrypoints.EntryPoint('name', 'bark.entrypoints')
+
+        self.assertEqual(ep.load(), entrypoints)
+
+    def test_load_nomodule(self):
+        ep = entrypoints.EntryPoint('name', 'bark.nosuchmodule:attr')
+
+        self.assertRaises(ImportError, ep.load)
+
+    def test_load_noattr(self):
+        ep = entrypoints.EntryPoint('name', 'bark.entrypoints:nosuchattr')
+
+        self.assertRaises(ImportError, ep.load)
+
+
+class ReadTest(unittest2.TestCase):
+    def test_read(self):
+        result = {'bark.handler': ['existing']}
+
+        entrypoints._read(StringIO.StringIO(ENTRY_POINTS), result)
+
+        self.assertEqual(set(result), set(['bark.handler', 'bark.conversion']))
+        self.assertEqual(result['bark.handler'][0], 'existing')
+        self.assertEqual([(ep.name, ep.module, ep.attrs)
+                          for ep in result['bark.handler'][1:]], [
+            ('test', 'bark.handlers', ['null_handler']),
+            ('Test', 'bark.handlers', ['stdout_handler']),
+        ])
+        self.assertEqual([(ep.name, ep.module, ep.attrs)
+                          for ep in result['bark.conversion']], [
+            ('a', 'bark.conversions', ['AddressConversion']),
+        ])
+
+    def test_read_bad(self):
+        result = {}
+
+        entrypoints._read(StringIO.StringIO('not an ini file'), result)
+
+        self.assertEqual(result, {})
+
+
+class ScanTest(unittest2.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, text, *path):
+        filename = os.path.join(self.tmpdir, *path)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(text)
+
+    def test_metadata_dirs(self):
+        for entry in ('a.egg-info', 'b.dist-info', 'c.egg', 'd'):
+            os.mkdir(os.path.join(self.tmpdir, entry))
+        self.write('', 'e.egg-info')
+
+        result = entrypoints._metadata_dirs(self.tmpdir)
+
+        self.assertEqual(result, [
+            os.path.join(self.tmpdir, 'EGG-INFO'),
+            os.path.join(self.tmpdir, 'a.egg-info'),
+            os.path.join(self.tmpdir, 'b.dist-info'),
+            os.path.join(self.tmpdir, 'c.egg', 'EGG-INFO'),
+            os.path.join(self.tmpdir, 'e.egg-info'),
+        ])
+
+    def test_metadata_dirs_missing(self):
+        result = entrypoints._metadata_dirs(os.path.join(self.tmpdir, 'x'))
+
+        self.assertEqual(result, [])
+
+    def test_scan(self):
+        self.write('[grp]\none = mod:one\n',
+                   'path1', 'a.egg-info', 'entry_points.txt')
+        self.write('[grp]\ntwo = mod:two\n',
+                   'path1', 'b.dist-info', 'entry_points.txt')
+        self.write('[grp]\nthree = mod:three\n',
+                   'path1', 'c.egg', 'EGG-INFO', 'entry_points.txt')
+        self.write('[other]\nfour = mod:four\n',
+                   'path2', 'EGG-INFO', 'entry_points.txt')
+        os.mkdir(os.path.join(self.tmpdir, 'path1', 'd.egg-info'))
+        zipped = os.path.join(self.tmpdir, 'e.egg')
+        with zipfile.ZipFile(zipped, 'w') as zf:
+            zf.writestr('EGG-INFO/entry_points.txt',
+                        '[grp]\nfive = mod:five\n')
+        nometa = os.path.join(self.tmpdir, 'f.egg')
+        with zipfile.ZipFile(nometa, 'w') as zf:
+            zf.writestr('mod.py', '')
+        path = [os.path.join(self.tmpdir, 'path1'),
+                os.path.join(self.tmpdir, 'path2'),
+                os.path.join(self.tmpdir, 'path1'),
+                os.path.join(self.tmpdir, 'missing'),
+                zipped, nometa]
+
+        with mock.patch.object(sys, 'path', path):
+            result = entrypoints._scan()
+
+        self.assertEqual(set(result), set(['grp', 'other']))
+        self.assertEqual([ep.name for ep in result['grp']],
+                         ['one', 'two', 'three', 'five'])
+        self.assertEqual([ep.name for ep in result['other']], ['four'])
+
+
+class IterEntryPointsTest(unittest2.TestCase):
+    @mock.patch.object(entrypoints, '_entry_points', None)
+    @mock.patch.object(entrypoints, '_scan', return_value={
+        'grp': [entrypoints.EntryPoint('one', 'mod:one'),
+                entrypoints.EntryPoint('two', 'mod:two'),
+                entrypoints.EntryPoint('one', 'mod:other')],
+    })
+    def test_iter_entry_points(self, mock_scan):
+        result = list(entrypoints.iter_entry_points('grp', 'one'))
+
+        self.assertEqual([ep.attrs for ep in result], [['one'], ['other']])
+        self.assertEqual(list(entrypoints.iter_entry_points('grp', 'x')), [])
+        self.assertEqual(list(entrypoints.iter_entry_points('x', 'one')), [])
+        mock_scan.assert_called_once_with()
+
+    def test_installed(self):
+        # Bark's own entry points must be found
+        result = list(entrypoints.iter_entry_points('bark.handler', 'file'))
+
+        self.assertEqual([ep.load() for ep in result],
+                         [handlers.file_handler])
@@ -0,0 +1,116 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest2
+
+from bark import filters
+
+
+class ParseTest(unittest2.TestCase):
+    def test_none(self):
+        options = {'arg': 'value'}
+
+        self.assertEqual(filters.parse(options), None)
+        self.assertEqual(options, {'arg': 'value'})
+
+    def test_parse(self):
+        options = {
+            'arg': 'value',
+            'exclude_paths': '/healthcheck, /static/,',
+            'exclude_methods': 'options, HEAD',
+            'exclude_headers': 'X-Health-Check',
+            'exclude_status': '304, 404',
+        }
+
+        result = filters.parse(options)
+
+        self.assertEqual(options, {'arg': 'value'})
+        self.assertEqual(result.paths, ['/healthcheck', '/static/'])
+        self.assertEqual(result.methods, frozenset(['OPTIONS', 'HEAD']))
+        self.assertEqual(result.header_keys,
+                         frozenset(['HTTP_X_HEALTH_CHECK']))
+        self.assertEqual(result.statuses, frozenset([304, 404]))
+
+    def test_parse_status_only(self):
+        result = filters.parse({'exclude_status': '304'})
+
+        self.assertEqual(result.paths, [])
+        self.assertEqual(result.path_re, None)
+        self.assertEqual(result.request_filter, False)
+
+    def test_parse_bad_status(self):
+        options = {
+            'exclude_paths': '/healthcheck',
+            'exclude_status': '304, redirect',
+        }
+
+        with self.assertRaises(ValueError) as cm:
+            filters.parse(options)
+
+        self.assertEqual(str(cm.exception), "invalid status code 'redirect'")
+        self.assertEqual(options, {})
+
+
+class FilterTest(unittest2.TestCase):
+    def test_init(self):
+        filt = filters.Filter()
+
+        self.assertEqual(filt.paths, [])
+        self.assertEqual(filt.path_re, None)
+        self.assertEqual(filt.methods, frozenset())
+        self.assertEqual(filt.header_keys, frozenset())
+        self.assertEqual(filt.statuses, frozenset())
+        self.assertEqual(filt.request_filter, False)
+
+    def test_paths(self):
+        filt = filters.Filter(paths=['/healthcheck', '/static/', '/a.b'])
+
+        self.assertEqual(filt.request_filter, True)
+        for environ, expected in [
+                ({'PATH_INFO': '/healthcheck'}, False),
+                ({'PATH_INFO': '/healthcheck/deep'}, False),
+                ({'PATH_INFO': '/static/app.js'}, False),
+                ({'SCRIPT_NAME': '/static', 'PATH_INFO': '/app.js'}, False),
+                ({'PATH_INFO': '/a.b'}, False),
+                ({'PATH_INFO': '/axb'}, True),
+                ({'PATH_INFO': '/static'}, True),
+                ({'PATH_INFO': '/api/healthcheck'}, True),
+                ({}, True)]:
+            self.assertEqual(filt(environ), expected, environ)
+
+    def test_methods(self):
+        filt = filters.Filter(methods=['options', 'HEAD'])
+
+        self.assertEqual(filt.request_filter, True)
+        self.assertEqual(filt({'REQUEST_METHOD': 'OPTIONS'}), False)
+        self.assertEqual(filt({'REQUEST_METHOD': 'HEAD'}), False)
+        self.assertEqual(filt({'REQUEST_METHOD': 'POST'}), True)
+        self.assertEqual(filt({}), True)
+
+    def test_headers(self):
+        filt = filters.Filter(headers=['X-Health-Check', 'Content-Type'])
+
+        self.assertEqual(filt.request_filter, True)
+        self.assertEqual(filt({'HTTP_X_HEALTH_CHECK': ''}), False)
+        self.assertEqual(filt({'CONTENT_TYPE': 'text/plain'}), False)
+        self.assertEqual(filt({'HTTP_USER_AGENT': 'agent'}), True)
+
+    def test_accept(self):
+        filt = filters.Filter(statuses=[304, 404])
+
+        self.assertEqual(filt.request_filter, False)
+        self.assertEqual(filt.accept(200), True)
+        self.assertEqual(filt.accept(304), False)
+        self.assertEqual(filt.accept(404), False)
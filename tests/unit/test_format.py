@@ -13,388 +13,65 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
+import random
+
 import mock
-import pkg_resources
 import unittest2
 
 from bark import conversions
 from bark import format
+from tests.unit import parse_reference
 
 
 class TestException(Exception):
     pass
 
 
-class ParseStateTest(unittest2.TestCase):
-    def test_init(self):
-        state = format.ParseState('fmt', 'format')
-
-        self.assertEqual(state.fmt, 'fmt')
-        self.assertEqual(state.format, 'format')
-        self.assertEqual(state.state, ['string'])
-        self.assertEqual(state.str_begin, 0)
-        self.assertEqual(state.param_begin, None)
-        self.assertEqual(state.conv_begin, None)
-        self.assertEqual(state.modifier, None)
-        self.assertEqual(state.codes, [])
-        self.assertEqual(state.reject, False)
-        self.assertEqual(state.ignore, 0)
-        self.assertEqual(state.code_last, False)
-
-    def test_eq(self):
-        state = format.ParseState('fmt', 'format')
-        state.state = ['string', 'other']
-
-        self.assertFalse(state == 'string')
-        self.assertTrue(state == 'other')
-
-    def test_pop_state_noidx(self):
-        state = format.ParseState('fmt', 'format')
-        state.state = ['string', 'other']
-
-        state.pop_state()
-
-        self.assertEqual(state.state, ['string'])
-        self.assertEqual(state.str_begin, 0)
-
-    def test_pop_state_withidx(self):
-        state = format.ParseState('fmt', 'format')
-        state.state = ['string', 'other']
-
-        state.pop_state(5)
-
-        self.assertEqual(state.state, ['string'])
-        self.assertEqual(state.str_begin, 5)
-
-    def test_check_ignore(self):
-        state = format.ParseState('fmt', 'format')
-        state.ignore = 1
-
-        self.assertTrue(state.check_ignore())
-        self.assertEqual(state.ignore, 0)
-        self.assertFalse(state.check_ignore())
-        self.assertEqual(state.ignore, 0)
-
-    def test_set_ignore(self):
-        state = format.ParseState('fmt', 'format')
-
-        state.set_ignore(1)
-
-        self.assertEqual(state.ignore, 1)
-
-        state.set_ignore(2)
-
-        self.assertEqual(state.ignore, 3)
-
-    def test_add_text_empty(self):
-        state = format.ParseState(mock.Mock(), 'a format string')
-        state.str_begin = 2
-
-        state.add_text(2)
-
-        self.assertFalse(state.fmt.append_text.called)
-        self.assertEqual(state.str_begin, 2)
-
-    def test_add_text_nonext(self):
-        state = format.ParseState(mock.Mock(), 'a format string')
-        state.str_begin = 2
-
-        state.add_text(8)
-
-        state.fmt.append_text.assert_called_once_with('format')
-        self.assertEqual(state.str_begin, 2)
-
-    def test_add_text_withnext(self):
-        state = format.ParseState(mock.Mock(), 'a format string')
-        state.str_begin = 2
-
-        state.add_text(8, 8)
-
-        state.fmt.append_text.assert_called_once_with('format')
-        self.assertEqual(state.str_begin, 8)
-
-    def test_add_escape_available(self):
-        state = format.ParseState(mock.Mock(
-            _unescape={'\\n': '\n'}), 'a \\n format string')
-        state.str_begin = 2
-
-        state.add_escape(4, 'n')
-
-        state.fmt.append_text.assert_called_once_with('\n')
-
-    def test_add_escape_unavailable(self):
-        state = format.ParseState(mock.Mock(
-            _unescape={'\\n': '\n'}), 'a \\t format string')
-        state.str_begin = 2
-
-        state.add_escape(4, 't')
-
-        state.fmt.append_text.assert_called_once_with('t')
-
-    def test_set_param(self):
-        state = format.ParseState('fmt', 'a format string')
-        state.modifier = mock.Mock()
-        state.param_begin = 2
-
-        state.set_param(8)
-
-        state.modifier.set_param.assert_called_once_with('format')
-
-    def test_set_conversion_noconv_nocodes(self):
-        state = format.ParseState(mock.Mock(**{
-            '_get_conversion.return_value': 'fake_conversion',
-        }), 'a format string')
-        modifier = mock.Mock()
-        state.modifier = modifier
-        state.param_begin = 2
-        state.reject = True
-        state.code_last = True
-
-        state.set_conversion(7)
-
-        self.assertFalse(modifier.set_codes.called)
-        state.fmt._get_conversion.assert_called_once_with('t', modifier)
-        state.fmt.append_conv.assert_called_once_with('fake_conversion')
-        self.assertEqual(state.param_begin, None)
-        self.assertEqual(state.conv_begin, None)
-        self.assertEqual(state.modifier, None)
-        self.assertEqual(state.codes, [])
-        self.assertEqual(state.reject, False)
-        self.assertEqual(state.code_last, False)
-
-    def test_set_conversion_withconv(self):
-        state = format.ParseState(mock.Mock(**{
-            '_get_conversion.return_value': 'fake_conversion',
-        }), 'a format string')
-        modifier = mock.Mock()
-        state.modifier = modifier
-        state.param_begin = 2
-        state.conv_begin = 2
-        state.reject = True
-        state.code_last = True
-
-        state.set_conversion(8)
-
-        self.assertFalse(modifier.set_codes.called)
-        state.fmt._get_conversion.assert_called_once_with('format', modifier)
-        state.fmt.append_conv.assert_called_once_with('fake_conversion')
-        self.assertEqual(state.param_begin, None)
-        self.assertEqual(state.conv_begin, None)
-        self.assertEqual(state.modifier, None)
-        self.assertEqual(state.codes, [])
-        self.assertEqual(state.reject, False)
-        self.assertEqual(state.code_last, False)
-
-    def test_set_conversion_withcodes(self):
-        state = format.ParseState(mock.Mock(**{
-            '_get_conversion.return_value': 'fake_conversion',
-        }), 'a format string')
-        modifier = mock.Mock()
-        state.modifier = modifier
-        state.param_begin = 2
-        state.codes = [101, 202, 303]
-        state.reject = 'reject'
-        state.code_last = True
-
-        state.set_conversion(7)
-
-        modifier.set_codes.assert_called_once_with([101, 202, 303], 'reject')
-        state.fmt._get_conversion.assert_called_once_with('t', modifier)
-        state.fmt.append_conv.assert_called_once_with('fake_conversion')
-        self.assertEqual(state.param_begin, None)
-        self.assertEqual(state.conv_begin, None)
-        self.assertEqual(state.modifier, None)
-        self.assertEqual(state.codes, [])
-        self.assertEqual(state.reject, False)
-        self.assertEqual(state.code_last, False)
-
-    def test_set_reject(self):
-        state = format.ParseState('fmt', 'format')
-
-        state.set_reject()
-
-        self.assertEqual(state.reject, True)
-
-    def test_set_code_short(self):
-        state = format.ParseState('fmt', 'a 1')
-
-        result = state.set_code(2)
-
-        self.assertEqual(result, False)
-        self.assertEqual(state.codes, [])
-        self.assertEqual(state.ignore, 0)
-        self.assertEqual(state.code_last, False)
-
-    def test_set_code_bad(self):
-        state = format.ParseState('fmt', 'a 10o')
-
-        result = state.set_code(2)
-
-        self.assertEqual(result, False)
-        self.assertEqual(state.codes, [])
-        self.assertEqual(state.ignore, 0)
-        self.assertEqual(state.code_last, False)
-
-    def test_set_code(self):
-        state = format.ParseState('fmt', 'a 101')
-
-        result = state.set_code(2)
-
-        self.assertEqual(result, True)
-        self.assertEqual(state.codes, [101])
-        self.assertEqual(state.ignore, 2)
-        self.assertEqual(state.code_last, True)
-
-    def test_end_state_nostr(self):
-        state = format.ParseState(mock.Mock(), 'format')
-        state.str_begin = 6
-
-        result = state.end_state()
-
-        self.assertFalse(state.fmt.append_text.called)
-        self.assertEqual(result, state.fmt)
-
-    def test_end_state_longstack(self):
-        state = format.ParseState(mock.Mock(), 'format')
-        state.state = ['string', 'other']
-
-        result = state.end_state()
-
-        state.fmt.append_text.assert_called_once_with(
-            "(Bad format string; ended in state 'other')")
-        self.assertEqual(result, state.fmt)
-
-    def test_end_state_wrongstate(self):
-        state = format.ParseState(mock.Mock(), 'format')
-        state.state = ['other']
-
-        result = state.end_state()
-
-        state.fmt.append_text.assert_called_once_with(
-            "(Bad format string; ended in state 'other')")
-        self.assertEqual(result, state.fmt)
-
-    def test_end_state(self):
-        state = format.ParseState(mock.Mock(), 'format')
-
-        result = state.end_state()
-
-        state.fmt.append_text.assert_called_once_with('format')
-        self.assertEqual(result, state.fmt)
-
-    @mock.patch.object(conversions, 'Modifier', return_value='some_conv')
-    def test_conversion(self, mock_Modifier):
-        state = format.ParseState('fmt', 'format')
-        state.str_begin = 2
-        state.param_begin = 2
-        state.conv_begin = 2
-        state.modifier = 'modifier'
-        state.codes = [101, 202]
-        state.reject = True
-        state.code_last = True
-
-        state.conversion(8)
-
-        self.assertEqual(state.state, ['string', 'conversion'])
-        self.assertEqual(state.str_begin, 8)
-        self.assertEqual(state.param_begin, None)
-        self.assertEqual(state.conv_begin, None)
-        self.assertEqual(state.modifier, 'some_conv')
-        self.assertEqual(state.codes, [])
-        self.assertEqual(state.reject, False)
-        self.assertEqual(state.code_last, False)
-        mock_Modifier.assert_called_once_with()
-
-    def test_escape(self):
-        state = format.ParseState('fmt', 'format')
-        state.str_begin = 2
-
-        state.escape(8)
-
-        self.assertEqual(state.state, ['string', 'escape'])
-        self.assertEqual(state.str_begin, 8)
-
-    def test_param(self):
-        state = format.ParseState('fmt', 'format')
-        state.param_begin = 2
-
-        state.param(8)
-
-        self.assertEqual(state.state, ['string', 'param'])
-        self.assertEqual(state.param_begin, 8)
-
-    def test_conv(self):
-        state = format.ParseState('fmt', 'format')
-        state.conv_begin = 2
-
-        state.conv(8)
-
-        self.assertEqual(state.state, ['string', 'conv'])
-        self.assertEqual(state.conv_begin, 8)
-
-
 class FakeConversion(conversions.Conversion):
     def convert(self, request, response, data):
         pass
 
 
-class FakeStringConversion(object):
-    def __init__(self, *text):
-        self.text = list(text)
+class MockConversion(FakeConversion):
+    def __init__(self, conv_chr, modifier, result):
+        super(MockConversion, self).__init__(conv_chr, modifier)
 
-    def append(self, text):
-        self.text.append(text)
+        self.convert = mock.Mock(return_value=result)
+
+
+class FakeStringConversion(object):
+    def __init__(self, string):
+        self.string = string
 
 
 class FormatTest(unittest2.TestCase):
     @mock.patch.dict(format.Format._conversion_cache)
+    @mock.patch.dict(format.Format._interned)
     @mock.patch.object(conversions, 'StringConversion',
                        return_value=mock.Mock())
-    @mock.patch('pkg_resources.iter_entry_points',
+    @mock.patch('bark.entrypoints.iter_entry_points',
                 return_value=[
                     mock.Mock(**{'load.side_effect': ImportError}),
                     mock.Mock(**{'load.side_effect': ImportError}),
                 ])
     def test_get_conversion_error(self, mock_iter_entry_points,
                                   mock_StringConversion):
-        result = format.Format._get_conversion('a', 'modifier')
+        result = format.Format._get_conversion('y', 'modifier')
 
         self.assertEqual(id(result), id(mock_StringConversion.return_value))
-        mock_iter_entry_points.assert_called_once_with('bark.conversion', 'a')
+        mock_iter_entry_points.assert_called_once_with('bark.conversion', 'y')
         mock_iter_entry_points.return_value[0].load.assert_called_once_with()
         mock_iter_entry_points.return_value[1].load.assert_called_once_with()
         mock_StringConversion.assert_called_once_with(
-            "(Unknown conversion '%a')")
-        self.assertEqual(format.Format._conversion_cache, dict(a=None))
+            "(Unknown conversion '%y')")
+        self.assertEqual(format.Format._conversion_cache, dict(y=None))
 
     @mock.patch.dict(format.Format._conversion_cache)
+    @mock.patch.dict(format.Format._interned)
     @mock.patch.object(conversions, 'StringConversion',
                        return_value=mock.Mock())
-    @mock.patch('pkg_resources.iter_entry_points',
-                return_value=[
-                    mock.Mock(**{
-                        'load.side_effect': pkg_resources.UnknownExtra,
-                    }),
-                    mock.Mock(**{
-                        'load.side_effect': pkg_resources.UnknownExtra,
-                    }),
-                ])
-    def test_get_conversion_unknown_extra(self, mock_iter_entry_points,
-                                          mock_StringConversion):
-        result = format.Format._get_conversion('a', 'modifier')
-
-        self.assertEqual(id(result), id(mock_StringConversion.return_value))
-        mock_iter_entry_points.assert_called_once_with('bark.conversion', 'a')
-        mock_iter_entry_points.return_value[0].load.assert_called_once_with()
-        mock_iter_entry_points.return_value[1].load.assert_called_once_with()
-        mock_StringConversion.assert_called_once_with(
-            "(Unknown conversion '%a')")
-        self.assertEqual(format.Format._conversion_cache, dict(a=None))
-
-    @mock.patch.dict(format.Format._conversion_cache)
-    @mock.patch.object(conversions, 'StringConversion',
-                       return_value=mock.Mock())
-    @mock.patch('pkg_resources.iter_entry_points',
+    @mock.patch('bark.entrypoints.iter_entry_points',
                 return_value=[
                     mock.Mock(**{'load.side_effect': TestException}),
                     mock.Mock(**{'load.side_effect': TestException}),
@@ -402,38 +79,55 @@ class FormatTest(unittest2.TestCase):
     def test_get_conversion_other_exception(self, mock_iter_entry_points,
                                             mock_StringConversion):
         self.assertRaises(TestException, format.Format._get_conversion,
-                          'a', 'modifier')
-        mock_iter_entry_points.assert_called_once_with('bark.conversion', 'a')
+                          'y', 'modifier')
+        mock_iter_entry_points.assert_called_once_with('bark.conversion', 'y')
         mock_iter_entry_points.return_value[0].load.assert_called_once_with()
         self.assertFalse(mock_iter_entry_points.return_value[1].load.called)
         self.assertFalse(mock_StringConversion.called)
         self.assertEqual(format.Format._conversion_cache, {})
 
     @mock.patch.dict(format.Format._conversion_cache)
+    @mock.patch.dict(format.Format._interned)
     @mock.patch.object(conversions, 'StringConversion',
                        return_value=mock.Mock())
-    @mock.patch('pkg_resources.iter_entry_points',
+    @mock.patch('bark.entrypoints.iter_entry_points',
                 return_value=[mock.Mock(**{
                     'load.return_value': mock.Mock(return_value='fake_conv'),
                 })])
     def test_get_conversion_load(self, mock_iter_entry_points,
                                  mock_StringConversion):
-        result = format.Format._get_conversion('a', 'modifier')
+        result = format.Format._get_conversion('y', 'modifier')
 
         self.assertEqual(result, 'fake_conv')
-        mock_iter_entry_points.assert_called_once_with('bark.conversion', 'a')
+        mock_iter_entry_points.assert_called_once_with('bark.conversion', 'y')
         mock_load = mock_iter_entry_points.return_value[0].load
         mock_load.assert_called_once_with()
-        mock_load.return_value.assert_called_once_with('a', 'modifier')
+        mock_load.return_value.assert_called_once_with('y', 'modifier')
         self.assertFalse(mock_StringConversion.called)
         self.assertEqual(format.Format._conversion_cache,
-                         dict(a=mock_load.return_value))
+                         dict(y=mock_load.return_value))
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    @mock.patch.dict(format.Format._interned)
+    @mock.patch.dict(conversions.registry,
+                     y=mock.Mock(return_value='fake_conv'))
+    @mock.patch('bark.entrypoints.iter_entry_points',
+                side_effect=Exception)
+    def test_get_conversion_builtin(self, mock_iter_entry_points):
+        result = format.Format._get_conversion('y', 'modifier')
+
+        self.assertEqual(result, 'fake_conv')
+        self.assertFalse(mock_iter_entry_points.called)
+        conversions.registry['y'].assert_called_once_with('y', 'modifier')
+        self.assertEqual(format.Format._conversion_cache,
+                         dict(y=conversions.registry['y']))
 
     @mock.patch.dict(format.Format._conversion_cache,
                      a=mock.Mock(return_value='fake_conv'))
+    @mock.patch.dict(format.Format._interned)
     @mock.patch.object(conversions, 'StringConversion',
                        return_value=mock.Mock())
-    @mock.patch('pkg_resources.iter_entry_points',
+    @mock.patch('bark.entrypoints.iter_entry_points',
                 side_effect=Exception)
     def test_get_conversion_cached(self, mock_iter_entry_points,
                                    mock_StringConversion):
@@ -446,14 +140,81 @@ class FormatTest(unittest2.TestCase):
             'a', 'modifier')
         self.assertFalse(mock_StringConversion.called)
 
-    @mock.patch.object(format, 'ParseState')
-    def test_parse_empty(self, mock_ParseState):
+    @mock.patch.dict(format.Format._conversion_cache,
+                     a=mock.Mock(side_effect=lambda c, m: mock.Mock()))
+    @mock.patch.dict(format.Format._interned)
+    def test_get_conversion_interned(self):
+        result1 = format.Format._get_conversion(
+            'a', conversions.Modifier(param='spam'))
+        result2 = format.Format._get_conversion(
+            'a', conversions.Modifier(param='spam'))
+        result3 = format.Format._get_conversion(
+            'a', conversions.Modifier(param='other'))
+
+        self.assertIs(result1, result2)
+        self.assertIsNot(result1, result3)
+        self.assertEqual(format.Format._conversion_cache['a'].call_count, 2)
+
+    @mock.patch.dict(format.Format._parse_cache)
+    def test_parse_cached(self):
+        with mock.patch.object(format.Format, '_parse',
+                               wraps=format.Format._parse) as mock_parse:
+            fmt1 = format.Format.parse('%h %s %!200s')
+            fmt2 = format.Format.parse('%h %s %!200s')
+            fmt3 = format.Format.parse('%h %s %!200s', compile=False)
+
+        mock_parse.assert_called_once_with('%h %s %!200s')
+        self.assertIsNot(fmt1, fmt2)
+        self.assertIsNot(fmt1.conversions, fmt2.conversions)
+        for conv1, conv2, conv3 in zip(fmt1.conversions, fmt2.conversions,
+                                       fmt3.conversions):
+            self.assertIs(conv1, conv2)
+            self.assertIs(conv1, conv3)
+        self.assertIs(fmt1._render, fmt2._render)
+        self.assertNotEqual(fmt1._render, None)
+        self.assertEqual(fmt3._render, None)
+
+    @mock.patch.dict(format.Format._parse_cache)
+    def test_parse_cached_append(self):
+        fmt1 = format.Format.parse('%h %s')
+        fmt1.append_text(' appended')
+
+        fmt2 = format.Format.parse('%h %s')
+
+        self.assertEqual(str(fmt1), '%h %s appended')
+        self.assertEqual(str(fmt2), '%h %s')
+        self.assertNotEqual(fmt2._render, None)
+
+    def test_parse_interned(self):
+        fmt1 = format.Format.parse('%h %{X-Foo}i %s')
+        fmt2 = format.Format.parse('%s %{X-Foo}i')
+
+        self.assertIs(fmt1.conversions[4], fmt2.conversions[0])
+        self.assertIs(fmt1.conversions[2], fmt2.conversions[2])
+
+    def test_parse_empty(self):
         fmt = format.Format.parse('')
 
-        self.assertFalse(mock_ParseState.called)
         self.assertIsInstance(fmt, format.Format)
         self.assertEqual(fmt.conversions, [])
+        self.assertNotEqual(fmt._render, None)
+
+    def test_parse_empty_nocompile(self):
+        fmt = format.Format.parse('', compile=False)
+
+        self.assertIsInstance(fmt, format.Format)
+        self.assertEqual(fmt.conversions, [])
+        self.assertEqual(fmt._render, None)
+
+    def test_parse_compiled(self):
+        fmt = format.Format.parse('%s %!200s', compile=False)
+        compiled = format.Format.parse('%s %!200s')
+
+        self.assertEqual(fmt._render, None)
+        self.assertNotEqual(compiled._render, None)
+        self.assertEqual(str(compiled), str(fmt))
 
+    @mock.patch.dict(format.Format._parse_cache)
     @mock.patch.object(format.Format, '_get_conversion', FakeConversion)
     @mock.patch.object(format.Format, 'append_text',
                        lambda self, text: self.conversions.append(text))
@@ -477,22 +238,24 @@ class FormatTest(unittest2.TestCase):
             # Add a parameter
             '%{param}i'
             # Try a multi-character conversion spec
-            '%(spec)'
+            '%(spec)',
+            compile=False,
         )
 
-        self.assertEqual(fmt.conversions[:7],
-                         ['string %', ' ', '\t', ' ', '\n', ' ', '\\'])
+        self.assertEqual(fmt.conversions[:8],
+                         ['string ', '%', ' ', '\t', ' ', '\n', ' ', '\\'])
 
         expected = ['%a', '%b', '%c', '%101d', '%!202e', '%303,404f',
                     '%!505,606g', '%1']
-        for conv, expect in zip(fmt.conversions[7:15], expected):
+        for conv, expect in zip(fmt.conversions[8:16], expected):
             self.assertIsInstance(conv, FakeConversion)
             self.assertEqual(str(conv), expect)
 
-        self.assertEqual(fmt.conversions[15], '0h')
+        self.assertEqual(fmt.conversions[16], '0h')
 
         expected = ['%{param}i', '%(spec)']
-        for conv, expect in zip(fmt.conversions[16:], expected):
+        self.assertEqual(len(fmt.conversions[17:]), len(expected))
+        for conv, expect in zip(fmt.conversions[17:], expected):
             self.assertIsInstance(conv, FakeConversion)
             self.assertEqual(str(conv), expect)
 
@@ -500,6 +263,7 @@ class FormatTest(unittest2.TestCase):
         fmt = format.Format()
 
         self.assertEqual(fmt.conversions, [])
+        self.assertEqual(fmt._render, None)
 
     def test_str(self):
         fmt = format.Format()
@@ -527,20 +291,21 @@ class FormatTest(unittest2.TestCase):
         self.assertEqual(len(fmt.conversions), 2)
         self.assertEqual(fmt.conversions[0], "something")
         self.assertIsInstance(fmt.conversions[1], FakeStringConversion)
-        self.assertEqual(fmt.conversions[1].text, ['some text'])
+        self.assertEqual(fmt.conversions[1].string, 'some text')
 
     @mock.patch.object(conversions, 'StringConversion', FakeStringConversion)
     def test_append_text_preceed(self):
         fmt = format.Format()
-        fmt.conversions.extend(["something",
-                                FakeStringConversion("other text")])
+        other = FakeStringConversion("other text")
+        fmt.conversions.extend(["something", other])
 
         fmt.append_text('some text')
 
         self.assertEqual(len(fmt.conversions), 2)
         self.assertEqual(fmt.conversions[0], "something")
         self.assertIsInstance(fmt.conversions[1], FakeStringConversion)
-        self.assertEqual(fmt.conversions[1].text, ['other text', 'some text'])
+        self.assertEqual(fmt.conversions[1].string, 'other textsome text')
+        self.assertEqual(other.string, 'other text')
 
     def test_append_conv(self):
         fmt = format.Format()
@@ -549,20 +314,125 @@ class FormatTest(unittest2.TestCase):
 
         self.assertEqual(fmt.conversions, ['conversion'])
 
+    def test_append_discards_render(self):
+        fmt = format.Format().compile()
+
+        fmt.append_text('some text')
+
+        self.assertEqual(fmt._render, None)
+
+        fmt.compile()
+        fmt.append_conv(FakeConversion('a', conversions.Modifier()))
+
+        self.assertEqual(fmt._render, None)
+
+    @mock.patch.object(format, '_compile_render', return_value='render')
+    @mock.patch.object(format, '_conditional', return_value=False)
+    @mock.patch.object(format, '_per_process', return_value=False)
+    def test_compile(self, mock_per_process, mock_conditional,
+                     mock_compile_render):
+        fmt = format.Format()
+        fmt.conversions = ['conv1', 'conv2']
+
+        result = fmt.compile()
+
+        self.assertEqual(id(result), id(fmt))
+        self.assertEqual(fmt._render, 'render')
+        self.assertEqual(fmt._pid, None)
+        mock_compile_render.assert_called_once_with(['conv1', 'conv2'])
+        mock_conditional.assert_called_once_with(['conv1', 'conv2'])
+        mock_per_process.assert_called_once_with(['conv1', 'conv2'])
+
+    @mock.patch.object(format, '_compile_render',
+                       side_effect=lambda convs, status=None: status)
+    @mock.patch.object(format, '_dispatch_status', return_value='dispatch')
+    @mock.patch.object(format, '_conditional', return_value=True)
+    @mock.patch.object(format, '_per_process', return_value=False)
+    def test_compile_conditional(self, mock_per_process, mock_conditional,
+                                 mock_dispatch_status, mock_compile_render):
+        fmt = format.Format()
+        fmt.conversions = ['conv1', 'conv2']
+
+        fmt.compile()
+
+        self.assertEqual(fmt._render, 'dispatch')
+        mock_dispatch_status.assert_called_once_with(mock.ANY, None)
+        compile_status = mock_dispatch_status.call_args[0][0]
+        self.assertEqual(compile_status(404), 404)
+        mock_compile_render.assert_has_calls([
+            mock.call(['conv1', 'conv2']),
+            mock.call(['conv1', 'conv2'], 404),
+        ])
+
+    @mock.patch('os.getpid', return_value=1234)
+    @mock.patch.object(format, '_compile_render', return_value='render')
+    @mock.patch.object(format, '_conditional', return_value=False)
+    @mock.patch.object(format, '_per_process', return_value=True)
+    def test_compile_per_process(self, mock_per_process, mock_conditional,
+                                 mock_compile_render, mock_getpid):
+        fmt = format.Format()
+        fmt.conversions = ['conv1', 'conv2']
+
+        fmt.compile()
+
+        self.assertEqual(fmt._render, 'render')
+        self.assertEqual(fmt._pid, 1234)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_convert_forked(self):
+        fmt = format.Format.parse('%P %{tid}P')
+        pid = fmt._pid
+
+        self.assertEqual(pid, os.getpid())
+
+        with mock.patch('os.getpid', return_value=pid + 1):
+            with mock.patch('thread.get_ident', return_value=4321):
+                result = fmt.convert('request', 'response',
+                                     fmt.prepare('request'))
+
+            self.assertEqual(fmt._pid, pid + 1)
+
+        self.assertEqual(result, '%d 4321' % (pid + 1))
+
     def test_prepare(self):
         fmt = format.Format()
         fmt.conversions = [
-            mock.Mock(**{'prepare.return_value': 'data1'}),
-            mock.Mock(**{'prepare.return_value': 'data2'}),
-            mock.Mock(**{'prepare.return_value': 'data3'}),
+            mock.Mock(needs_start=False, **{'prepare.return_value': 'data1'}),
+            mock.Mock(needs_start=False, **{'prepare.return_value': 'data2'}),
+            mock.Mock(needs_start=False, **{'prepare.return_value': 'data3'}),
         ]
 
         result = fmt.prepare('request')
 
-        self.assertEqual(result, ['data1', 'data2', 'data3'])
+        self.assertEqual(result, ('data1', 'data2', 'data3'))
         for conv in fmt.conversions:
             conv.prepare.assert_called_once_with('request')
 
+    @mock.patch.object(format, '_prepare', return_value='data')
+    @mock.patch.object(format, '_prepare_plan', return_value='plan')
+    def test_prepare_plan_cached(self, mock_prepare_plan, mock_prepare):
+        fmt = format.Format()
+
+        result1 = fmt.prepare('request1')
+        result2 = fmt.prepare('request2', 'start')
+
+        self.assertEqual(result1, 'data')
+        self.assertEqual(result2, 'data')
+        mock_prepare_plan.assert_called_once_with([])
+        mock_prepare.assert_has_calls([
+            mock.call('plan', 'request1', None),
+            mock.call('plan', 'request2', 'start'),
+        ])
+
+    def test_prepare_plan_discarded(self):
+        fmt = format.Format()
+        fmt.prepare('request')
+
+        fmt.append_text('text')
+
+        self.assertEqual(fmt._plan, None)
+        self.assertEqual(fmt.prepare('request'), (None,))
+
     def test_convert(self):
         fmt = format.Format()
         fmt.conversions = [
@@ -592,3 +462,801 @@ class FormatTest(unittest2.TestCase):
                                                      datum)
             else:
                 self.assertFalse(conv.convert.called)
+
+    def test_convert_compiled(self):
+        fmt = format.Format()
+        fmt._render = mock.Mock(return_value='rendered')
+        fmt.conversions = [mock.Mock()]
+
+        result = fmt.convert('request', 'response', 'data')
+
+        self.assertEqual(result, 'rendered')
+        fmt._render.assert_called_once_with('request', 'response', 'data')
+        self.assertFalse(fmt.conversions[0].convert.called)
+
+
+def make_conv(value, codes=None, reject=False):
+    modifier = conversions.Modifier(codes, reject)
+    return mock.Mock(modifier=modifier, **{
+        'convert.return_value': value,
+        'constant.return_value': None,
+    })
+
+
+def describe(fmt):
+    result = []
+    for conv in fmt.conversions:
+        if isinstance(conv, conversions.StringConversion):
+            result.append(conv.string)
+        else:
+            result.append((conv.__class__, conv.conv_chr,
+                           conv.modifier.codes, conv.modifier.reject,
+                           conv.modifier.param))
+    return result
+
+
+class ParseReferenceTest(unittest2.TestCase):
+    def assertParsesSame(self, fmt):
+        expected = parse_reference.parse(format.Format(), fmt)
+        result = format.Format.parse(fmt, compile=False)
+
+        self.assertEqual(describe(result), describe(expected),
+                         'Format %r parsed differently' % fmt)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_examples(self):
+        examples = [
+            '',
+            'static',
+            '%h %l %u %t "%r" %>s %b',
+            '%{Referer}i -> %U',
+            r'string %% \t \n \\ \q',
+            '%<a %>b %!404,500{param}i %(name) %{param}(name)',
+            '%101d %!202e %303,404f %!505,606g %10h %2004s',
+            '%200{x}!,300,,s %{x}200s %,s %{x},s %{a}{b}s',
+            '%{unterminated',
+            '%(unterminated',
+            '%200',
+            '%!',
+            'trailing \\',
+            '%({)',
+            '%()',
+            '%{}s',
+            u'caf\xe9 %{caf\xe9}i %\u0663\u0663\u0663s',
+        ]
+
+        for fmt in examples:
+            self.assertParsesSame(fmt)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_random(self):
+        rand = random.Random(1)
+        alphabet = '%\\{}()!<>,0129snai \n'
+
+        for i in range(2000):
+            self.assertParsesSame(''.join(rand.choice(alphabet)
+                                          for j in range(rand.randint(1, 16))))
+
+
+class CompileRenderTest(unittest2.TestCase):
+    def test_empty(self):
+        render = format._compile_render([])
+
+        self.assertEqual(render('request', 'response', []), '')
+
+    def test_text_only(self):
+        render = format._compile_render([
+            conversions.StringConversion('100% static'),
+        ])
+
+        self.assertEqual(render('request', 'response', [{}]), '100% static')
+
+    def test_unconditional(self):
+        convs = [
+            conversions.StringConversion('a %'),
+            make_conv('b'),
+            conversions.StringConversion(' c '),
+            make_conv('d%s'),
+        ]
+        response = mock.Mock()
+
+        render = format._compile_render(convs)
+        result = render('request', response, ['d0', 'd1', 'd2', 'd3'])
+
+        self.assertEqual(result, 'a %b c d%s')
+        convs[1].convert.assert_called_once_with('request', response, 'd1')
+        convs[3].convert.assert_called_once_with('request', response, 'd3')
+
+    def test_conditional(self):
+        convs = [
+            make_conv('accept', [200]),
+            conversions.StringConversion(' '),
+            make_conv('reject', [200], True),
+        ]
+        response = mock.Mock(status_code=200)
+
+        render = format._compile_render(convs)
+        result = render('request', response, ['d0', 'd1', 'd2'])
+
+        self.assertEqual(result, 'accept -')
+        convs[0].convert.assert_called_once_with('request', response, 'd0')
+        self.assertFalse(convs[2].convert.called)
+
+    @mock.patch.dict('os.environ', VAR='a "%s"')
+    def test_folded(self):
+        modifier = conversions.Modifier(param='VAR')
+        convs = [
+            conversions.EnvironmentConversion('e', modifier),
+            conversions.StringConversion(' '),
+            make_conv('b'),
+            conversions.StringConversion(' '),
+            conversions.ProcessIDConversion('P', conversions.Modifier()),
+        ]
+        response = mock.Mock()
+
+        render = format._compile_render(convs)
+        result = render('request', response, ['d0', 'd1', 'd2', 'd3', 'd4'])
+
+        self.assertEqual(result, 'a \\"%%s\\" b %d' % os.getpid())
+        convs[2].convert.assert_called_once_with('request', response, 'd2')
+
+    def test_status(self):
+        convs = [
+            make_conv('accept', [200]),
+            conversions.StringConversion(' '),
+            make_conv('reject', [200], True),
+            conversions.StringConversion(' '),
+            make_conv('always'),
+        ]
+        response = mock.Mock(status_code=200)
+
+        render = format._compile_render(convs, 200)
+        with mock.patch.object(conversions.Modifier, 'accept') as mock_accept:
+            result = render('request', response,
+                            ['d0', 'd1', 'd2', 'd3', 'd4'])
+
+        self.assertEqual(result, 'accept - always')
+        convs[0].convert.assert_called_once_with('request', response, 'd0')
+        self.assertFalse(convs[2].convert.called)
+        convs[4].convert.assert_called_once_with('request', response, 'd4')
+        self.assertFalse(mock_accept.called)
+
+    def test_folded_only(self):
+        convs = [
+            conversions.UnavailableConversion('l', conversions.Modifier()),
+            conversions.StringConversion(' '),
+            conversions.KeepAliveConversion('k', conversions.Modifier()),
+        ]
+
+        render = format._compile_render(convs)
+
+        self.assertEqual(render('request', 'response', [{}, {}, {}]), '- 0')
+
+    def test_matches_interpreted(self):
+        convs = [
+            make_conv('one'),
+            conversions.StringConversion(' "%%" '),
+            make_conv(u'two', [404]),
+            make_conv('three', [404], True),
+            conversions.StringConversion('\\n'),
+        ]
+        interpreted = format.Format()
+        interpreted.conversions = convs
+        compiled = format.Format()
+        compiled.conversions = convs
+        compiled.compile()
+        data = [{}] * len(convs)
+
+        for code in (200, 404, 500):
+            response = mock.Mock(status_code=code)
+            expected = interpreted.convert('request', response, data)
+            result = compiled.convert('request', response, data)
+
+            self.assertEqual(result, expected)
+            self.assertEqual(type(result), type(expected))
+
+
+class ConstantTest(unittest2.TestCase):
+    def test_string(self):
+        conv = conversions.StringConversion('text')
+
+        self.assertEqual(format._constant(conv), 'text')
+
+    def test_constant(self):
+        conv = conversions.KeepAliveConversion('k', conversions.Modifier())
+
+        self.assertEqual(format._constant(conv), '0')
+
+    def test_variable(self):
+        conv = conversions.RequestMethodConversion('m',
+                                                   conversions.Modifier())
+
+        self.assertEqual(format._constant(conv), None)
+
+    def test_codes(self):
+        for reject in (True, False):
+            modifier = conversions.Modifier([200], reject)
+            conv = conversions.KeepAliveConversion('k', modifier)
+
+            self.assertEqual(format._constant(conv), None)
+
+    def test_status_accepted(self):
+        modifier = conversions.Modifier([200])
+        conv = conversions.KeepAliveConversion('k', modifier)
+
+        self.assertEqual(format._constant(conv, 200), '0')
+
+    def test_status_rejected(self):
+        modifier = conversions.Modifier([200], True)
+        conv = conversions.RequestMethodConversion('m', modifier)
+
+        self.assertEqual(format._constant(conv, 200), '-')
+
+    def test_status_variable(self):
+        modifier = conversions.Modifier([200])
+        conv = conversions.RequestMethodConversion('m', modifier)
+
+        self.assertEqual(format._constant(conv, 200), None)
+
+
+class PerProcessTest(unittest2.TestCase):
+    def test_no_pid(self):
+        convs = [
+            conversions.StringConversion('text'),
+            conversions.KeepAliveConversion('k', conversions.Modifier()),
+        ]
+
+        self.assertFalse(format._per_process(convs))
+
+    def test_pid(self):
+        convs = [
+            conversions.StringConversion('text'),
+            conversions.ProcessIDConversion('P', conversions.Modifier()),
+        ]
+
+        self.assertTrue(format._per_process(convs))
+
+    def test_tid(self):
+        modifier = conversions.Modifier(param='tid')
+        convs = [conversions.ProcessIDConversion('P', modifier)]
+
+        self.assertFalse(format._per_process(convs))
+
+    def test_pid_codes(self):
+        # Folded when specialized for a status code
+        modifier = conversions.Modifier([200])
+        convs = [conversions.ProcessIDConversion('P', modifier)]
+
+        self.assertTrue(format._per_process(convs))
+
+
+class ConditionalTest(unittest2.TestCase):
+    def test_unconditional(self):
+        convs = [
+            conversions.StringConversion('text'),
+            FakeConversion('a', conversions.Modifier()),
+        ]
+
+        self.assertFalse(format._conditional(convs))
+
+    def test_conditional(self):
+        for reject in (True, False):
+            modifier = conversions.Modifier([200], reject)
+            convs = [
+                conversions.StringConversion('text'),
+                FakeConversion('a', modifier),
+            ]
+
+            self.assertTrue(format._conditional(convs))
+
+
+class PreparePlanTest(unittest2.TestCase):
+    def test_empty(self):
+        self.assertEqual(format._prepare_plan([]), ((), (), ()))
+
+    def test_plan(self):
+        convs = [
+            conversions.StringConversion('text'),
+            conversions.ServeTimeConversion('D', conversions.Modifier()),
+            conversions.RequestMethodConversion('m',
+                                                conversions.Modifier()),
+            conversions.TimeConversion('t', conversions.Modifier()),
+            mock.Mock(needs_start=False),
+        ]
+
+        result = format._prepare_plan(convs)
+
+        self.assertEqual(result, ((None,) * 5, (1, 3), ((4, convs[4]),)))
+
+    def test_plan_prepare_override(self):
+        class PreparedTimeConversion(conversions.TimeConversion):
+            def prepare(self, request):
+                return {'start': 1000000.0, 'other': 'spam'}
+
+        class PreparedServeTimeConversion(conversions.ServeTimeConversion):
+            def prepare(self, request):
+                return {'start': 1000000.0, 'other': 'spam'}
+
+        class DeclaredTimeConversion(PreparedTimeConversion):
+            needs_start = True
+
+        convs = [
+            PreparedTimeConversion('t', conversions.Modifier()),
+            PreparedServeTimeConversion('D', conversions.Modifier()),
+            DeclaredTimeConversion('t', conversions.Modifier()),
+            conversions.TimeConversion('t', conversions.Modifier()),
+        ]
+
+        result = format._prepare_plan(convs)
+
+        self.assertEqual(result, ((None,) * 4, (2, 3),
+                                  ((0, convs[0]), (1, convs[1]))))
+
+        data = format._prepare(result, 'request', {'start': 1.0})
+
+        self.assertEqual(data, (
+            {'start': 1000000.0, 'other': 'spam'},
+            {'start': 1000000.0, 'other': 'spam'},
+            {'start': 1.0},
+            {'start': 1.0},
+        ))
+
+
+class PrepareTest(unittest2.TestCase):
+    @mock.patch('time.time')
+    def test_unprepared(self, mock_time):
+        plan = ((None, None), (), ())
+
+        result = format._prepare(plan, 'request')
+
+        self.assertIs(result, plan[0])
+        self.assertFalse(mock_time.called)
+
+    @mock.patch('time.time', return_value=1234.5)
+    def test_start(self, mock_time):
+        plan = ((None, None, None), (0, 2), ())
+
+        result = format._prepare(plan, 'request')
+
+        self.assertEqual(result, ({'start': 1234.5}, None, {'start': 1234.5}))
+        self.assertIs(result[0], result[2])
+        mock_time.assert_called_once_with()
+
+    @mock.patch('time.time')
+    def test_start_shared(self, mock_time):
+        plan = ((None, None), (1,), ())
+
+        result = format._prepare(plan, 'request', 'start')
+
+        self.assertEqual(result, (None, 'start'))
+        self.assertFalse(mock_time.called)
+
+    def test_prepared(self):
+        conv = mock.Mock(**{'prepare.return_value': 'data'})
+        plan = ((None, None), (), ((1, conv),))
+
+        result = format._prepare(plan, 'request')
+
+        self.assertEqual(result, (None, 'data'))
+        conv.prepare.assert_called_once_with('request')
+
+
+class DispatchStatusTest(unittest2.TestCase):
+    def test_dispatch(self):
+        compile_status = mock.Mock(side_effect=lambda status: mock.Mock(
+            return_value='render%d' % status))
+        generic = mock.Mock(return_value='generic')
+
+        render = format._dispatch_status(compile_status, generic)
+
+        for status in (200, 404, 200):
+            response = mock.Mock(status_code=status)
+            result = render('request', response, 'data')
+
+            self.assertEqual(result, 'render%d' % status)
+            render.renders[status].assert_called_with('request', response,
+                                                      'data')
+
+        compile_status.assert_has_calls([mock.call(200), mock.call(404)])
+        self.assertEqual(compile_status.call_count, 2)
+        self.assertEqual(set(render.renders), set([200, 404]))
+        self.assertFalse(generic.called)
+
+    @mock.patch.object(format, '_max_status_renders', 1)
+    def test_overflow(self):
+        compile_status = mock.Mock(return_value=mock.Mock(
+            return_value='render'))
+        generic = mock.Mock(return_value='generic')
+
+        render = format._dispatch_status(compile_status, generic)
+        response = mock.Mock(status_code=404)
+
+        self.assertEqual(render('request', mock.Mock(status_code=200),
+                                'data'), 'render')
+        self.assertEqual(render('request', response, 'data'), 'generic')
+        generic.assert_called_once_with('request', response, 'data')
+        compile_status.assert_called_once_with(200)
+        self.assertEqual(set(render.renders), set([200]))
+
+
+class CompileSharedTest(unittest2.TestCase):
+    def test_shared(self):
+        conv_a = MockConversion('a', conversions.Modifier(), 'A')
+        conv_b = MockConversion('b', conversions.Modifier(), 'B')
+        conv_a2 = MockConversion('a', conversions.Modifier(), 'A2')
+        conv_lists = [
+            [conv_a, conversions.StringConversion(' % '), conv_b],
+            [conv_b, conversions.StringConversion(' '), conv_a2],
+            [conversions.StringConversion('static')],
+            [],
+        ]
+        response = mock.Mock()
+
+        unique, render = format._compile_shared(conv_lists)
+        result = render('request', response, ['data_a', 'data_b'])
+
+        self.assertEqual(unique, [conv_a, conv_b])
+        self.assertEqual(result, ('A % B', 'B A', 'static', ''))
+        conv_a.convert.assert_called_once_with('request', response,
+                                               'data_a')
+        conv_b.convert.assert_called_once_with('request', response,
+                                               'data_b')
+        self.assertFalse(conv_a2.convert.called)
+
+    def test_conditional(self):
+        accept = conversions.Modifier([200])
+        reject = conversions.Modifier([200], True)
+        conv_a = MockConversion('a', accept, 'A')
+        conv_b = MockConversion('a', reject, 'B')
+        response = mock.Mock(status_code=200)
+
+        unique, render = format._compile_shared([[conv_a], [conv_b]])
+        result = render('request', response, ['data_a', 'data_b'])
+
+        self.assertEqual(unique, [conv_a, conv_b])
+        self.assertEqual(result, ('A', '-'))
+        self.assertFalse(conv_b.convert.called)
+
+    def test_status(self):
+        accept = conversions.Modifier([200])
+        reject = conversions.Modifier([200], True)
+        conv_a = MockConversion('a', accept, 'A')
+        conv_b = MockConversion('a', reject, 'B')
+        conv_c = MockConversion('c', conversions.Modifier(), 'C')
+        conv_lists = [[conv_a, conv_c], [conv_b, conv_c, conv_b]]
+        response = mock.Mock(status_code=404)
+
+        unique, render = format._compile_shared(conv_lists, 404)
+        result = render('request', response, ['data_a', 'data_c', 'data_b'])
+
+        self.assertEqual(unique, [conv_a, conv_c, conv_b])
+        self.assertEqual(result, ('-C', 'BCB'))
+        self.assertFalse(conv_a.convert.called)
+        conv_b.convert.assert_called_once_with('request', response, 'data_b')
+        conv_c.convert.assert_called_once_with('request', response, 'data_c')
+
+    def test_skip(self):
+        conv_a = MockConversion('a', conversions.Modifier(), 'A')
+        conv_b = MockConversion('b', conversions.Modifier(), 'B')
+        conv_c = MockConversion('c', conversions.Modifier(), 'C')
+        conv_lists = [[conv_a, conv_b], [conv_b, conv_c], [conv_c]]
+        response = mock.Mock(status_code=404)
+
+        unique, render = format._compile_shared(conv_lists, 404,
+                                                frozenset([0, 2]))
+        result = render('request', response, ['data_a', 'data_b', 'data_c'])
+
+        self.assertEqual(unique, [conv_a, conv_b, conv_c])
+        self.assertEqual(result, (None, 'BC', None))
+        self.assertFalse(conv_a.convert.called)
+        conv_b.convert.assert_called_once_with('request', response, 'data_b')
+        conv_c.convert.assert_called_once_with('request', response, 'data_c')
+
+    @mock.patch.dict('os.environ', VAR='100%')
+    def test_folded(self):
+        modifier = conversions.Modifier(param='VAR')
+        conv_a = MockConversion('a', conversions.Modifier(), 'A')
+        conv_lists = [
+            [conversions.UnavailableConversion('l', conversions.Modifier()),
+             conversions.StringConversion(' '),
+             conversions.EnvironmentConversion('e', modifier),
+             conversions.StringConversion(' '), conv_a],
+            [conversions.KeepAliveConversion('k', conversions.Modifier())],
+        ]
+
+        unique, render = format._compile_shared(conv_lists)
+        result = render('request', 'response', ['data_a'])
+
+        self.assertEqual(unique, [conv_a])
+        self.assertEqual(result, ('- 100% A', '0'))
+
+
+class FilterStatusTest(unittest2.TestCase):
+    def test_filter_status(self):
+        render = mock.Mock(return_value=('result1', 'result2', 'result3'))
+        accepts = [None, lambda status: status == 200,
+                   lambda status: status == 404]
+        response = mock.Mock(status_code=404)
+
+        render_filtered = format._filter_status(render, accepts)
+        result = render_filtered('request', response, 'data')
+
+        self.assertEqual(result, ('result1', None, 'result3'))
+        render.assert_called_once_with('request', response, 'data')
+
+
+class FormatSetTest(unittest2.TestCase):
+    @mock.patch.object(format, '_prepare_plan', return_value='plan')
+    @mock.patch.object(format, '_compile_shared',
+                       return_value=('unique', 'render'))
+    @mock.patch.object(format, '_conditional', return_value=False)
+    @mock.patch.object(format, '_per_process', return_value=False)
+    def test_init_compiled(self, mock_per_process, mock_conditional,
+                           mock_compile_shared, mock_prepare_plan):
+        formats = [mock.Mock(conversions='convs1', _render='render1'),
+                   mock.Mock(conversions='convs2', _render='render2')]
+
+        fset = format.FormatSet(iter(formats))
+
+        self.assertEqual(fset.formats, formats)
+        self.assertEqual(fset.accepts, [None, None])
+        self.assertEqual(fset.conversions, 'unique')
+        self.assertEqual(fset._render, 'render')
+        self.assertEqual(fset._pid, None)
+        self.assertEqual(fset._plan, 'plan')
+        mock_compile_shared.assert_called_once_with(['convs1', 'convs2'])
+        mock_prepare_plan.assert_called_once_with('unique')
+        mock_conditional.assert_has_calls([mock.call('convs1'),
+                                           mock.call('convs2')])
+        mock_per_process.assert_has_calls([mock.call('convs1'),
+                                           mock.call('convs2')])
+
+    @mock.patch.object(format, '_prepare_plan', mock.Mock())
+    @mock.patch.object(format, '_compile_shared',
+                       side_effect=lambda convs, status=None, skip=(): (
+                           'unique', status))
+    @mock.patch.object(format, '_dispatch_status', return_value='dispatch')
+    @mock.patch.object(format, '_conditional', side_effect=[False, True])
+    @mock.patch.object(format, '_per_process', return_value=False)
+    def test_init_conditional(self, mock_per_process, mock_conditional,
+                              mock_dispatch_status, mock_compile_shared):
+        formats = [mock.Mock(conversions='convs1', _render='render1'),
+                   mock.Mock(conversions='convs2', _render='render2')]
+
+        fset = format.FormatSet(formats)
+
+        self.assertEqual(fset.conversions, 'unique')
+        self.assertEqual(fset._render, 'dispatch')
+        mock_dispatch_status.assert_called_once_with(mock.ANY, None)
+        compile_status = mock_dispatch_status.call_args[0][0]
+        self.assertEqual(compile_status(404), 404)
+        mock_compile_shared.assert_has_calls([
+            mock.call(['convs1', 'convs2']),
+            mock.call(['convs1', 'convs2'], 404, frozenset()),
+        ])
+
+    @mock.patch.object(format, '_prepare_plan', mock.Mock())
+    @mock.patch.object(format, '_compile_shared',
+                       side_effect=lambda convs, status=None, skip=(): (
+                           'unique', (status, skip)))
+    @mock.patch.object(format, '_filter_status', return_value='filtered')
+    @mock.patch.object(format, '_dispatch_status', return_value='dispatch')
+    @mock.patch.object(format, '_conditional', return_value=False)
+    @mock.patch.object(format, '_per_process', return_value=False)
+    def test_init_accepts(self, mock_per_process, mock_conditional,
+                          mock_dispatch_status, mock_filter_status,
+                          mock_compile_shared):
+        formats = [mock.Mock(conversions='convs1', _render='render1'),
+                   mock.Mock(conversions='convs2', _render='render2')]
+        accepts = [None, lambda status: status != 404]
+
+        fset = format.FormatSet(formats, iter(accepts))
+
+        self.assertEqual(fset.accepts, accepts)
+        self.assertEqual(fset._render, 'dispatch')
+        mock_filter_status.assert_called_once_with((None, ()),
+                                                   accepts)
+        mock_dispatch_status.assert_called_once_with(mock.ANY, 'filtered')
+        compile_status = mock_dispatch_status.call_args[0][0]
+        self.assertEqual(compile_status(404), (404, frozenset([1])))
+        self.assertEqual(compile_status(200), (200, frozenset()))
+
+    @mock.patch('os.getpid', return_value=1234)
+    @mock.patch.object(format, '_prepare_plan', mock.Mock())
+    @mock.patch.object(format, '_compile_shared',
+                       return_value=('unique', 'render'))
+    @mock.patch.object(format, '_conditional', return_value=False)
+    @mock.patch.object(format, '_per_process', side_effect=[False, True])
+    def test_init_per_process(self, mock_per_process, mock_conditional,
+                              mock_compile_shared, mock_getpid):
+        formats = [mock.Mock(conversions='convs1', _render='render1'),
+                   mock.Mock(conversions='convs2', _render='render2')]
+
+        fset = format.FormatSet(formats)
+
+        self.assertEqual(fset._pid, 1234)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_convert_forked(self):
+        fset = format.FormatSet([format.Format.parse('%P %m'),
+                                 format.Format.parse('%{pid}P')])
+        request = mock.Mock(environ=dict(REQUEST_METHOD='GET'))
+        pid = fset._pid
+
+        self.assertEqual(pid, os.getpid())
+        self.assertEqual(len(fset.conversions), 1)
+
+        with mock.patch('os.getpid', return_value=pid + 1):
+            result = fset.convert(request, 'response',
+                                  fset.prepare(request))
+
+            self.assertEqual(fset._pid, pid + 1)
+
+        self.assertEqual(result, ('%d GET' % (pid + 1), str(pid + 1)))
+
+    @mock.patch.object(format, '_compile_shared')
+    def test_init_interpreted(self, mock_compile_shared):
+        formats = [mock.Mock(conversions='convs1', _render='render1'),
+                   mock.Mock(conversions='convs2', _render=None)]
+
+        fset = format.FormatSet(formats)
+
+        self.assertEqual(fset.formats, formats)
+        self.assertEqual(fset.conversions, None)
+        self.assertEqual(fset._render, None)
+        self.assertEqual(fset._plan, None)
+        self.assertFalse(mock_compile_shared.called)
+
+    @mock.patch.object(format, '_prepare', return_value='data')
+    def test_prepare_compiled(self, mock_prepare):
+        fset = format.FormatSet([])
+        fset._plan = 'plan'
+
+        result = fset.prepare('request')
+
+        self.assertEqual(result, 'data')
+        mock_prepare.assert_called_once_with('plan', 'request')
+
+    @mock.patch('time.time', return_value=1234.5)
+    def test_prepare_interpreted(self, mock_time):
+        fset = format.FormatSet([])
+        fset._render = None
+        fset.formats = [
+            mock.Mock(**{'prepare.return_value': 'data1'}),
+            mock.Mock(**{'prepare.return_value': 'data2'}),
+        ]
+
+        result = fset.prepare('request')
+
+        self.assertEqual(result, ('data1', 'data2'))
+        for fmt in fset.formats:
+            fmt.prepare.assert_called_once_with('request', {'start': 1234.5})
+        self.assertIs(fset.formats[0].prepare.call_args[0][1],
+                      fset.formats[1].prepare.call_args[0][1])
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    @mock.patch('time.time', return_value=1234.5)
+    def test_prepare_shared_start(self, mock_time):
+        fset = format.FormatSet([format.Format.parse('%D %t'),
+                                 format.Format.parse('%{msec}t %s')])
+
+        result = fset.prepare('request')
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[0], {'start': 1234.5})
+        self.assertIs(result[0], result[1])
+        self.assertIs(result[0], result[2])
+        self.assertEqual(result[3], None)
+        mock_time.assert_called_once_with()
+
+    def test_convert_compiled(self):
+        fset = format.FormatSet([])
+        fset._render = mock.Mock(return_value=('result1', 'result2'))
+
+        result = fset.convert('request', 'response', 'data')
+
+        self.assertEqual(result, ('result1', 'result2'))
+        fset._render.assert_called_once_with('request', 'response', 'data')
+
+    def test_convert_interpreted(self):
+        fset = format.FormatSet([])
+        fset._render = None
+        fset.formats = [
+            mock.Mock(**{'convert.return_value': 'result1'}),
+            mock.Mock(**{'convert.return_value': 'result2'}),
+        ]
+        fset.accepts = [None, None]
+
+        result = fset.convert('request', 'response', ['data1', 'data2'])
+
+        self.assertEqual(result, ('result1', 'result2'))
+        fset.formats[0].convert.assert_called_once_with(
+            'request', 'response', 'data1')
+        fset.formats[1].convert.assert_called_once_with(
+            'request', 'response', 'data2')
+
+    def test_convert_interpreted_accepts(self):
+        fset = format.FormatSet([])
+        fset._render = None
+        fset.formats = [
+            mock.Mock(**{'convert.return_value': 'result1'}),
+            mock.Mock(**{'convert.return_value': 'result2'}),
+        ]
+        fset.accepts = [None, lambda status: status != 404]
+        response = mock.Mock(status_code=404)
+
+        result = fset.convert('request', response, ['data1', 'data2'])
+
+        self.assertEqual(result, ('result1', None))
+        self.assertFalse(fset.formats[1].convert.called)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_convert_accepts(self):
+        request = mock.Mock(environ={
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/path',
+            'HTTP_USER_AGENT': 'agent',
+        })
+        accepts = [None, lambda status: status != 404]
+
+        for compile in (True, False):
+            formats = [format.Format.parse('%m %s', compile=compile),
+                       format.Format.parse('%U %{User-Agent}i',
+                                           compile=compile)]
+            fset = format.FormatSet(formats, accepts)
+
+            for status, expected in [(200, ('GET 200', '/path agent')),
+                                     (404, ('GET 404', None))]:
+                response = mock.Mock(status_code=status)
+
+                result = fset.convert(request, response,
+                                      fset.prepare(request))
+
+                self.assertEqual(result, expected)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    @mock.patch.object(format, '_max_status_renders', 0)
+    def test_convert_accepts_generic(self):
+        request = mock.Mock(environ={'REQUEST_METHOD': 'GET'})
+        fset = format.FormatSet([format.Format.parse('%m'),
+                                 format.Format.parse('%s %m')],
+                                [lambda status: status == 200, None])
+
+        for status, expected in [(200, ('GET', '200 GET')),
+                                 (404, (None, '404 GET'))]:
+            response = mock.Mock(status_code=status)
+
+            result = fset.convert(request, response, fset.prepare(request))
+
+            self.assertEqual(result, expected)
+
+    @mock.patch.dict(format.Format._conversion_cache)
+    def test_matches_formats(self):
+        fmts = ['%h %t "%r" %s %b', '%h %t "%r" %s %b %{User-Agent}i',
+                '%404,500{User-Agent}i %s', 'static only', '']
+        formats = [format.Format.parse(fmt) for fmt in fmts]
+        fset = format.FormatSet(formats)
+        request = mock.Mock(environ={
+            'wsgi.url_scheme': 'http',
+            'HTTP_HOST': 'example.com',
+            'PATH_INFO': '/path',
+            'REQUEST_METHOD': 'GET',
+            'REMOTE_ADDR': '10.0.0.1',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_USER_AGENT': 'agent',
+        })
+
+        self.assertEqual(len(fset.conversions), 7)
+        for code in (200, 404):
+            response = mock.Mock(status_code=code, content_length=19)
+
+            data = fset.prepare(request)
+            with mock.patch('time.time', return_value=1000000000.0):
+                result = fset.convert(request, response, data)
+            expected = []
+            for fmt in formats:
+                data = fmt.prepare(request)
+                with mock.patch('time.time', return_value=1000000000.0):
+                    expected.append(fmt.convert(request, response, data))
+
+            self.assertEqual(result, tuple(expected))
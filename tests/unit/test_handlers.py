@@ -13,9 +13,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import errno
 import logging
 import logging.handlers
+import os
+import Queue
+import StringIO
 import sys
+import threading
+import time
 
 import mock
 import pkg_resources
@@ -179,24 +185,274 @@ class NullHandlerTest(unittest2.TestCase):
         emit('this is a test')
 
 
+class StreamWriterTest(unittest2.TestCase):
+    def test_init(self):
+        writer = handlers.StreamWriter('stream')
+
+        self.assertEqual(writer.stream, 'stream')
+
+    def test_write(self):
+        stream = mock.Mock(spec=['write', 'flush'])
+        writer = handlers.StreamWriter(stream)
+
+        writer.write('message')
+
+        stream.assert_has_calls([
+            mock.call.write('message\n'),
+            mock.call.flush(),
+        ])
+
+    def test_write_unicode(self):
+        stream = mock.Mock(spec=['write', 'flush'])
+        writer = handlers.StreamWriter(stream)
+
+        writer.write(u'message')
+
+        stream.assert_has_calls([
+            mock.call.write('message\n'),
+            mock.call.flush(),
+        ])
+
+    def test_write_unicode_noencoding(self):
+        stream = mock.Mock(spec=['write', 'flush'],
+                           **{'write.side_effect': [UnicodeError, None]})
+        writer = handlers.StreamWriter(stream)
+
+        writer.write(u'm\xe9ssage')
+
+        stream.assert_has_calls([
+            mock.call.write(u'm\xe9ssage\n'),
+            mock.call.write('m\xc3\xa9ssage\n'),
+            mock.call.flush(),
+        ])
+
+    def test_write_unicode_encoding(self):
+        stream = mock.Mock(encoding='latin1')
+        writer = handlers.StreamWriter(stream)
+
+        writer.write(u'm\xe9ssage')
+
+        stream.assert_has_calls([
+            mock.call.write(u'm\xe9ssage\n'),
+            mock.call.flush(),
+        ])
+
+    def test_write_unicode_encoding_fails(self):
+        stream = mock.Mock(encoding='latin1', **{
+            'write.side_effect': [UnicodeEncodeError('latin1', u'', 0, 1,
+                                                     'reason'), None],
+        })
+        writer = handlers.StreamWriter(stream)
+
+        writer.write(u'm\xe9ssage')
+
+        stream.assert_has_calls([
+            mock.call.write(u'm\xe9ssage\n'),
+            mock.call.write('m\xe9ssage\n'),
+            mock.call.flush(),
+        ])
+
+    def test_matches_stream_handler(self):
+        messages = ['message', u'm\xe9ssage', 'with %s and %%']
+        direct = StringIO.StringIO()
+        wrapped = StringIO.StringIO()
+        writer = handlers.StreamWriter(direct)
+        emit = handlers.wrap_log_handler(logging.StreamHandler(wrapped))
+
+        for msg in messages:
+            writer(msg)
+            emit(msg)
+
+        self.assertEqual(direct.getvalue(), wrapped.getvalue())
+
+    @mock.patch.object(handlers.StreamWriter, 'write')
+    def test_call(self, mock_write):
+        writer = handlers.StreamWriter('stream')
+
+        writer('message')
+
+        mock_write.assert_called_once_with('message')
+
+    @mock.patch.object(handlers.StreamWriter, 'write',
+                       side_effect=TestException)
+    @mock.patch.object(handlers.LOG, 'exception')
+    def test_call_error(self, mock_exception, mock_write):
+        writer = handlers.StreamWriter('stream')
+
+        writer('message')
+
+        mock_write.assert_called_once_with('message')
+        mock_exception.assert_called_once_with("Failed to emit log message")
+
+
+class FileWriterTest(unittest2.TestCase):
+    @mock.patch.object(handlers.FileWriter, 'open')
+    def test_init(self, mock_open):
+        writer = handlers.FileWriter('/path/to/file')
+
+        self.assertEqual(writer.filename, '/path/to/file')
+        self.assertEqual(writer.mode, 'a')
+        self.assertEqual(writer.encoding, None)
+        self.assertEqual(writer.stream, None)
+        mock_open.assert_called_once_with()
+
+    @mock.patch('os.path.abspath', return_value='/absolute/file')
+    @mock.patch.object(handlers.FileWriter, 'open')
+    def test_init_delay(self, mock_open, mock_abspath):
+        writer = handlers.FileWriter('file', mode='w', encoding='utf-8',
+                                     delay=True)
+
+        mock_abspath.assert_called_once_with('file')
+        self.assertEqual(writer.filename, '/absolute/file')
+        self.assertEqual(writer.mode, 'w')
+        self.assertEqual(writer.encoding, 'utf-8')
+        self.assertEqual(writer.stream, None)
+        self.assertFalse(mock_open.called)
+
+    @mock.patch('codecs.open', return_value='codecs')
+    @mock.patch('__builtin__.open', return_value='file')
+    def test_open(self, mock_open, mock_codecs_open):
+        writer = handlers.FileWriter('/path/to/file', delay=True)
+
+        writer.open()
+
+        mock_open.assert_called_once_with('/path/to/file', 'a')
+        self.assertFalse(mock_codecs_open.called)
+        self.assertEqual(writer.stream, 'file')
+
+    @mock.patch('codecs.open', return_value='codecs')
+    @mock.patch('__builtin__.open', return_value='file')
+    def test_open_encoding(self, mock_open, mock_codecs_open):
+        writer = handlers.FileWriter('/path/to/file', encoding='utf-8',
+                                     delay=True)
+
+        writer.open()
+
+        self.assertFalse(mock_open.called)
+        mock_codecs_open.assert_called_once_with('/path/to/file', 'a',
+                                                 'utf-8')
+        self.assertEqual(writer.stream, 'codecs')
+
+    @mock.patch.object(handlers.StreamWriter, 'write')
+    def test_write(self, mock_write):
+        writer = handlers.FileWriter('/path/to/file', delay=True)
+        stream = mock.Mock()
+
+        def fake_open():
+            writer.stream = stream
+        with mock.patch.object(writer, 'open',
+                               side_effect=fake_open) as mock_open:
+            writer.write('message 1')
+            writer.write('message 2')
+
+        mock_open.assert_called_once_with()
+        mock_write.assert_has_calls([
+            mock.call('message 1'),
+            mock.call('message 2'),
+        ])
+
+
+class WatchedFileWriterTest(unittest2.TestCase):
+    @mock.patch('os.fstat', return_value=mock.Mock(st_dev=1, st_ino=2))
+    @mock.patch('__builtin__.open', return_value=mock.Mock(**{
+        'fileno.return_value': 5,
+    }))
+    def test_init(self, mock_open, mock_fstat):
+        writer = handlers.WatchedFileWriter('/path/to/file')
+
+        self.assertEqual(writer.stream, mock_open.return_value)
+        self.assertEqual(writer.dev, 1)
+        self.assertEqual(writer.ino, 2)
+        mock_fstat.assert_called_once_with(5)
+
+    @mock.patch('os.fstat')
+    @mock.patch('__builtin__.open')
+    def test_init_delay(self, mock_open, mock_fstat):
+        writer = handlers.WatchedFileWriter('/path/to/file', delay=True)
+
+        self.assertEqual(writer.stream, None)
+        self.assertEqual(writer.dev, -1)
+        self.assertEqual(writer.ino, -1)
+        self.assertFalse(mock_open.called)
+        self.assertFalse(mock_fstat.called)
+
+    @mock.patch('os.stat', return_value=mock.Mock(st_dev=1, st_ino=2))
+    @mock.patch.object(handlers.FileWriter, 'write')
+    def test_write_unchanged(self, mock_write, mock_stat):
+        writer = handlers.WatchedFileWriter('/path/to/file', delay=True)
+        stream = mock.Mock()
+        writer.stream = stream
+        writer.dev, writer.ino = 1, 2
+
+        writer.write('message')
+
+        mock_stat.assert_called_once_with('/path/to/file')
+        self.assertFalse(stream.close.called)
+        self.assertEqual(writer.stream, stream)
+        mock_write.assert_called_once_with('message')
+
+    @mock.patch('os.stat', return_value=mock.Mock(st_dev=1, st_ino=3))
+    @mock.patch.object(handlers.FileWriter, 'write')
+    def test_write_changed(self, mock_write, mock_stat):
+        writer = handlers.WatchedFileWriter('/path/to/file', delay=True)
+        stream = mock.Mock()
+        writer.stream = stream
+        writer.dev, writer.ino = 1, 2
+
+        writer.write('message')
+
+        stream.assert_has_calls([mock.call.flush(), mock.call.close()])
+        self.assertEqual(writer.stream, None)
+        mock_write.assert_called_once_with('message')
+
+    @mock.patch('os.stat', side_effect=OSError(errno.ENOENT, 'missing'))
+    @mock.patch.object(handlers.FileWriter, 'write')
+    def test_write_removed(self, mock_write, mock_stat):
+        writer = handlers.WatchedFileWriter('/path/to/file', delay=True)
+        stream = mock.Mock()
+        writer.stream = stream
+        writer.dev, writer.ino = 1, 2
+
+        writer.write('message')
+
+        stream.assert_has_calls([mock.call.flush(), mock.call.close()])
+        self.assertEqual(writer.stream, None)
+        mock_write.assert_called_once_with('message')
+
+    @mock.patch('os.stat', side_effect=OSError(errno.EACCES, 'denied'))
+    @mock.patch.object(handlers.FileWriter, 'write')
+    def test_write_staterror(self, mock_write, mock_stat):
+        writer = handlers.WatchedFileWriter('/path/to/file', delay=True)
+        writer.stream = mock.Mock()
+
+        self.assertRaises(OSError, writer.write, 'message')
+        self.assertFalse(mock_write.called)
+
+    @mock.patch('os.stat')
+    @mock.patch.object(handlers.FileWriter, 'write')
+    def test_write_unopened(self, mock_write, mock_stat):
+        writer = handlers.WatchedFileWriter('/path/to/file', delay=True)
+
+        writer.write('message')
+
+        self.assertFalse(mock_stat.called)
+        mock_write.assert_called_once_with('message')
+
+
 class StdOutHandlerTest(unittest2.TestCase):
-    @mock.patch('logging.StreamHandler',
-                return_value=mock.Mock(**{'emit.__name__': 'emit'}))
-    def test_handler(self, mock_StreamHandler):
+    def test_handler(self):
         emit = handlers.stdout_handler('stdout', 'test')
 
-        self.assertTrue(callable(emit))
-        mock_StreamHandler.assert_called_once_with(sys.stdout)
+        self.assertIsInstance(emit, handlers.StreamWriter)
+        self.assertEqual(emit.stream, sys.stdout)
 
 
 class StdErrHandlerTest(unittest2.TestCase):
-    @mock.patch('logging.StreamHandler',
-                return_value=mock.Mock(**{'emit.__name__': 'emit'}))
-    def test_handler(self, mock_StreamHandler):
+    def test_handler(self):
         emit = handlers.stderr_handler('stderr', 'test')
 
-        self.assertTrue(callable(emit))
-        mock_StreamHandler.assert_called_once_with(sys.stderr)
+        self.assertIsInstance(emit, handlers.StreamWriter)
+        self.assertEqual(emit.stream, sys.stderr)
 
 
 class FileHandlerTest(unittest2.TestCase):
@@ -204,15 +460,14 @@ class FileHandlerTest(unittest2.TestCase):
         self.assertEqual(handlers.file_handler._bark_types,
                          dict(delay=handlers.boolean))
 
-    @mock.patch('logging.FileHandler',
-                return_value=mock.Mock(**{'emit.__name__': 'emit'}))
-    def test_handler(self, mock_FileHandler):
+    @mock.patch.object(handlers, 'FileWriter', return_value='writer')
+    def test_handler(self, mock_FileWriter):
         args = dict(filename='filename', mode='b', encoding='encoding',
                     delay=True)
         emit = handlers.file_handler('file', 'test', **args)
 
-        self.assertTrue(callable(emit))
-        mock_FileHandler.assert_called_once_with(
+        self.assertEqual(emit, 'writer')
+        mock_FileWriter.assert_called_once_with(
             'filename', mode='b', encoding='encoding', delay=True)
 
 
@@ -221,18 +476,296 @@ class WatchedFileHandlerTest(unittest2.TestCase):
         self.assertEqual(handlers.watched_file_handler._bark_types,
                          dict(delay=handlers.boolean))
 
-    @mock.patch('logging.handlers.WatchedFileHandler',
-                return_value=mock.Mock(**{'emit.__name__': 'emit'}))
-    def test_handler(self, mock_WatchedFileHandler):
+    @mock.patch.object(handlers, 'WatchedFileWriter', return_value='writer')
+    def test_handler(self, mock_WatchedFileWriter):
         args = dict(filename='filename', mode='b', encoding='encoding',
                     delay=True)
         emit = handlers.watched_file_handler('watched_file', 'test', **args)
 
-        self.assertTrue(callable(emit))
-        mock_WatchedFileHandler.assert_called_once_with(
+        self.assertEqual(emit, 'writer')
+        mock_WatchedFileWriter.assert_called_once_with(
             'filename', mode='b', encoding='encoding', delay=True)
 
 
+class CloseAtExitTest(unittest2.TestCase):
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_close_at_exit(self, exit_handlers):
+        handler1 = mock.Mock()
+        handler1.close.side_effect = lambda: exit_handlers.discard(handler1)
+        handler2 = mock.Mock()
+        handler2.close.side_effect = lambda: exit_handlers.discard(handler2)
+        exit_handlers.update([handler1, handler2])
+
+        handlers._close_at_exit()
+
+        handler1.close.assert_called_once_with()
+        handler2.close.assert_called_once_with()
+        self.assertEqual(exit_handlers, set())
+
+
+class BufferedFileHandlerTest(unittest2.TestCase):
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    def test_init(self, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0)
+
+        self.assertEqual(handler.filename, 'filename')
+        self.assertEqual(handler.encoding, 'utf-8')
+        self.assertEqual(handler.bufsize, 65536)
+        self.assertEqual(handler.interval, 0)
+        self.assertEqual(handler.closed, False)
+        self.assertEqual(handler.fd, 5)
+        self.assertEqual(handler.buf, [])
+        self.assertEqual(handler.buflen, 0)
+        self.assertEqual(handler.thread, None)
+        mock_open.assert_called_once_with(
+            'filename', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        self.assertEqual(exit_handlers, set([handler]))
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    def test_init_flusher(self, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', encoding='latin1',
+                                               bufsize=10, interval=10.0)
+
+        self.assertEqual(handler.encoding, 'latin1')
+        self.assertEqual(handler.bufsize, 10)
+        self.assertTrue(handler.thread.is_alive())
+        self.assertTrue(handler.thread.daemon)
+
+        handler.close()
+
+        self.assertFalse(handler.thread.is_alive())
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=lambda fd, data: len(data))
+    def test_call(self, mock_write, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', bufsize=30,
+                                               interval=0)
+
+        handler('message 1')
+        handler(u'message \u3f26')
+
+        self.assertFalse(mock_write.called)
+        self.assertEqual(handler.buflen, 22)
+
+        handler('message 3')
+
+        mock_write.assert_called_once_with(
+            5, 'message 1\nmessage \xe3\xbc\xa6\nmessage 3\n')
+        self.assertEqual(handler.buf, [])
+        self.assertEqual(handler.buflen, 0)
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=[4, 6])
+    def test_partial_write(self, mock_write, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', bufsize=1,
+                                               interval=0)
+
+        handler('message')
+
+        mock_write.assert_has_calls([
+            mock.call(5, 'message\n'),
+            mock.call(5, 'age\n'),
+        ])
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=lambda fd, data: len(data))
+    def test_flush(self, mock_write, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0)
+
+        handler.flush()
+
+        self.assertFalse(mock_write.called)
+
+        handler('message 1')
+        handler('message 2')
+        handler.flush()
+
+        mock_write.assert_called_once_with(5, 'message 1\nmessage 2\n')
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=lambda fd, data: len(data))
+    def test_flusher(self, mock_write, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0.01)
+        written = threading.Event()
+        mock_write.side_effect = lambda fd, data: written.set() or len(data)
+
+        handler('message')
+
+        self.assertTrue(written.wait(5))
+        mock_write.assert_called_once_with(5, 'message\n')
+
+        handler.close()
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=lambda fd, data: len(data))
+    @mock.patch.object(handlers.LOG, 'exception')
+    def test_flusher_error(self, mock_exception, mock_write, mock_open,
+                           exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0.01)
+        written = threading.Event()
+
+        def fail(fd, data):
+            mock_write.side_effect = lambda fd, data: len(data)
+            written.set()
+            raise OSError()
+        mock_write.side_effect = fail
+
+        handler('message')
+
+        self.assertTrue(written.wait(5))
+        handler.close()
+
+        self.assertEqual(handler.errors, 1)
+        mock_exception.assert_called_once_with(
+            "Failed to write log messages to 'filename'")
+        mock_write.assert_called_with(5, 'message\n')
+        self.assertEqual(handler.buf, [])
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=OSError(9, 'Bad file descriptor'))
+    @mock.patch.object(handlers.LOG, 'exception')
+    def test_call_error(self, mock_exception, mock_write, mock_open,
+                        exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', bufsize=10,
+                                               interval=0)
+
+        handler('message 1')
+
+        self.assertEqual(handler.errors, 1)
+        mock_exception.assert_called_once_with(
+            "Failed to write log messages to 'filename'")
+        self.assertEqual(handler.buf, ['message 1\n'])
+        self.assertEqual(handler.flushlen, 20)
+
+        # The buffer must grow before the next attempt
+        handler('msg 2')
+
+        self.assertEqual(mock_write.call_count, 1)
+
+        mock_write.side_effect = lambda fd, data: len(data)
+        handler('message 3')
+
+        mock_write.assert_called_with(5, 'message 1\nmsg 2\nmessage 3\n')
+        self.assertEqual(handler.errors, 1)
+        self.assertEqual(handler.buf, [])
+        self.assertEqual(handler.buflen, 0)
+        self.assertEqual(handler.flushlen, 10)
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=OSError(28, 'No space left'))
+    @mock.patch.object(handlers.LOG, 'exception')
+    def test_call_error_discard(self, mock_exception, mock_write, mock_open,
+                                exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', bufsize=10,
+                                               interval=0)
+
+        for i in range(16):
+            handler('message %d' % (i % 10))
+
+        self.assertEqual(handler.errors, 16)
+        self.assertEqual(handler.buflen, 160)
+
+        handler('message 6')
+
+        self.assertEqual(handler.errors, 17)
+        self.assertEqual(handler.buf, [])
+        self.assertEqual(handler.buflen, 0)
+        self.assertEqual(handler.flushlen, 10)
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=OSError(9, 'Bad file descriptor'))
+    @mock.patch.object(handlers.LOG, 'exception')
+    def test_closed_error(self, mock_exception, mock_write, mock_open,
+                          exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0)
+        handler.close()
+
+        handler('message')
+
+        self.assertEqual(handler.errors, 1)
+        mock_exception.assert_called_once_with(
+            "Failed to write log messages to 'filename'")
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=lambda fd, data: len(data))
+    def test_close(self, mock_write, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0)
+        handler('message 1')
+
+        handler.close()
+        handler.close()
+
+        mock_write.assert_called_once_with(5, 'message 1\n')
+        self.assertEqual(handler.closed, True)
+        self.assertEqual(exit_handlers, set())
+
+        handler('message 2')
+
+        mock_write.assert_called_with(5, 'message 2\n')
+        self.assertEqual(mock_write.call_count, 2)
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=lambda fd, data: len(data))
+    def test_forked(self, mock_write, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0)
+        handler('message 1')
+
+        old_lock = handler.lock
+
+        # A thread in the parent may have held the lock at the fork
+        old_lock.acquire()
+        with mock.patch('os.getpid', return_value=handler.pid + 1):
+            handler('message 2')
+            handler.flush()
+
+        mock_write.assert_called_once_with(5, 'message 2\n')
+        self.assertNotEqual(id(handler.lock), id(old_lock))
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch('os.open', return_value=5)
+    @mock.patch('os.write', side_effect=lambda fd, data: len(data))
+    def test_forked_close(self, mock_write, mock_open, exit_handlers):
+        handler = handlers.BufferedFileHandler('filename', interval=0)
+        handler('message 1')
+        handler.lock.acquire()
+
+        with mock.patch('os.getpid', return_value=handler.pid + 1):
+            handler.close()
+
+        self.assertFalse(mock_write.called)
+        self.assertEqual(handler.closed, True)
+        self.assertEqual(exit_handlers, set())
+
+
+class BufferedFileHandlerFactoryTest(unittest2.TestCase):
+    def test_arg_types(self):
+        self.assertEqual(handlers.buffered_file_handler._bark_types,
+                         dict(bufsize=int, interval=float))
+
+    @mock.patch.object(handlers, 'BufferedFileHandler',
+                       return_value='buffered')
+    def test_handler(self, mock_BufferedFileHandler):
+        args = dict(filename='filename', encoding='encoding', bufsize=10,
+                    interval=2.5)
+        emit = handlers.buffered_file_handler('buffered_file', 'test', **args)
+
+        self.assertEqual(emit, 'buffered')
+        mock_BufferedFileHandler.assert_called_once_with(
+            'filename', encoding='encoding', bufsize=10, interval=2.5)
+
+
 class RotatingFileHandlerTest(unittest2.TestCase):
     def test_arg_types(self):
         self.assertEqual(handlers.rotating_file_handler._bark_types,
@@ -381,8 +914,338 @@ class HTTPHandlerTest(unittest2.TestCase):
             'host', 'url', method='method')
 
 
+class BlockingHandler(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.msgs = []
+
+    def __call__(self, msg):
+        self.event.wait()
+        self.msgs.append(msg)
+
+
+class AsyncHandlerTest(unittest2.TestCase):
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_init(self, exit_handlers):
+        handler = handlers.AsyncHandler('handler', 5, 'drop-oldest')
+
+        self.assertEqual(handler.handler, 'handler')
+        self.assertEqual(handler.maxsize, 5)
+        self.assertEqual(handler.overflow, 'drop-oldest')
+        self.assertEqual(handler.dropped, 0)
+        self.assertEqual(handler.errors, 0)
+        self.assertEqual(handler.closing, False)
+        self.assertEqual(handler.closed, False)
+        self.assertEqual(handler.queue.maxsize, 5)
+        self.assertTrue(handler.thread.is_alive())
+        self.assertTrue(handler.thread.daemon)
+        self.assertEqual(exit_handlers, set([handler]))
+
+        handler.close()
+
+        self.assertFalse(handler.thread.is_alive())
+        self.assertEqual(exit_handlers, set())
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_emit(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+
+        for i in range(5):
+            handler('msg%d' % i)
+        handler.flush()
+
+        target.assert_has_calls([mock.call('msg%d' % i) for i in range(5)])
+        self.assertEqual(handler.dropped, 0)
+
+        handler.close()
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch.object(handlers.LOG, 'exception')
+    def test_emit_error(self, mock_exception, exit_handlers):
+        target = mock.Mock(side_effect=[TestException, None])
+        handler = handlers.AsyncHandler(target)
+
+        handler('msg1')
+        handler('msg2')
+        handler.flush()
+
+        target.assert_has_calls([mock.call('msg1'), mock.call('msg2')])
+        self.assertEqual(handler.errors, 1)
+        mock_exception.assert_called_once_with("Failed to emit log message")
+
+        handler.close()
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_drop_newest(self, exit_handlers):
+        target = BlockingHandler()
+        handler = handlers.AsyncHandler(target, 2, 'drop-newest')
+
+        for i in range(6):
+            handler('msg%d' % i)
+        target.event.set()
+        handler.close()
+
+        # The writer thread may or may not have taken msg0 off the
+        # queue before the queue filled up
+        self.assertIn(target.msgs, [['msg0', 'msg1'],
+                                    ['msg0', 'msg1', 'msg2']])
+        self.assertEqual(handler.dropped, 6 - len(target.msgs))
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_drop_oldest(self, exit_handlers):
+        target = BlockingHandler()
+        handler = handlers.AsyncHandler(target, 2, 'drop-oldest')
+
+        for i in range(6):
+            handler('msg%d' % i)
+        target.event.set()
+        handler.close()
+
+        self.assertIn(target.msgs, [['msg4', 'msg5'],
+                                    ['msg0', 'msg4', 'msg5']])
+        self.assertEqual(handler.dropped, 6 - len(target.msgs))
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_drop_oldest_stop(self, exit_handlers):
+        handler = handlers.AsyncHandler(mock.Mock(), 2, 'drop-oldest')
+        handler.close()
+
+        # A queue the writer thread is not reading, as it would be
+        # while close() waits for it to finish
+        queue = handler.queue = Queue.Queue(2)
+        handler.closed = False
+        queue.put(handler._stop)
+        handler('msg1')
+        handler('msg2')
+
+        self.assertEqual(list(queue.queue), ['msg1', handler._stop])
+        self.assertEqual(handler.dropped, 1)
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_block(self, exit_handlers):
+        target = BlockingHandler()
+        handler = handlers.AsyncHandler(target, 1, 'block')
+        handler('msg0')
+        handler('msg1')
+
+        # This will block until the writer thread catches up
+        writer = threading.Thread(target=handler, args=('msg2',))
+        writer.start()
+        target.event.set()
+        writer.join()
+        handler.close()
+
+        self.assertEqual(target.msgs, ['msg0', 'msg1', 'msg2'])
+        self.assertEqual(handler.dropped, 0)
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_closed(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+        handler('msg1')
+
+        handler.close()
+        handler.close()
+        handler('msg2')
+
+        target.assert_has_calls([mock.call('msg1'), mock.call('msg2')])
+        self.assertFalse(handler.thread.is_alive())
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_closing(self, exit_handlers):
+        target = BlockingHandler()
+        handler = handlers.AsyncHandler(target)
+        handler('msg0')
+        closer = threading.Thread(target=handler.close)
+        closer.start()
+        while not handler.closing:
+            time.sleep(0.001)
+
+        # While the writer thread is still emitting messages, new
+        # messages are queued rather than emitted alongside it
+        sender = threading.Thread(target=handler, args=('msg1',))
+        sender.start()
+        sender.join(5)
+        self.assertFalse(sender.is_alive())
+        self.assertFalse(handler.closed)
+
+        target.event.set()
+        closer.join()
+
+        self.assertEqual(target.msgs, ['msg0', 'msg1'])
+        self.assertTrue(handler.closed)
+        self.assertFalse(handler.thread.is_alive())
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_close_drain(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+        handler.queue.put(handler._stop)
+        handler.thread.join()
+        handler('msg')
+
+        self.assertFalse(target.called)
+
+        handler.close()
+
+        target.assert_called_once_with('msg')
+        self.assertTrue(handler.queue.empty())
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_closed_while_queueing(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+        handler.close()
+        handler.closed = False
+        queue = handler.queue
+
+        def put(msg):
+            Queue.Queue.put(queue, msg)
+            handler.closed = True
+
+        with mock.patch.object(queue, 'put', side_effect=put):
+            handler('msg')
+
+        target.assert_called_once_with('msg')
+        self.assertTrue(queue.empty())
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_forked(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+        old_thread = handler.thread
+        old_queue = handler.queue
+        handler.close()
+        handler.closing = False
+        handler.closed = False
+
+        with mock.patch('os.getpid', return_value=handler.pid + 1):
+            handler('msg')
+
+            self.assertNotEqual(id(handler.thread), id(old_thread))
+            self.assertNotEqual(id(handler.queue), id(old_queue))
+
+            handler.close()
+
+        target.assert_called_once_with('msg')
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_forked_locked(self, exit_handlers):
+        handler = handlers.AsyncHandler(mock.Mock())
+        handler.close()
+        handler.closing = False
+        handler.closed = False
+        locked = []
+
+        def start():
+            locked.append(handlers._restart_lock.locked())
+            handler.pid += 1
+
+        with mock.patch('os.getpid', return_value=handler.pid + 1):
+            with mock.patch.object(handler, 'start', side_effect=start):
+                handler('msg1')
+                handler('msg2')
+
+        self.assertEqual(locked, [True])
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_forked_held(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+        handler.close()
+        handler.closing = False
+        handler.closed = False
+        old_lock = handler.lock
+
+        # Threads in the parent may have held the lock and the
+        # queue's mutex at the fork
+        old_lock.acquire()
+        handler.queue.mutex.acquire()
+        with mock.patch('os.getpid', return_value=handler.pid + 1):
+            handler('msg')
+            handler.close()
+
+        target.assert_called_once_with('msg')
+        self.assertNotEqual(id(handler.lock), id(old_lock))
+        self.assertFalse(handler.thread.is_alive())
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_forked_close(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+        handler.lock.acquire()
+
+        with mock.patch('os.getpid', return_value=handler.pid + 1):
+            handler.close()
+
+        self.assertTrue(handler.closed)
+        self.assertEqual(exit_handlers, set())
+
+        handler.queue.put(handler._stop)
+        handler.thread.join()
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    def test_forked_closed(self, exit_handlers):
+        target = mock.Mock()
+        handler = handlers.AsyncHandler(target)
+        handler.close()
+        handler.lock.acquire()
+
+        with mock.patch('os.getpid', return_value=handler.pid + 1):
+            handler('msg')
+
+        target.assert_called_once_with('msg')
+        self.assertEqual(handler.thread, None)
+
+
+class AsyncHandlerFactoryTest(unittest2.TestCase):
+    def test_arg_types(self):
+        self.assertEqual(set(handlers.async_handler._bark_types),
+                         set(['maxsize', 'overflow']))
+        self.assertEqual(handlers.async_handler._bark_types['maxsize'], int)
+        self.assertEqual(
+            handlers.async_handler._bark_types['overflow'].choices,
+            set(['block', 'drop-newest', 'drop-oldest']))
+
+    @mock.patch.object(handlers, 'get_handler', return_value='target')
+    @mock.patch.object(handlers, 'AsyncHandler', return_value='async')
+    def test_handler(self, mock_AsyncHandler, mock_get_handler):
+        emit = handlers.async_handler('async', 'test', 'file', maxsize=10,
+                                      overflow='drop-newest',
+                                      filename='filename')
+
+        self.assertEqual(emit, 'async')
+        mock_get_handler.assert_called_once_with(
+            'file', 'test', dict(filename='filename'))
+        mock_AsyncHandler.assert_called_once_with(
+            'target', maxsize=10, overflow='drop-newest')
+
+    @mock.patch.object(handlers, '_exit_handlers', new_callable=set)
+    @mock.patch.object(handlers.LOG, 'warn')
+    @mock.patch.object(handlers, '_lookup_handler',
+                       side_effect=lambda x: {
+                           'async': handlers.async_handler,
+                           'null': handlers.null_handler,
+                       }[x])
+    def test_get_handler(self, mock_lookup_handler, mock_warn,
+                         exit_handlers):
+        emit = handlers.get_handler('async', 'test', dict(
+            target='null', maxsize='10', overflow='drop-oldest',
+            extra='extra'))
+
+        self.assertIsInstance(emit, handlers.AsyncHandler)
+        self.assertEqual(emit.maxsize, 10)
+        self.assertEqual(emit.overflow, 'drop-oldest')
+        mock_warn.assert_called_once_with(
+            "Unused arguments for handler of type 'null' for log 'test': "
+            "'extra'")
+
+        emit.close()
+
+
 class LookupHandlerTest(unittest2.TestCase):
-    @mock.patch('pkg_resources.iter_entry_points',
+    @mock.patch('bark.entrypoints.iter_entry_points',
                 return_value=[
                     mock.Mock(**{'load.side_effect': ImportError}),
                     mock.Mock(**{'load.side_effect': ImportError}),
@@ -395,24 +1258,7 @@ class LookupHandlerTest(unittest2.TestCase):
         mock_iter_entry_points.return_value[0].load.assert_called_once_with()
         mock_iter_entry_points.return_value[1].load.assert_called_once_with()
 
-    @mock.patch('pkg_resources.iter_entry_points',
-                return_value=[
-                    mock.Mock(**{
-                        'load.side_effect': pkg_resources.UnknownExtra,
-                    }),
-                    mock.Mock(**{
-                        'load.side_effect': pkg_resources.UnknownExtra,
-                    }),
-                ])
-    def test_unknown_extra(self, mock_iter_entry_points):
-        self.assertRaises(ImportError, handlers._lookup_handler, 'handler')
-
-        mock_iter_entry_points.assert_called_once_with('bark.handler',
-                                                       'handler')
-        mock_iter_entry_points.return_value[0].load.assert_called_once_with()
-        mock_iter_entry_points.return_value[1].load.assert_called_once_with()
-
-    @mock.patch('pkg_resources.iter_entry_points',
+    @mock.patch('bark.entrypoints.iter_entry_points',
                 return_value=[
                     mock.Mock(**{'load.side_effect': TestException}),
                     mock.Mock(**{'load.side_effect': TestException}),
@@ -425,7 +1271,7 @@ class LookupHandlerTest(unittest2.TestCase):
         mock_iter_entry_points.return_value[0].load.assert_called_once_with()
         self.assertFalse(mock_iter_entry_points.return_value[1].load.called)
 
-    @mock.patch('pkg_resources.iter_entry_points',
+    @mock.patch('bark.entrypoints.iter_entry_points',
                 return_value=[mock.Mock(**{'load.return_value': 'fake_hand'})])
     def test_load(self, mock_iter_entry_points):
         result = handlers._lookup_handler('handler')
@@ -435,6 +1281,23 @@ class LookupHandlerTest(unittest2.TestCase):
         mock_iter_entry_points.return_value[0].load.assert_called_once_with()
         self.assertEqual(result, 'fake_hand')
 
+    @mock.patch('bark.entrypoints.iter_entry_points', side_effect=Exception)
+    def test_builtin(self, mock_iter_entry_points):
+        result = handlers._lookup_handler('file')
+
+        self.assertFalse(mock_iter_entry_points.called)
+        self.assertEqual(result, handlers.file_handler)
+
+
+class RegistryTest(unittest2.TestCase):
+    def test_matches_entry_points(self):
+        # The registry must agree with the entry points in setup.py
+        entry_points = dict(
+            (ep.name, ep.load())
+            for ep in pkg_resources.iter_entry_points('bark.handler'))
+
+        self.assertEqual(handlers.registry, entry_points)
+
 
 class GetHandlerTest(unittest2.TestCase):
     @mock.patch.object(handlers.LOG, 'warn')
@@ -23,71 +23,506 @@ class TestException(Exception):
     pass
 
 
+class FakeFormatSet(object):
+    def __init__(self, formats, accepts=None):
+        self.formats = list(formats)
+        self.accepts = accepts
+        self.prepare = mock.Mock(return_value='data')
+        self.convert = mock.Mock(return_value=tuple(
+            'result-%s' % fmt for fmt in self.formats))
+
+
 class BarkMiddlewareTest(unittest2.TestCase):
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
     def test_init(self):
-        mid = middleware.BarkMiddleware('app', 'handlers', 'proxies')
+        handlers = {
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, 'proxies')
 
         self.assertEqual(mid.app, 'app')
-        self.assertEqual(mid.handlers, 'handlers')
+        self.assertEqual(mid.handlers, handlers)
         self.assertEqual(mid.proxies, 'proxies')
+        self.assertEqual(mid.samplers, {})
+        self.assertEqual(mid.filters, {})
+        self.assertIsInstance(mid.formats, FakeFormatSet)
+        self.assertEqual(sorted(zip(mid.formats.formats, mid.emitters)),
+                         [('fmt1', 'handler1'), ('fmt2', 'handler2')])
+        self.assertEqual(mid.formats.accepts, [None, None])
+        self.assertEqual(mid._selectors, [])
+        self.assertEqual(mid._subsets, {
+            frozenset(): (mid.formats, mid.emitters),
+        })
 
-    def test_call_noproxies(self):
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_init_samplers(self):
         handlers = {
-            'log1': (mock.Mock(**{
-                'prepare.return_value': 'log1',
-                'convert.return_value': 'result1',
-            }), mock.Mock()),
-            'log2': (mock.Mock(**{
-                'prepare.return_value': 'log2',
-                'convert.return_value': 'result2',
-            }), mock.Mock()),
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
         }
-        request = mock.Mock(**{'get_response.return_value': 'response'})
 
-        mid = middleware.BarkMiddleware('app', handlers, None)
+        mid = middleware.BarkMiddleware('app', handlers, None,
+                                        {'log2': 'sampler2'})
+
+        self.assertEqual(mid.samplers, {'log2': 'sampler2'})
+        self.assertEqual(mid._selectors, [
+            (mid.emitters.index('handler2'), 'sampler2'),
+        ])
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_init_filters(self):
+        handlers = {
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
+            'log3': ('fmt3', 'handler3'),
+        }
+        filters = {
+            'log1': mock.Mock(request_filter=True, statuses=frozenset()),
+            'log2': mock.Mock(request_filter=False,
+                              statuses=frozenset([404])),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, None,
+                                        {'log1': 'sampler1'}, filters)
+
+        idx1 = mid.emitters.index('handler1')
+        idx2 = mid.emitters.index('handler2')
+        self.assertEqual(mid.filters, filters)
+        self.assertEqual(mid._selectors, [
+            (idx1, filters['log1']),
+            (idx1, 'sampler1'),
+        ])
+        self.assertEqual(mid.formats.accepts[idx1], None)
+        self.assertEqual(mid.formats.accepts[idx2], filters['log2'].accept)
+
+    @mock.patch.object(middleware.BarkMiddleware, 'start',
+                       return_value=('request', 'streams', 'data',
+                                     ['200 OK', 'headers'], 'orig_iter'))
+    @mock.patch.object(middleware.BarkMiddleware, 'emit')
+    @mock.patch('bark.wsgi.Response')
+    def test_call(self, mock_Response, mock_emit, mock_start):
+        mid = middleware.BarkMiddleware('app', {}, None)
+
+        result = mid('environ', 'start_response')
+
+        self.assertEqual(result, mock_Response.return_value.app_iter)
+        mock_start.assert_called_once_with('environ', 'start_response')
+        mock_Response.assert_called_once_with('200 OK', 'headers',
+                                              'orig_iter')
+        mock_emit.assert_called_once_with(
+            'request', mock_Response.return_value, 'streams', 'data')
+
+    @mock.patch.object(middleware.BarkMiddleware, 'start',
+                       return_value=('request', None, None, [], 'orig_iter'))
+    @mock.patch.object(middleware.BarkMiddleware, 'emit')
+    @mock.patch('bark.wsgi.Response')
+    def test_call_sampled_out(self, mock_Response, mock_emit, mock_start):
+        mid = middleware.BarkMiddleware('app', {}, None)
+
+        result = mid('environ', 'start_response')
+
+        self.assertEqual(result, 'orig_iter')
+        self.assertFalse(mock_Response.called)
+        self.assertFalse(mock_emit.called)
+
+    @mock.patch.object(middleware.BarkMiddleware, 'emit')
+    @mock.patch('bark.wsgi.Response')
+    def test_call_unstarted(self, mock_Response, mock_emit):
+        orig_iter = mock.Mock(**{'__iter__': mock.Mock(
+            side_effect=lambda: iter(['chunk']))})
+        captured = []
+        mid = middleware.BarkMiddleware('app', {}, None)
+        mid.start = mock.Mock(return_value=('request', 'streams', 'data',
+                                            captured, orig_iter))
+
+        def iterate():
+            captured[:] = ['404 Not Found', 'headers']
+            return iter(['chunk'])
+        orig_iter.__iter__.side_effect = iterate
+
+        result = mid('environ', 'start_response')
+
+        self.assertEqual(result, mock_Response.return_value.app_iter)
+        orig_iter.close.assert_called_once_with()
+        mock_Response.assert_called_once_with('404 Not Found', 'headers',
+                                              ['chunk'])
+        mock_emit.assert_called_once_with(
+            'request', mock_Response.return_value, 'streams', 'data')
+
+    @mock.patch.object(middleware.BarkMiddleware, 'emit')
+    @mock.patch('bark.wsgi.Response')
+    def test_call_never_started(self, mock_Response, mock_emit):
+        mid = middleware.BarkMiddleware('app', {}, None)
+        mid.start = mock.Mock(return_value=('request', 'streams', 'data',
+                                            [], []))
+
+        mid('environ', 'start_response')
 
-        result = mid(request)
+        mock_Response.assert_called_once_with('500 Internal Server Error',
+                                              [], [])
 
-        handlers['log1'][0].prepare.assert_called_once_with(request)
-        handlers['log2'][0].prepare.assert_called_once_with(request)
-        request.get_response.assert_called_once_with('app')
-        handlers['log1'][0].convert.assert_called_once_with(
-            request, 'response', 'log1')
-        handlers['log1'][1].assert_called_once_with('result1')
-        handlers['log2'][0].convert.assert_called_once_with(
-            request, 'response', 'log2')
-        handlers['log2'][1].assert_called_once_with('result2')
-        self.assertEqual(result, 'response')
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    @mock.patch('bark.wsgi.Request')
+    def test_start_noproxies(self, mock_Request):
+        app = mock.Mock(return_value='orig_iter')
+        start_response = mock.Mock(return_value='write')
 
-    def test_call_withproxies(self):
+        mid = middleware.BarkMiddleware(app, {}, None)
+
+        result = mid.start('environ', start_response)
+
+        self.assertEqual(result, (mock_Request.return_value,
+                                  (mid.formats, mid.emitters), 'data', [],
+                                  'orig_iter'))
+        mock_Request.assert_called_once_with('environ')
+        mid.formats.prepare.assert_called_once_with(
+            mock_Request.return_value)
+        app.assert_called_once_with('environ', mock.ANY)
+
+        # Check that the status and headers get captured
+        capture = app.call_args[0][1]
+        captured = result[3]
+
+        self.assertEqual(capture('200 OK', 'headers'), 'write')
+        start_response.assert_called_once_with('200 OK', 'headers', None)
+        self.assertEqual(captured, ['200 OK', 'headers'])
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    @mock.patch('bark.wsgi.Request')
+    def test_start_withproxies(self, mock_Request):
+        proxies = mock.Mock()
+        app = mock.Mock(return_value='orig_iter')
+
+        mid = middleware.BarkMiddleware(app, {}, proxies)
+
+        result = mid.start('environ', 'start_response')
+
+        self.assertEqual(result, (mock_Request.return_value,
+                                  (mid.formats, mid.emitters), 'data', [],
+                                  'orig_iter'))
+        proxies.assert_called_once_with(mock_Request.return_value)
+        mid.formats.prepare.assert_called_once_with(
+            mock_Request.return_value)
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    @mock.patch('bark.wsgi.Request')
+    def test_start_sampled_out(self, mock_Request):
         proxies = mock.Mock()
+        app = mock.Mock(return_value='orig_iter')
+
+        mid = middleware.BarkMiddleware(app, {}, proxies)
+        mid.select = mock.Mock(return_value=None)
+
+        result = mid.start('environ', 'start_response')
+
+        self.assertEqual(result, (mock_Request.return_value, None, None, [],
+                                  'orig_iter'))
+        proxies.assert_called_once_with(mock_Request.return_value)
+        mid.select.assert_called_once_with('environ')
+        self.assertFalse(mid.formats.prepare.called)
+        app.assert_called_once_with('environ', mock.ANY)
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    @mock.patch('bark.wsgi.Request')
+    def test_start_sent(self, mock_Request):
+        app = mock.Mock(return_value='orig_iter')
+        write = mock.Mock()
+        start_response = mock.Mock(return_value=write)
+        sent = [3]
+
+        mid = middleware.BarkMiddleware(app, {}, None)
+
+        mid.start('environ', start_response, sent)
+
+        # Check that the written bytes get counted
+        capture = app.call_args[0][1]
+        counting_write = capture('200 OK', 'headers')
+
+        self.assertNotEqual(counting_write, write)
+
+        counting_write('abc')
+        counting_write('')
+        counting_write('de')
+
+        self.assertEqual(write.call_args_list, [
+            mock.call('abc'), mock.call(''), mock.call('de')])
+        self.assertEqual(sent, [8])
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    @mock.patch('bark.wsgi.Request')
+    def test_start_sent_sampled_out(self, mock_Request):
+        app = mock.Mock(return_value='orig_iter')
+        start_response = mock.Mock(return_value='write')
+        sent = [0]
+
+        mid = middleware.BarkMiddleware(app, {}, None)
+        mid.select = mock.Mock(return_value=None)
+
+        mid.start('environ', start_response, sent)
+
+        capture = app.call_args[0][1]
+
+        self.assertEqual(capture('200 OK', 'headers'), 'write')
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_select_unsampled(self):
         handlers = {
-            'log1': (mock.Mock(**{
-                'prepare.return_value': 'log1',
-                'convert.return_value': 'result1',
-            }), mock.Mock()),
-            'log2': (mock.Mock(**{
-                'prepare.return_value': 'log2',
-                'convert.return_value': 'result2',
-            }), mock.Mock()),
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
         }
-        request = mock.Mock(**{'get_response.return_value': 'response'})
 
-        mid = middleware.BarkMiddleware('app', handlers, proxies)
+        mid = middleware.BarkMiddleware('app', handlers, None)
+
+        self.assertEqual(mid.select('environ'), (mid.formats, mid.emitters))
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_select_kept(self):
+        handlers = {
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
+        }
+        sampler = mock.Mock(return_value=True)
+
+        mid = middleware.BarkMiddleware('app', handlers, None,
+                                        {'log1': sampler})
+
+        self.assertEqual(mid.select('environ'), (mid.formats, mid.emitters))
+        sampler.assert_called_once_with('environ', {})
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_select_dropped(self):
+        handlers = {
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
+            'log3': ('fmt3', 'handler3'),
+        }
+        samplers = {
+            'log1': mock.Mock(return_value=False),
+            'log2': mock.Mock(return_value=True),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, None, samplers)
+
+        result = mid.select('environ')
+
+        formats, emitters = result
+        self.assertIsInstance(formats, FakeFormatSet)
+        self.assertEqual(sorted(zip(formats.formats, emitters)),
+                         [('fmt2', 'handler2'), ('fmt3', 'handler3')])
+        self.assertEqual(formats.accepts, [None, None])
+        self.assertEqual(mid.select('environ'), result)
+        self.assertTrue(mid.select('environ')[0] is formats)
+
+        # The draws are shared by the samplers
+        draws = samplers['log1'].call_args[0][1]
+        samplers['log2'].assert_called_with('environ', draws)
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_select_all_dropped(self):
+        handlers = {
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
+        }
+        samplers = {
+            'log1': mock.Mock(return_value=False),
+            'log2': mock.Mock(return_value=False),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, None, samplers)
+
+        self.assertEqual(mid.select('environ'), None)
+        self.assertEqual(mid._subsets[frozenset([0, 1])], None)
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_select_filtered(self):
+        handlers = {
+            'log1': ('fmt1', 'handler1'),
+            'log2': ('fmt2', 'handler2'),
+        }
+        sampler = mock.Mock(return_value=True)
+        filters = {
+            'log1': mock.Mock(return_value=False, request_filter=True,
+                              statuses=frozenset()),
+            'log2': mock.Mock(return_value=True, request_filter=True,
+                              statuses=frozenset([404])),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, None,
+                                        {'log1': sampler}, filters)
+
+        formats, emitters = mid.select('environ')
+
+        self.assertEqual(emitters, ['handler2'])
+        self.assertEqual(formats.accepts, [filters['log2'].accept])
+        filters['log1'].assert_called_once_with('environ', {})
+        filters['log2'].assert_called_once_with('environ', {})
+        # Filtered requests are not counted by the sampler
+        self.assertFalse(sampler.called)
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_emit(self):
+        handlers = {
+            'log1': ('fmt1', mock.Mock()),
+            'log2': ('fmt2', mock.Mock()),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, None)
+
+        mid.emit('request', 'response', (mid.formats, mid.emitters), 'data')
+
+        mid.formats.convert.assert_called_once_with(
+            'request', 'response', 'data')
+        handlers['log1'][1].assert_called_once_with('result-fmt1')
+        handlers['log2'][1].assert_called_once_with('result-fmt2')
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_emit_sampled_out(self):
+        handlers = {
+            'log1': ('fmt1', mock.Mock()),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, None)
+
+        mid.emit('request', 'response', None, None)
+
+        self.assertFalse(mid.formats.convert.called)
+        self.assertFalse(handlers['log1'][1].called)
+
+    @mock.patch('bark.format.FormatSet', FakeFormatSet)
+    def test_emit_filtered(self):
+        handlers = {
+            'log1': ('fmt1', mock.Mock()),
+            'log2': ('fmt2', mock.Mock()),
+        }
+
+        mid = middleware.BarkMiddleware('app', handlers, None)
+        mid.formats.convert.return_value = ('result1', None)
+
+        mid.emit('request', 'response', (mid.formats, mid.emitters), 'data')
+
+        mid.emitters[0].assert_called_once_with('result1')
+        self.assertFalse(mid.emitters[1].called)
+
+
+class StreamingBarkMiddlewareTest(unittest2.TestCase):
+    @mock.patch.object(middleware.StreamingBarkMiddleware, 'start',
+                       return_value=('request', 'streams', 'data',
+                                     'captured', 'orig_iter'))
+    @mock.patch.object(middleware, 'LoggingAppIter', return_value='app_iter')
+    def test_call(self, mock_LoggingAppIter, mock_start):
+        mid = middleware.StreamingBarkMiddleware('app', {}, None)
+
+        result = mid('environ', 'start_response')
+
+        self.assertEqual(result, 'app_iter')
+        mock_start.assert_called_once_with('environ', 'start_response', [0])
+        sent = mock_start.call_args[0][2]
+        mock_LoggingAppIter.assert_called_once_with(
+            mid, 'request', 'streams', 'data', 'captured', 'orig_iter', sent)
+        self.assertTrue(mock_LoggingAppIter.call_args[0][6] is sent)
+
+    @mock.patch.object(middleware.StreamingBarkMiddleware, 'start',
+                       return_value=('request', None, None, 'captured',
+                                     'orig_iter'))
+    @mock.patch.object(middleware, 'LoggingAppIter', return_value='app_iter')
+    def test_call_sampled_out(self, mock_LoggingAppIter, mock_start):
+        mid = middleware.StreamingBarkMiddleware('app', {}, None)
 
-        result = mid(request)
+        result = mid('environ', 'start_response')
 
-        proxies.assert_called_once_with(request)
-        handlers['log1'][0].prepare.assert_called_once_with(request)
-        handlers['log2'][0].prepare.assert_called_once_with(request)
-        request.get_response.assert_called_once_with('app')
-        handlers['log1'][0].convert.assert_called_once_with(
-            request, 'response', 'log1')
-        handlers['log1'][1].assert_called_once_with('result1')
-        handlers['log2'][0].convert.assert_called_once_with(
-            request, 'response', 'log2')
-        handlers['log2'][1].assert_called_once_with('result2')
-        self.assertEqual(result, 'response')
+        self.assertEqual(result, 'orig_iter')
+        self.assertFalse(mock_LoggingAppIter.called)
+
+
+class LoggingAppIterTest(unittest2.TestCase):
+    def test_init(self):
+        app_iter = middleware.LoggingAppIter('mid', 'request', 'streams',
+                                             'data', 'captured', 'app_iter')
+
+        self.assertEqual(app_iter.middleware, 'mid')
+        self.assertEqual(app_iter.request, 'request')
+        self.assertEqual(app_iter.streams, 'streams')
+        self.assertEqual(app_iter.data, 'data')
+        self.assertEqual(app_iter.captured, 'captured')
+        self.assertEqual(app_iter.app_iter, 'app_iter')
+        self.assertEqual(app_iter.sent, [0])
+        self.assertEqual(app_iter.bytes_sent, 0)
+        self.assertEqual(app_iter.closed, False)
+
+    def test_init_sent(self):
+        sent = [5]
+        app_iter = middleware.LoggingAppIter('mid', 'request', 'streams',
+                                             'data', 'captured', 'app_iter',
+                                             sent)
+
+        self.assertTrue(app_iter.sent is sent)
+        self.assertEqual(app_iter.bytes_sent, 5)
+
+    def test_iter(self):
+        app_iter = middleware.LoggingAppIter('mid', 'request', 'streams',
+                                             'data', 'captured',
+                                             ['abc', '', 'de'])
+
+        self.assertEqual(list(app_iter), ['abc', '', 'de'])
+        self.assertEqual(app_iter.bytes_sent, 5)
+
+    def test_iter_sent(self):
+        sent = [3]
+        app_iter = middleware.LoggingAppIter('mid', 'request', 'streams',
+                                             'data', 'captured',
+                                             ['abc', '', 'de'], sent)
+
+        self.assertEqual(list(app_iter), ['abc', '', 'de'])
+        self.assertEqual(sent, [8])
+        self.assertEqual(app_iter.bytes_sent, 8)
+
+    @mock.patch('bark.wsgi.Response', return_value='response')
+    def test_close(self, mock_Response):
+        mid = mock.Mock()
+        request = mock.Mock(environ={})
+        orig_iter = mock.Mock()
+        app_iter = middleware.LoggingAppIter(
+            mid, request, 'streams', 'data', ['404 Not Found', [('a', 'b')]],
+            orig_iter, [5])
+
+        app_iter.close()
+        app_iter.close()
+
+        orig_iter.close.assert_called_once_with()
+        mock_Response.assert_called_once_with('404 Not Found', [('a', 'b')])
+        self.assertEqual(request.environ, {'bark.bytes_sent': 5})
+        mid.emit.assert_called_once_with(request, 'response', 'streams',
+                                         'data')
+
+    @mock.patch('bark.wsgi.Response', return_value='response')
+    def test_close_uncloseable(self, mock_Response):
+        mid = mock.Mock()
+        request = mock.Mock(environ={})
+        app_iter = middleware.LoggingAppIter(
+            mid, request, 'streams', 'data', ['200 OK', []], [])
+
+        app_iter.close()
+
+        mock_Response.assert_called_once_with('200 OK', [])
+        self.assertEqual(request.environ, {'bark.bytes_sent': 0})
+        mid.emit.assert_called_once_with(request, 'response', 'streams',
+                                         'data')
+
+    @mock.patch('bark.wsgi.Response', return_value='response')
+    def test_close_failure(self, mock_Response):
+        mid = mock.Mock()
+        request = mock.Mock(environ={})
+        orig_iter = mock.Mock(**{'close.side_effect': TestException})
+        app_iter = middleware.LoggingAppIter(
+            mid, request, 'streams', 'data', [], orig_iter)
+
+        self.assertRaises(TestException, app_iter.close)
+        mock_Response.assert_called_once_with('500 Internal Server Error',
+                                              [])
+        mid.emit.assert_called_once_with(request, 'response', 'streams',
+                                         'data')
 
 
 def missing_handler(name, logname, args):
@@ -116,13 +551,50 @@ class BarkFilterTest(unittest2.TestCase):
 
         mid = filt('app')
 
-        mock_BarkMiddleware.assert_called_once_with('app', {}, None)
+        mock_BarkMiddleware.assert_called_once_with('app', {}, None, {}, {})
+        self.assertEqual(mid, 'mid')
+
+    @mock.patch.object(middleware.LOG, 'warn')
+    @mock.patch.object(middleware, 'StreamingBarkMiddleware',
+                       return_value='streaming')
+    @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
+    def test_streaming(self, mock_BarkMiddleware,
+                       mock_StreamingBarkMiddleware, mock_warn):
+        filt = middleware.bark_filter({}, streaming='on')
+
+        mid = filt('app')
+
+        self.assertFalse(mock_warn.called)
+        self.assertFalse(mock_BarkMiddleware.called)
+        mock_StreamingBarkMiddleware.assert_called_once_with(
+            'app', {}, None, {}, {})
+        self.assertEqual(mid, 'streaming')
+
+    @mock.patch.object(middleware.LOG, 'warn')
+    @mock.patch.object(middleware, 'StreamingBarkMiddleware',
+                       return_value='streaming')
+    @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
+    def test_badoptions(self, mock_BarkMiddleware,
+                        mock_StreamingBarkMiddleware, mock_warn):
+        filt = middleware.bark_filter({}, streaming='sure', compile='maybe')
+
+        mid = filt('app')
+
+        mock_warn.assert_has_calls([
+            mock.call("Cannot understand 'streaming' option: "
+                      "invalid Boolean value 'sure'"),
+            mock.call("Cannot understand 'compile' option: "
+                      "invalid Boolean value 'maybe'"),
+        ], any_order=True)
+        self.assertFalse(mock_StreamingBarkMiddleware.called)
+        mock_BarkMiddleware.assert_called_once_with('app', {}, None, {}, {})
         self.assertEqual(mid, 'mid')
 
     @mock.patch.object(middleware.LOG, 'warn')
     @mock.patch('ConfigParser.SafeConfigParser')
     @mock.patch('bark.proxy.ProxyConfig')
-    @mock.patch('bark.format.Format.parse', side_effect=lambda x: x)
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
     @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
     @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
     def test_localonly(self, mock_BarkMiddleware, mock_get_handler, mock_parse,
@@ -143,8 +615,8 @@ class BarkFilterTest(unittest2.TestCase):
         self.assertFalse(mock_SafeConfigParser.called)
         self.assertFalse(mock_ProxyConfig.called)
         mock_parse.assert_has_calls([
-            mock.call('format string for log1'),
-            mock.call('format string for log2'),
+            mock.call('format string for log1', compile=True),
+            mock.call('format string for log2', compile=True),
         ], any_order=True)
         mock_get_handler.assert_has_calls([
             mock.call('file', 'log1',
@@ -160,13 +632,14 @@ class BarkFilterTest(unittest2.TestCase):
         mock_BarkMiddleware.assert_called_once_with('app', {
             'log1': ('format string for log1', 'file'),
             'log2': ('format string for log2', 'other'),
-        }, None)
+        }, None, {}, {})
         self.assertEqual(mid, 'mid')
 
     @mock.patch.object(middleware.LOG, 'warn')
     @mock.patch('ConfigParser.SafeConfigParser')
     @mock.patch('bark.proxy.ProxyConfig')
-    @mock.patch('bark.format.Format.parse', side_effect=lambda x: x)
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
     @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
     @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
     def test_missingformat(self, mock_BarkMiddleware, mock_get_handler,
@@ -186,7 +659,8 @@ class BarkFilterTest(unittest2.TestCase):
 
         self.assertFalse(mock_SafeConfigParser.called)
         self.assertFalse(mock_ProxyConfig.called)
-        mock_parse.assert_called_once_with('format string for log2')
+        mock_parse.assert_called_once_with('format string for log2',
+                                           compile=True)
         mock_get_handler.assert_called_once_with('other', 'log2',
                                                  dict(arg3='argument 3',
                                                       arg4='argument 4'))
@@ -198,13 +672,14 @@ class BarkFilterTest(unittest2.TestCase):
 
         mock_BarkMiddleware.assert_called_once_with('app', {
             'log2': ('format string for log2', 'other'),
-        }, None)
+        }, None, {}, {})
         self.assertEqual(mid, 'mid')
 
     @mock.patch.object(middleware.LOG, 'warn')
     @mock.patch('ConfigParser.SafeConfigParser')
     @mock.patch('bark.proxy.ProxyConfig')
-    @mock.patch('bark.format.Format.parse', side_effect=lambda x: x)
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
     @mock.patch('bark.handlers.get_handler', side_effect=missing_handler)
     @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
     def test_missinghandler(self, mock_BarkMiddleware, mock_get_handler,
@@ -226,8 +701,8 @@ class BarkFilterTest(unittest2.TestCase):
         self.assertFalse(mock_SafeConfigParser.called)
         self.assertFalse(mock_ProxyConfig.called)
         mock_parse.assert_has_calls([
-            mock.call('format string for log1'),
-            mock.call('format string for log2'),
+            mock.call('format string for log1', compile=True),
+            mock.call('format string for log2', compile=True),
         ], any_order=True)
         mock_get_handler.assert_has_calls([
             mock.call('file', 'log1',
@@ -244,7 +719,7 @@ class BarkFilterTest(unittest2.TestCase):
 
         mock_BarkMiddleware.assert_called_once_with('app', {
             'log2': ('format string for log2', 'other'),
-        }, None)
+        }, None, {}, {})
         self.assertEqual(mid, 'mid')
 
     @mock.patch.object(middleware.LOG, 'warn')
@@ -256,7 +731,8 @@ class BarkFilterTest(unittest2.TestCase):
         }[x],
     }))
     @mock.patch('bark.proxy.ProxyConfig')
-    @mock.patch('bark.format.Format.parse', side_effect=lambda x: x)
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
     @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
     @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
     def test_conffile(self, mock_BarkMiddleware, mock_get_handler, mock_parse,
@@ -284,9 +760,9 @@ class BarkFilterTest(unittest2.TestCase):
         ])
         self.assertFalse(mock_ProxyConfig.called)
         mock_parse.assert_has_calls([
-            mock.call('format string for log1'),
-            mock.call('format string for log2'),
-            mock.call('format 3'),
+            mock.call('format string for log1', compile=True),
+            mock.call('format string for log2', compile=True),
+            mock.call('format 3', compile=True),
         ], any_order=True)
         mock_get_handler.assert_has_calls([
             mock.call('file', 'log1',
@@ -305,7 +781,7 @@ class BarkFilterTest(unittest2.TestCase):
             'log1': ('format string for log1', 'file'),
             'log2': ('format string for log2', 'other'),
             'log3': ('format 3', 'file'),
-        }, None)
+        }, None, {}, {})
         self.assertEqual(mid, 'mid')
 
     @mock.patch.object(middleware.LOG, 'warn')
@@ -337,7 +813,8 @@ class BarkFilterTest(unittest2.TestCase):
 
         mid = filt('app')
 
-        mock_BarkMiddleware.assert_called_once_with('app', {}, 'proxies')
+        mock_BarkMiddleware.assert_called_once_with('app', {}, 'proxies',
+                                                    {}, {})
         self.assertEqual(mid, 'mid')
 
     @mock.patch.object(middleware.LOG, 'warn')
@@ -372,7 +849,7 @@ class BarkFilterTest(unittest2.TestCase):
 
         mid = filt('app')
 
-        mock_BarkMiddleware.assert_called_once_with('app', {}, None)
+        mock_BarkMiddleware.assert_called_once_with('app', {}, None, {}, {})
         self.assertEqual(mid, 'mid')
 
     @mock.patch.object(middleware.LOG, 'warn')
@@ -384,7 +861,8 @@ class BarkFilterTest(unittest2.TestCase):
         }[x],
     }))
     @mock.patch('bark.proxy.ProxyConfig', return_value='proxies')
-    @mock.patch('bark.format.Format.parse', side_effect=lambda x: x)
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
     @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
     @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
     def test_together(self, mock_BarkMiddleware, mock_get_handler, mock_parse,
@@ -419,8 +897,8 @@ class BarkFilterTest(unittest2.TestCase):
             arg9='argument 9',
         ))
         mock_parse.assert_has_calls([
-            mock.call('format string for log1'),
-            mock.call('format string for log2'),
+            mock.call('format string for log1', compile=True),
+            mock.call('format string for log2', compile=True),
         ], any_order=True)
         mock_get_handler.assert_has_calls([
             mock.call('file', 'log1',
@@ -437,5 +915,120 @@ class BarkFilterTest(unittest2.TestCase):
         mock_BarkMiddleware.assert_called_once_with('app', {
             'log1': ('format string for log1', 'file'),
             'log2': ('format string for log2', 'other'),
-        }, 'proxies')
+        }, 'proxies', {}, {})
         self.assertEqual(mid, 'mid')
+
+    @mock.patch.object(middleware.LOG, 'warn')
+    @mock.patch('bark.sampling.Sampler', return_value='sampler')
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
+    @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
+    @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
+    def test_sample(self, mock_BarkMiddleware, mock_get_handler, mock_parse,
+                    mock_Sampler, mock_warn):
+        local_conf = {
+            'log1.format': 'format string for log1',
+            'log1.arg1': 'argument 1',
+            'log1.sample': '1%',
+            'log1.sample_header': 'X-Request-Id',
+            'log2.format': 'format string for log2',
+            'log2.sample_note': 'ignored',
+        }
+
+        filt = middleware.bark_filter({}, **local_conf)
+
+        mock_Sampler.assert_called_once_with(0.01, 'X-Request-Id', None)
+        mock_get_handler.assert_has_calls([
+            mock.call('file', 'log1', dict(arg1='argument 1')),
+            mock.call('file', 'log2', {}),
+        ], any_order=True)
+        self.assertFalse(mock_warn.called)
+
+        mid = filt('app')
+
+        mock_BarkMiddleware.assert_called_once_with('app', {
+            'log1': ('format string for log1', 'file'),
+            'log2': ('format string for log2', 'file'),
+        }, None, {'log1': 'sampler'}, {})
+        self.assertEqual(mid, 'mid')
+
+    @mock.patch.object(middleware.LOG, 'warn')
+    @mock.patch('bark.sampling.Sampler', return_value='sampler')
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
+    @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
+    @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
+    def test_badsample(self, mock_BarkMiddleware, mock_get_handler,
+                       mock_parse, mock_Sampler, mock_warn):
+        local_conf = {
+            'log1.format': 'format string for log1',
+            'log1.sample': 'often',
+        }
+
+        filt = middleware.bark_filter({}, **local_conf)
+
+        self.assertFalse(mock_Sampler.called)
+        mock_warn.assert_called_once_with(
+            "Cannot understand 'sample' option for log 'log1': "
+            "could not convert string to float: often")
+
+        mid = filt('app')
+
+        mock_BarkMiddleware.assert_called_once_with('app', {
+            'log1': ('format string for log1', 'file'),
+        }, None, {}, {})
+
+    @mock.patch.object(middleware.LOG, 'warn')
+    @mock.patch('bark.filters.parse',
+                side_effect=lambda x: 'filter' if x.pop('exclude', None)
+                else None)
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
+    @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
+    @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
+    def test_filters(self, mock_BarkMiddleware, mock_get_handler, mock_parse,
+                     mock_filters_parse, mock_warn):
+        local_conf = {
+            'log1.format': 'format string for log1',
+            'log1.exclude': 'yes',
+            'log2.format': 'format string for log2',
+        }
+
+        filt = middleware.bark_filter({}, **local_conf)
+
+        mock_get_handler.assert_has_calls([
+            mock.call('file', 'log1', {}),
+            mock.call('file', 'log2', {}),
+        ], any_order=True)
+        self.assertFalse(mock_warn.called)
+
+        mid = filt('app')
+
+        mock_BarkMiddleware.assert_called_once_with('app', {
+            'log1': ('format string for log1', 'file'),
+            'log2': ('format string for log2', 'file'),
+        }, None, {}, {'log1': 'filter'})
+        self.assertEqual(mid, 'mid')
+
+    @mock.patch.object(middleware.LOG, 'warn')
+    @mock.patch('bark.filters.parse', side_effect=ValueError('bad'))
+    @mock.patch('bark.format.Format.parse',
+                side_effect=lambda x, compile: x)
+    @mock.patch('bark.handlers.get_handler', side_effect=lambda x, y, z: x)
+    @mock.patch.object(middleware, 'BarkMiddleware', return_value='mid')
+    def test_badfilters(self, mock_BarkMiddleware, mock_get_handler,
+                        mock_parse, mock_filters_parse, mock_warn):
+        local_conf = {
+            'log1.format': 'format string for log1',
+        }
+
+        filt = middleware.bark_filter({}, **local_conf)
+
+        mock_warn.assert_called_once_with(
+            "Cannot understand filter options for log 'log1': bad")
+
+        mid = filt('app')
+
+        mock_BarkMiddleware.assert_called_once_with('app', {
+            'log1': ('format string for log1', 'file'),
+        }, None, {}, {})
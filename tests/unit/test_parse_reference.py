@@ -0,0 +1,325 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import unittest2
+
+from bark import conversions
+from tests.unit import parse_reference
+
+
+class ParseStateTest(unittest2.TestCase):
+    def test_init(self):
+        state = parse_reference.ParseState('fmt', 'format')
+
+        self.assertEqual(state.fmt, 'fmt')
+        self.assertEqual(state.format, 'format')
+        self.assertEqual(state.state, ['string'])
+        self.assertEqual(state.str_begin, 0)
+        self.assertEqual(state.param_begin, None)
+        self.assertEqual(state.conv_begin, None)
+        self.assertEqual(state.modifier, None)
+        self.assertEqual(state.codes, [])
+        self.assertEqual(state.reject, False)
+        self.assertEqual(state.ignore, 0)
+        self.assertEqual(state.code_last, False)
+
+    def test_eq(self):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.state = ['string', 'other']
+
+        self.assertFalse(state == 'string')
+        self.assertTrue(state == 'other')
+
+    def test_pop_state_noidx(self):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.state = ['string', 'other']
+
+        state.pop_state()
+
+        self.assertEqual(state.state, ['string'])
+        self.assertEqual(state.str_begin, 0)
+
+    def test_pop_state_withidx(self):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.state = ['string', 'other']
+
+        state.pop_state(5)
+
+        self.assertEqual(state.state, ['string'])
+        self.assertEqual(state.str_begin, 5)
+
+    def test_check_ignore(self):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.ignore = 1
+
+        self.assertTrue(state.check_ignore())
+        self.assertEqual(state.ignore, 0)
+        self.assertFalse(state.check_ignore())
+        self.assertEqual(state.ignore, 0)
+
+    def test_set_ignore(self):
+        state = parse_reference.ParseState('fmt', 'format')
+
+        state.set_ignore(1)
+
+        self.assertEqual(state.ignore, 1)
+
+        state.set_ignore(2)
+
+        self.assertEqual(state.ignore, 3)
+
+    def test_add_text_empty(self):
+        state = parse_reference.ParseState(mock.Mock(), 'a format string')
+        state.str_begin = 2
+
+        state.add_text(2)
+
+        self.assertFalse(state.fmt.append_text.called)
+        self.assertEqual(state.str_begin, 2)
+
+    def test_add_text_nonext(self):
+        state = parse_reference.ParseState(mock.Mock(), 'a format string')
+        state.str_begin = 2
+
+        state.add_text(8)
+
+        state.fmt.append_text.assert_called_once_with('format')
+        self.assertEqual(state.str_begin, 2)
+
+    def test_add_text_withnext(self):
+        state = parse_reference.ParseState(mock.Mock(), 'a format string')
+        state.str_begin = 2
+
+        state.add_text(8, 8)
+
+        state.fmt.append_text.assert_called_once_with('format')
+        self.assertEqual(state.str_begin, 8)
+
+    def test_add_escape_available(self):
+        state = parse_reference.ParseState(mock.Mock(
+            _unescape={'\\n': '\n'}), 'a \\n format string')
+        state.str_begin = 2
+
+        state.add_escape(4, 'n')
+
+        state.fmt.append_text.assert_called_once_with('\n')
+
+    def test_add_escape_unavailable(self):
+        state = parse_reference.ParseState(mock.Mock(
+            _unescape={'\\n': '\n'}), 'a \\t format string')
+        state.str_begin = 2
+
+        state.add_escape(4, 't')
+
+        state.fmt.append_text.assert_called_once_with('t')
+
+    def test_set_param(self):
+        state = parse_reference.ParseState('fmt', 'a format string')
+        state.modifier = conversions.Modifier()
+        state.param_begin = 2
+
+        state.set_param(8)
+
+        self.assertEqual(state.modifier, conversions.Modifier(param='format'))
+
+    def test_set_conversion_noconv_nocodes(self):
+        state = parse_reference.ParseState(mock.Mock(**{
+            '_get_conversion.return_value': 'fake_conversion',
+        }), 'a format string')
+        modifier = mock.Mock()
+        state.modifier = modifier
+        state.param_begin = 2
+        state.reject = True
+        state.code_last = True
+
+        state.set_conversion(7)
+
+        state.fmt._get_conversion.assert_called_once_with('t', modifier)
+        state.fmt.append_conv.assert_called_once_with('fake_conversion')
+        self.assertEqual(state.param_begin, None)
+        self.assertEqual(state.conv_begin, None)
+        self.assertEqual(state.modifier, None)
+        self.assertEqual(state.codes, [])
+        self.assertEqual(state.reject, False)
+        self.assertEqual(state.code_last, False)
+
+    def test_set_conversion_withconv(self):
+        state = parse_reference.ParseState(mock.Mock(**{
+            '_get_conversion.return_value': 'fake_conversion',
+        }), 'a format string')
+        modifier = mock.Mock()
+        state.modifier = modifier
+        state.param_begin = 2
+        state.conv_begin = 2
+        state.reject = True
+        state.code_last = True
+
+        state.set_conversion(8)
+
+        state.fmt._get_conversion.assert_called_once_with('format', modifier)
+        state.fmt.append_conv.assert_called_once_with('fake_conversion')
+        self.assertEqual(state.param_begin, None)
+        self.assertEqual(state.conv_begin, None)
+        self.assertEqual(state.modifier, None)
+        self.assertEqual(state.codes, [])
+        self.assertEqual(state.reject, False)
+        self.assertEqual(state.code_last, False)
+
+    def test_set_conversion_withcodes(self):
+        state = parse_reference.ParseState(mock.Mock(**{
+            '_get_conversion.return_value': 'fake_conversion',
+        }), 'a format string')
+        state.modifier = conversions.Modifier(param='param')
+        state.param_begin = 2
+        state.codes = [101, 202, 303]
+        state.reject = True
+        state.code_last = True
+
+        state.set_conversion(7)
+
+        state.fmt._get_conversion.assert_called_once_with(
+            't', conversions.Modifier([101, 202, 303], True, 'param'))
+        state.fmt.append_conv.assert_called_once_with('fake_conversion')
+        self.assertEqual(state.param_begin, None)
+        self.assertEqual(state.conv_begin, None)
+        self.assertEqual(state.modifier, None)
+        self.assertEqual(state.codes, [])
+        self.assertEqual(state.reject, False)
+        self.assertEqual(state.code_last, False)
+
+    def test_set_reject(self):
+        state = parse_reference.ParseState('fmt', 'format')
+
+        state.set_reject()
+
+        self.assertEqual(state.reject, True)
+
+    def test_set_code_short(self):
+        state = parse_reference.ParseState('fmt', 'a 1')
+
+        result = state.set_code(2)
+
+        self.assertEqual(result, False)
+        self.assertEqual(state.codes, [])
+        self.assertEqual(state.ignore, 0)
+        self.assertEqual(state.code_last, False)
+
+    def test_set_code_bad(self):
+        state = parse_reference.ParseState('fmt', 'a 10o')
+
+        result = state.set_code(2)
+
+        self.assertEqual(result, False)
+        self.assertEqual(state.codes, [])
+        self.assertEqual(state.ignore, 0)
+        self.assertEqual(state.code_last, False)
+
+    def test_set_code(self):
+        state = parse_reference.ParseState('fmt', 'a 101')
+
+        result = state.set_code(2)
+
+        self.assertEqual(result, True)
+        self.assertEqual(state.codes, [101])
+        self.assertEqual(state.ignore, 2)
+        self.assertEqual(state.code_last, True)
+
+    def test_end_state_nostr(self):
+        state = parse_reference.ParseState(mock.Mock(), 'format')
+        state.str_begin = 6
+
+        result = state.end_state()
+
+        self.assertFalse(state.fmt.append_text.called)
+        self.assertEqual(result, state.fmt)
+
+    def test_end_state_longstack(self):
+        state = parse_reference.ParseState(mock.Mock(), 'format')
+        state.state = ['string', 'other']
+
+        result = state.end_state()
+
+        state.fmt.append_text.assert_called_once_with(
+            "(Bad format string; ended in state 'other')")
+        self.assertEqual(result, state.fmt)
+
+    def test_end_state_wrongstate(self):
+        state = parse_reference.ParseState(mock.Mock(), 'format')
+        state.state = ['other']
+
+        result = state.end_state()
+
+        state.fmt.append_text.assert_called_once_with(
+            "(Bad format string; ended in state 'other')")
+        self.assertEqual(result, state.fmt)
+
+    def test_end_state(self):
+        state = parse_reference.ParseState(mock.Mock(), 'format')
+
+        result = state.end_state()
+
+        state.fmt.append_text.assert_called_once_with('format')
+        self.assertEqual(result, state.fmt)
+
+    @mock.patch.object(conversions, 'Modifier', return_value='some_conv')
+    def test_conversion(self, mock_Modifier):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.str_begin = 2
+        state.param_begin = 2
+        state.conv_begin = 2
+        state.modifier = 'modifier'
+        state.codes = [101, 202]
+        state.reject = True
+        state.code_last = True
+
+        state.conversion(8)
+
+        self.assertEqual(state.state, ['string', 'conversion'])
+        self.assertEqual(state.str_begin, 8)
+        self.assertEqual(state.param_begin, None)
+        self.assertEqual(state.conv_begin, None)
+        self.assertEqual(state.modifier, 'some_conv')
+        self.assertEqual(state.codes, [])
+        self.assertEqual(state.reject, False)
+        self.assertEqual(state.code_last, False)
+        mock_Modifier.assert_called_once_with()
+
+    def test_escape(self):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.str_begin = 2
+
+        state.escape(8)
+
+        self.assertEqual(state.state, ['string', 'escape'])
+        self.assertEqual(state.str_begin, 8)
+
+    def test_param(self):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.param_begin = 2
+
+        state.param(8)
+
+        self.assertEqual(state.state, ['string', 'param'])
+        self.assertEqual(state.param_begin, 8)
+
+    def test_conv(self):
+        state = parse_reference.ParseState('fmt', 'format')
+        state.conv_begin = 2
+
+        state.conv(8)
+
+        self.assertEqual(state.state, ['string', 'conv'])
+        self.assertEqual(state.conv_begin, 8)
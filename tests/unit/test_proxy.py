@@ -13,6 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import bisect
+import itertools
+import os
+import random
+import shutil
+import tempfile
+
 import mock
 import netaddr
 import unittest2
@@ -20,85 +27,388 @@ import unittest2
 from bark import proxy
 
 
+class ParseAddrTest(unittest2.TestCase):
+    def test_parse_addr_v4(self):
+        self.assertEqual(proxy._parse_addr('10.0.0.1'), (4, 0x0a000001))
+
+    def test_parse_addr_v4_aton(self):
+        self.assertEqual(proxy._parse_addr('10.1'), (4, 0x0a000001))
+        self.assertEqual(proxy._parse_addr('010.0.0.1'), (4, 0x08000001))
+
+    def test_parse_addr_v6(self):
+        self.assertEqual(proxy._parse_addr('2001:db8::1'),
+                         (6, 0x20010db8 << 96 | 1))
+        self.assertEqual(proxy._parse_addr('::ffff:10.0.0.1'),
+                         (6, 0xffff0a000001))
+
+    @mock.patch('socket.inet_aton')
+    def test_parse_addr_garbage(self, mock_inet_aton):
+        self.assertEqual(proxy._parse_addr('unknown'), None)
+        self.assertEqual(proxy._parse_addr(''), None)
+        self.assertEqual(proxy._parse_addr('10.0.0.1 '), None)
+        self.assertFalse(mock_inet_aton.called)
+
+    def test_parse_addr_invalid(self):
+        self.assertEqual(proxy._parse_addr('10.0.0.256'), None)
+        self.assertEqual(proxy._parse_addr('1.2.3.4.5'), None)
+        self.assertEqual(proxy._parse_addr('2001:db8:::1'), None)
+        self.assertEqual(proxy._parse_addr('2001:db8::1:10.0.0'), None)
+
+
 class ParseIPTest(unittest2.TestCase):
-    @mock.patch('netaddr.IPAddress', side_effect=ValueError)
-    def test_parse_ip_value_error(self, mock_IPAddress):
+    @mock.patch.object(proxy, '_parse_addr', return_value=None)
+    def test_parse_ip_invalid(self, mock_parse_addr):
         result = proxy._parse_ip(' 10.0.0.1 ')
 
         self.assertEqual(result, None)
-        mock_IPAddress.assert_called_once_with('10.0.0.1')
+        mock_parse_addr.assert_called_once_with('10.0.0.1')
+
+    def test_parse_ip_v4(self):
+        self.assertEqual(proxy._parse_ip(' 10.0.0.1 '), (4, 0x0a000001))
+
+    def test_parse_ip_v6_pure(self):
+        self.assertEqual(proxy._parse_ip(' 2001:db8::1 '),
+                         (6, 0x20010db8 << 96 | 1))
+        self.assertEqual(proxy._parse_ip('::1:0:0'), (6, 1 << 32))
+
+    def test_parse_ip_v6_v4(self):
+        self.assertEqual(proxy._parse_ip('::ffff:10.0.0.1'), (4, 0x0a000001))
+        self.assertEqual(proxy._parse_ip('::10.0.0.1'), (4, 0x0a000001))
+        self.assertEqual(proxy._parse_ip('::1'), (4, 1))
+
+    def test_matches_netaddr(self):
+        rng = random.Random(42)
+
+        for i in range(1000):
+            if i % 2:
+                addr = netaddr.IPAddress(rng.getrandbits(32), 4)
+            else:
+                addr = netaddr.IPAddress(rng.getrandbits(128) >>
+                                         rng.choice((0, 16, 64, 96)), 6)
+            if addr.version == 6 and addr.value >> 32 in (0, 0xffff):
+                expected = addr.ipv4()
+            else:
+                expected = addr
+
+            result = proxy._parse_ip(str(addr))
+
+            self.assertEqual(result, (expected.version, expected.value))
+            self.assertEqual(proxy._format_ip(result), str(expected))
+
+
+class ParseNetTest(unittest2.TestCase):
+    def test_parse_net_address(self):
+        self.assertEqual(proxy._parse_net(' 10.0.0.1 '),
+                         (4, 0x0a000001, 0x0a000001))
+
+    def test_parse_net_cidr(self):
+        self.assertEqual(proxy._parse_net('10.0.0.0 / 8'),
+                         (4, 0x0a000000, 0x0affffff))
+        self.assertEqual(proxy._parse_net('2001:db8::/32'),
+                         (6, 0x20010db8 << 96, (0x20010db8 + 1 << 96) - 1))
+
+    def test_parse_net_host_bits(self):
+        self.assertEqual(proxy._parse_net('10.1.2.3/16'),
+                         (4, 0x0a010000, 0x0a01ffff))
+
+    def test_parse_net_canonical(self):
+        self.assertEqual(proxy._parse_net('::ffff:10.0.0.0/104'),
+                         (4, 0x0a000000, 0x0affffff))
+        self.assertEqual(proxy._parse_net('::1'), (4, 1, 1))
+        self.assertEqual(proxy._parse_net('::/64'),
+                         (6, 0, (1 << 64) - 1))
+
+    def test_parse_net_invalid(self):
+        self.assertEqual(proxy._parse_net('unknown'), None)
+        self.assertEqual(proxy._parse_net('10.0.0.0/33'), None)
+        self.assertEqual(proxy._parse_net('10.0.0.0/'), None)
+        self.assertEqual(proxy._parse_net('10.0.0.0/-1'), None)
+        self.assertEqual(proxy._parse_net(object()), None)
+
+    def test_parse_net_netaddr(self):
+        self.assertEqual(proxy._parse_net(netaddr.IPNetwork('10.0.0.0/8')),
+                         (4, 0x0a000000, 0x0affffff))
+        self.assertEqual(proxy._parse_net(netaddr.IPRange('10.0.0.5',
+                                                          '10.0.0.9')),
+                         (4, 0x0a000005, 0x0a000009))
+
+
+class FormatIPTest(unittest2.TestCase):
+    def test_format_ip_v4(self):
+        self.assertEqual(proxy._format_ip((4, 0x0a000001)), '10.0.0.1')
+
+    def test_format_ip_v6(self):
+        self.assertEqual(proxy._format_ip((6, 0x20010db8 << 96 | 1)),
+                         '2001:db8::1')
+
+
+class ModifierTest(unittest2.TestCase):
+    def test_modifier(self):
+        names = ('restrict', 'internal')
+
+        self.assertEqual(proxy._modifier('restrict(10.0.0.1)', names),
+                         ('restrict', '10.0.0.1'))
+        self.assertEqual(proxy._modifier('internal(10.0.0.1)', names),
+                         ('internal', '10.0.0.1'))
+        self.assertEqual(proxy._modifier('accept(10.0.0.1)', names),
+                         (None, 'accept(10.0.0.1)'))
+        self.assertEqual(proxy._modifier('restrict(10.0.0.1', names),
+                         (None, 'restrict(10.0.0.1'))
+        self.assertEqual(proxy._modifier('10.0.0.1', names),
+                         (None, '10.0.0.1'))
+
+
+class ParseForwardedTest(unittest2.TestCase):
+    def test_parse_forwarded(self):
+        result = proxy._parse_forwarded(
+            'for=192.0.2.60;proto=http;by=203.0.113.43')
+
+        self.assertEqual(result, [
+            ({'for': '192.0.2.60', 'proto': 'http', 'by': '203.0.113.43'},
+             41),
+        ])
 
-    @mock.patch('netaddr.IPAddress', side_effect=netaddr.AddrFormatError)
-    def test_parse_ip_addr_format_error(self, mock_IPAddress):
-        result = proxy._parse_ip(' 10.0.0.1 ')
+    def test_parse_forwarded_elements(self):
+        header = 'for=192.0.2.43 ,, For="[2001:db8:cafe::17]:4711" , '
 
-        self.assertEqual(result, None)
-        mock_IPAddress.assert_called_once_with('10.0.0.1')
+        result = proxy._parse_forwarded(header)
 
-    @mock.patch('netaddr.IPAddress', return_value=mock.Mock(version=4))
-    def test_parse_ip_v4(self, mock_IPAddress):
-        result = proxy._parse_ip(' 10.0.0.1 ')
+        self.assertEqual(result, [
+            ({'for': '192.0.2.43'}, 14),
+            ({'for': '[2001:db8:cafe::17]:4711'}, 48),
+        ])
+        self.assertEqual(header[:result[0][1]], 'for=192.0.2.43')
 
-        self.assertEqual(id(result), id(mock_IPAddress.return_value))
-        mock_IPAddress.assert_called_once_with('10.0.0.1')
-        self.assertFalse(result.ipv4.called)
+    def test_parse_forwarded_quoted(self):
+        result = proxy._parse_forwarded(
+            'for="_hidden"; host="a\\"b\\\\c;d,e"')
 
-    @mock.patch('netaddr.IPAddress', return_value=mock.Mock(**{
-        'version': 6,
-        'ipv4.side_effect': netaddr.AddrConversionError,
-    }))
-    def test_parse_ip_v6_pure(self, mock_IPAddress):
-        result = proxy._parse_ip(' 10.0.0.1 ')
+        self.assertEqual(result, [
+            ({'for': '_hidden', 'host': 'a"b\\c;d,e'}, 33),
+        ])
 
-        self.assertEqual(id(result), id(mock_IPAddress.return_value))
-        mock_IPAddress.assert_called_once_with('10.0.0.1')
-        result.ipv4.assert_called_once_with()
+    def test_parse_forwarded_malformed(self):
+        result = proxy._parse_forwarded(
+            'for=192.0.2.43 bogus, for=198.51.100.17, "for"')
 
-    @mock.patch('netaddr.IPAddress', return_value=mock.Mock(**{
-        'version': 6,
-        'ipv4.return_value': 'v4addr',
-    }))
-    def test_parse_ip_v6_v4(self, mock_IPAddress):
-        result = proxy._parse_ip(' 10.0.0.1 ')
+        self.assertEqual(result, [
+            (None, 20),
+            ({'for': '198.51.100.17'}, 39),
+            (None, 46),
+        ])
+
+    def test_parse_forwarded_empty(self):
+        self.assertEqual(proxy._parse_forwarded(''), [])
+        self.assertEqual(proxy._parse_forwarded(' , ;, '), [])
+
+
+class ForwardedNodeTest(unittest2.TestCase):
+    def test_forwarded_node_v4(self):
+        self.assertEqual(proxy._forwarded_node('192.0.2.43'), '192.0.2.43')
+        self.assertEqual(proxy._forwarded_node('192.0.2.43:47011'),
+                         '192.0.2.43')
+
+    def test_forwarded_node_v6(self):
+        self.assertEqual(proxy._forwarded_node('[2001:db8::17]'),
+                         '2001:db8::17')
+        self.assertEqual(proxy._forwarded_node('[2001:db8::17]:4711'),
+                         '2001:db8::17')
+        self.assertEqual(proxy._forwarded_node('2001:db8::17'),
+                         '2001:db8::17')
+
+    def test_forwarded_node_invalid(self):
+        self.assertEqual(proxy._forwarded_node('[2001:db8::17'), '')
+        self.assertEqual(proxy._forwarded_node('[2001:db8::17]4711'), '')
+        self.assertEqual(proxy._forwarded_node('unknown'), 'unknown')
+        self.assertEqual(proxy._forwarded_node('_hidden'), '_hidden')
+
+
+class ReadListTest(unittest2.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_list(self):
+        filename = os.path.join(self.tmpdir, 'list')
+        with open(filename, 'w') as f:
+            f.write('# CDN egress ranges\n'
+                    '10.0.0.0/8\n'
+                    '\n'
+                    '  restrict(10.1.0.0/16)  # edge\n'
+                    '2001:db8::/32\n')
+
+        result = proxy._read_list(filename)
+
+        self.assertEqual(result, ['10.0.0.0/8', 'restrict(10.1.0.0/16)',
+                                  '2001:db8::/32'])
+
+    def test_read_list_missing(self):
+        self.assertRaises(IOError, proxy._read_list,
+                          os.path.join(self.tmpdir, 'missing'))
+
+
+class CompileIntervalsTest(unittest2.TestCase):
+    def test_compile_intervals(self):
+        groups = [
+            [(4, 10, 19)],
+            [(4, 15, 29), (6, 5, 5)],
+        ]
+
+        result = proxy._compile_intervals(groups, tuple)
+
+        self.assertEqual(result, {
+            4: ((0, 10, 15, 20, 30),
+                ((False, False), (True, False), (True, True),
+                 (False, True), (False, False))),
+            6: ((0, 5, 6),
+                ((False, False), (False, True), (False, False))),
+        })
+
+
+class CompileIndexTest(unittest2.TestCase):
+    def test_compile_index(self):
+        accepted = [(4, 0x0a000000, 0x0affffff),
+                    (6, 0x20010db8 << 96, (0x20010db8 + 1 << 96) - 1)]
+        excluded = [(4, 0x0a010000, 0x0a01ffff),
+                    (4, 0x0affffff, 0x0affffff)]
+
+        result = proxy._compile_index(accepted, excluded)
+
+        self.assertEqual(result, {
+            4: ((0, 0x0a000000, 0x0a010000, 0x0a020000, 0x0affffff),
+                (False, True, False, True, False)),
+            6: ((0, 0x20010db8 << 96, (0x20010db8 + 1) << 96),
+                (False, True, False)),
+        })
 
-        self.assertEqual(result, 'v4addr')
-        mock_IPAddress.assert_called_once_with('10.0.0.1')
-        mock_IPAddress.return_value.ipv4.assert_called_once_with()
+    def test_compile_index_merged(self):
+        accepted = [(4, 0, 0xffffffff)]
+        excluded = [(4, 0x0a000000, 0x0a7fffff),
+                    (4, 0x0a800000, 0x0affffff),
+                    (4, 0xffffffff, 0xffffffff)]
+
+        result = proxy._compile_index(accepted, excluded)
+
+        self.assertEqual(result[4], ((0, 0x0a000000, 0x0b000000,
+                                      0xffffffff),
+                                     (True, False, True, False)))
+        self.assertEqual(result[6], ((0,), (False,)))
+
+    def test_compile_index_not_retained(self):
+        result1 = proxy._compile_index([(4, 0, 0xffffffff)],
+                                       [(4, 0x0a000000, 0x0affffff)])
+        result2 = proxy._compile_index([(4, 0, 0xffffffff)],
+                                       [(4, 0x0a000000, 0x0affffff)])
+
+        self.assertEqual(result1, result2)
+        self.assertIsNot(result1, result2)
+
+    def test_compile_index_overlap(self):
+        accepted = [(4, 0x0a000000, 0x0affffff),
+                    (4, 0x0a010000, 0x0a01ffff),
+                    (4, 0x0a800000, 0x0b7fffff)]
+
+        result = proxy._compile_index(accepted, [])
+
+        self.assertEqual(result[4], ((0, 0x0a000000, 0x0b800000),
+                                     (False, True, False)))
+
+    def test_matches_ipset(self):
+        rng = random.Random(42)
+
+        def network(version):
+            if version == 4:
+                return netaddr.IPNetwork((rng.getrandbits(32),
+                                          rng.randint(8, 32)), 4).cidr
+            return netaddr.IPNetwork((rng.getrandbits(128),
+                                      rng.randint(16, 128)), 6).cidr
+
+        def ranges(nets):
+            return [(net.version, net.first, net.last) for net in nets]
+
+        for i in range(5):
+            accepted = [network(rng.choice((4, 6))) for j in range(20)]
+            excluded = [network(rng.choice((4, 6))) for j in range(20)]
+            index = proxy._compile_index(ranges(accepted), ranges(excluded))
+            accepted_set = netaddr.IPSet(accepted)
+            excluded_set = netaddr.IPSet(excluded)
+
+            # Probe the edges of every network, and random addresses
+            probes = []
+            for cidr in itertools.chain(accepted, excluded):
+                size = 1 << (32 if cidr.version == 4 else 128)
+                for value in (cidr.first - 1, cidr.first, cidr.last,
+                              cidr.last + 1):
+                    if 0 <= value < size:
+                        probes.append(netaddr.IPAddress(value,
+                                                        cidr.version))
+            probes.extend(netaddr.IPAddress(rng.getrandbits(32), 4)
+                          for j in range(100))
+
+            for addr in probes:
+                starts, permitted = index[addr.version]
+                result = permitted[bisect.bisect_right(starts,
+                                                       addr.value) - 1]
+
+                self.assertEqual(result, addr in accepted_set and
+                                 addr not in excluded_set, addr)
 
 
 class ProxyTest(unittest2.TestCase):
+    def assertInRanges(self, addr, ranges):
+        version, value = proxy._parse_ip(addr)
+        self.assertTrue(any(vers == version and first <= value <= last
+                            for vers, first, last in ranges), addr)
+
+    def assertNotInRanges(self, addr, ranges):
+        version, value = proxy._parse_ip(addr)
+        self.assertFalse(any(vers == version and first <= value <= last
+                             for vers, first, last in ranges), addr)
+
     def test_init_restrictive(self):
         pxy = proxy.Proxy('10.0.0.1', restrictive=True)
 
         self.assertEqual(pxy.address, '10.0.0.1')
-        self.assertFalse('207.97.209.147' in pxy.accepted)
-        self.assertFalse('10.0.0.1' in pxy.accepted)
-        self.assertFalse('127.0.0.1' in pxy.accepted)
-        self.assertFalse('207.97.209.147' in pxy.excluded)
-        self.assertTrue('10.0.0.1' in pxy.excluded)
-        self.assertTrue('127.0.0.1' in pxy.excluded)
+        self.assertEqual(pxy.accepted, [])
+        self.assertNotInRanges('207.97.209.147', pxy.excluded)
+        self.assertInRanges('10.0.0.1', pxy.excluded)
+        self.assertInRanges('127.0.0.1', pxy.excluded)
+
+    def test_init_shared(self):
+        pxy1 = proxy.Proxy('10.0.0.1')
+        pxy2 = proxy.Proxy('10.0.0.2')
+
+        self.assertEqual(pxy1.excluded, pxy2.excluded)
+        self.assertIsNot(pxy1.excluded, pxy2.excluded)
+        self.assertIs(pxy1.excluded[0], pxy2.excluded[0])
+        self.assertIs(pxy1.accepted[0], pxy2.accepted[0])
+
+    def test_slots(self):
+        pxy = proxy.Proxy('10.0.0.1')
+
+        self.assertFalse(hasattr(pxy, '__dict__'))
 
     def test_init_internal(self):
         pxy = proxy.Proxy('10.0.0.1', prohibit_internal=False)
 
         self.assertEqual(pxy.address, '10.0.0.1')
-        self.assertTrue('207.97.209.147' in pxy.accepted)
-        self.assertTrue('10.0.0.1' in pxy.accepted)
-        self.assertTrue('127.0.0.1' in pxy.accepted)
-        self.assertFalse('207.97.209.147' in pxy.excluded)
-        self.assertFalse('10.0.0.1' in pxy.excluded)
-        self.assertTrue('127.0.0.1' in pxy.excluded)
+        self.assertEqual(pxy.accepted, [(4, 0, (1 << 32) - 1),
+                                        (6, 0, (1 << 128) - 1)])
+        self.assertNotInRanges('207.97.209.147', pxy.excluded)
+        self.assertNotInRanges('10.0.0.1', pxy.excluded)
+        self.assertInRanges('127.0.0.1', pxy.excluded)
 
     def test_init_normal(self):
         pxy = proxy.Proxy('10.0.0.1')
 
         self.assertEqual(pxy.address, '10.0.0.1')
-        self.assertTrue('207.97.209.147' in pxy.accepted)
-        self.assertTrue('10.0.0.1' in pxy.accepted)
-        self.assertTrue('127.0.0.1' in pxy.accepted)
-        self.assertFalse('207.97.209.147' in pxy.excluded)
-        self.assertTrue('10.0.0.1' in pxy.excluded)
-        self.assertTrue('127.0.0.1' in pxy.excluded)
+        self.assertEqual(pxy.accepted, [(4, 0, (1 << 32) - 1),
+                                        (6, 0, (1 << 128) - 1)])
+        self.assertNotInRanges('207.97.209.147', pxy.excluded)
+        self.assertInRanges('10.0.0.1', pxy.excluded)
+        self.assertInRanges('127.0.0.1', pxy.excluded)
 
     def test_contains(self):
         pxy = proxy.Proxy('10.0.0.1')
@@ -106,6 +416,73 @@ class ProxyTest(unittest2.TestCase):
         self.assertTrue('207.97.209.147' in pxy)
         self.assertFalse('10.0.0.1' in pxy)
         self.assertFalse('127.0.0.1' in pxy)
+        self.assertTrue('2001:4860::8888' in pxy)
+        self.assertFalse('::1' in pxy)
+        self.assertFalse('::ffff:127.0.0.1' in pxy)
+        self.assertFalse('unknown' in pxy)
+
+    def test_contains_parsed(self):
+        pxy = proxy.Proxy('10.0.0.1')
+
+        self.assertTrue(proxy._parse_ip('207.97.209.147') in pxy)
+        self.assertFalse(proxy._parse_ip('10.0.0.1') in pxy)
+        self.assertTrue(proxy._parse_ip('2001:4860::8888') in pxy)
+
+    @mock.patch.object(proxy, '_compile_index', return_value={
+        4: ((0, 100), (False, True)),
+    })
+    def test_contains_index(self, mock_compile_index):
+        pxy = proxy.Proxy('10.0.0.1')
+        pxy.accept('10.0.0.0/8')
+
+        self.assertFalse((4, 99) in pxy)
+        self.assertTrue((4, 100) in pxy)
+        mock_compile_index.assert_called_once_with(pxy.accepted,
+                                                   pxy.excluded)
+
+    @mock.patch.object(proxy, '_compile_index', return_value='index')
+    def test_compile(self, mock_compile_index):
+        pxy = proxy.Proxy('10.0.0.1')
+        pxy.restrict('203.0.113.0/24')
+
+        pxy.compile()
+        pxy.compile()
+
+        self.assertEqual(pxy._index, 'index')
+        mock_compile_index.assert_called_once_with(pxy.accepted,
+                                                   pxy.excluded)
+
+    def test_default_index(self):
+        for restrictive, prohibit_internal in itertools.product(
+                (False, True), repeat=2):
+            pxy1 = proxy.Proxy('10.0.0.1', restrictive, prohibit_internal)
+            pxy2 = proxy.Proxy('10.0.0.2', restrictive, prohibit_internal)
+
+            self.assertIs(pxy1._index, pxy2._index)
+            self.assertEqual(pxy1._index, proxy._compile_index(
+                pxy1.accepted, pxy1.excluded))
+
+    def test_extend(self):
+        pxy = proxy.Proxy('10.0.0.1', restrictive=True)
+        default_index = pxy._index
+
+        pxy.extend([(4, 0xcb007100, 0xcb0071ff)],
+                   [(4, 0xcb007180, 0xcb0071ff)])
+
+        self.assertEqual(pxy.accepted, [(4, 0xcb007100, 0xcb0071ff)])
+        self.assertIn((4, 0xcb007180, 0xcb0071ff), pxy.excluded)
+        self.assertEqual(pxy._index, None)
+        self.assertTrue('203.0.113.7' in pxy)
+        self.assertFalse('203.0.113.130' in pxy)
+        self.assertIsNot(pxy._index, default_index)
+
+    def test_extend_empty(self):
+        pxy = proxy.Proxy('10.0.0.1')
+        default_index = pxy._index
+
+        pxy.extend()
+
+        self.assertIs(pxy._index, default_index)
 
     @mock.patch.object(proxy.LOG, 'warn')
     def test_restrict(self, mock_warn):
@@ -115,19 +492,20 @@ class ProxyTest(unittest2.TestCase):
 
         pxy.restrict('207.97.209.147')
 
+        self.assertEqual(pxy._index, None)
         self.assertFalse('207.97.209.147' in pxy)
 
         self.assertFalse(mock_warn.called)
 
-    @mock.patch.object(proxy, '_parse_ip', return_value=None)
+    @mock.patch.object(proxy, '_parse_net', return_value=None)
     @mock.patch.object(proxy.LOG, 'warn')
-    def test_restrict_badaddr(self, mock_warn, mock_parse_ip):
+    def test_restrict_badaddr(self, mock_warn, mock_parse_net):
         pxy = proxy.Proxy('10.0.0.1')
         pxy.excluded = mock.Mock()
 
         pxy.restrict('207.97.209.147')
 
-        self.assertFalse(pxy.excluded.add.called)
+        self.assertFalse(pxy.excluded.append.called)
         mock_warn.assert_called_once_with(
             "Cannot restrict address '207.97.209.147' from proxy 10.0.0.1: "
             "invalid address")
@@ -140,29 +518,176 @@ class ProxyTest(unittest2.TestCase):
 
         pxy.accept('207.97.209.147')
 
+        self.assertEqual(pxy._index, None)
         self.assertTrue('207.97.209.147' in pxy)
 
         self.assertFalse(mock_warn.called)
 
-    @mock.patch.object(proxy, '_parse_ip', return_value=None)
     @mock.patch.object(proxy.LOG, 'warn')
-    def test_accept_badaddr(self, mock_warn, mock_parse_ip):
+    def test_accept_cidr(self, mock_warn):
+        pxy = proxy.Proxy('10.0.0.1', restrictive=True)
+
+        pxy.accept('207.97.209.0/24')
+        pxy.restrict('207.97.209.128/25')
+
+        self.assertTrue('207.97.209.127' in pxy)
+        self.assertFalse('207.97.209.128' in pxy)
+        self.assertFalse('207.97.210.1' in pxy)
+
+        self.assertFalse(mock_warn.called)
+
+    @mock.patch.object(proxy, '_parse_net', return_value=None)
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_accept_badaddr(self, mock_warn, mock_parse_net):
         pxy = proxy.Proxy('10.0.0.1')
         pxy.accepted = mock.Mock()
 
         pxy.accept('207.97.209.147')
 
-        self.assertFalse(pxy.accepted.add.called)
+        self.assertFalse(pxy.accepted.append.called)
         mock_warn.assert_called_once_with(
             "Cannot add address '207.97.209.147' to proxy 10.0.0.1: "
             "invalid address")
 
 
+class ResultCacheTest(unittest2.TestCase):
+    def test_init(self):
+        cache = proxy.ResultCache(5)
+
+        self.assertEqual(cache.size, 5)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 0)
+        self.assertEqual(len(cache), 0)
+
+    def test_get_miss(self):
+        cache = proxy.ResultCache(5)
+
+        self.assertEqual(cache.get('key'), None)
+        self.assertEqual(cache.get('key', 'default'), 'default')
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 2)
+
+    def test_get_hit(self):
+        cache = proxy.ResultCache(5)
+        cache.put('key', None)
+
+        self.assertEqual(cache.get('key', 'default'), None)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 0)
+
+    def test_put_evicts(self):
+        cache = proxy.ResultCache(3)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key.upper())
+
+        cache.put('d', 'D')
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 'B')
+
+    def test_get_refreshes(self):
+        cache = proxy.ResultCache(3)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key.upper())
+
+        cache.get('a')
+        cache.put('d', 'D')
+
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('b'), None)
+
+    def test_put_refreshes(self):
+        cache = proxy.ResultCache(3)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key.upper())
+
+        cache.put('a', 'E')
+        cache.put('d', 'D')
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get('a'), 'E')
+        self.assertEqual(cache.get('b'), None)
+
+
 class ProxyConfigTest(unittest2.TestCase):
+    def test_init_header_key(self):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For'))
+
+        self.assertEqual(pc.header, 'X-Forwarded-For')
+        self.assertEqual(pc.header_key, 'HTTP_X_FORWARDED_FOR')
+
     def test_init_noheader(self):
         self.assertRaises(KeyError, proxy.ProxyConfig, {})
 
-    @mock.patch.object(proxy, 'Proxy', side_effect=lambda x: x)
+    def test_init_forwarded(self):
+        pc1 = proxy.ProxyConfig(dict(header='X-Forwarded-For'))
+        pc2 = proxy.ProxyConfig(dict(header='Forwarded'))
+
+        self.assertEqual(pc1.forwarded, False)
+        self.assertEqual(pc2.forwarded, True)
+        self.assertEqual(pc2.header_key, 'HTTP_FORWARDED')
+
+    def test_init_compiled(self):
+        pc1 = proxy.ProxyConfig(dict(header='X-Forwarded-For'))
+        pc2 = proxy.ProxyConfig(dict(header='X-Forwarded-For',
+                                     proxies='10.0.0.1, restrict(10.0.0.2)',
+                                     **{'10.0.0.2': '203.0.113.0/24'}))
+
+        self.assertNotEqual(pc1.pseudo_proxy._index, None)
+        for pxy in pc2.proxies.values():
+            self.assertNotEqual(pxy._index, None)
+
+    @mock.patch.object(proxy, '_compile_index')
+    def test_contains_compiled(self, mock_compile_index):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For',
+                                    proxies='10.0.0.1'))
+        mock_compile_index.reset_mock()
+        pxy = pc.proxies[(4, 0x0a000001)]
+        pxy._index = {4: ((0,), (True,))}
+
+        self.assertTrue('203.0.113.7' in pxy)
+        self.assertFalse(mock_compile_index.called)
+
+    def test_init_nocache(self):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For'))
+
+        self.assertEqual(pc.cache, None)
+
+    def test_init_cache(self):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For',
+                                    cache_size='100'))
+
+        self.assertTrue(isinstance(pc.cache, proxy.ResultCache))
+        self.assertEqual(pc.cache.size, 100)
+
+    def test_init_cache_zero(self):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For',
+                                    cache_size='0'))
+
+        self.assertEqual(pc.cache, None)
+
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_init_cache_invalid(self, mock_warn):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For',
+                                    cache_size='many'))
+
+        self.assertEqual(pc.cache, None)
+        mock_warn.assert_called_once_with(
+            "Cannot understand 'cache_size' option for proxies: invalid "
+            "literal for int() with base 10: 'many'")
+
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_init_cache_negative(self, mock_warn):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For',
+                                    cache_size='-1'))
+
+        self.assertEqual(pc.cache, None)
+        mock_warn.assert_called_once_with(
+            "Cannot understand 'cache_size' option for proxies: cache "
+            "size -1 is negative")
+
+    @mock.patch.object(proxy, 'Proxy')
     def test_init_noproxies(self, mock_Proxy):
         config = dict(header='x-forwarded-for')
         pc = proxy.ProxyConfig(config)
@@ -170,12 +695,15 @@ class ProxyConfigTest(unittest2.TestCase):
         mock_Proxy.assert_called_once_with('0.0.0.0/0')
         self.assertEqual(pc.header, 'x-forwarded-for')
         self.assertEqual(pc.proxies, None)
-        self.assertEqual(pc.pseudo_proxy, '0.0.0.0/0')
+        self.assertEqual(pc.pseudo_proxy, mock_Proxy.return_value)
+        mock_Proxy.return_value.compile.assert_called_once_with()
 
+    @mock.patch.object(proxy, '_format_ip', lambda x: x)
     @mock.patch.object(proxy, '_parse_ip',
                        lambda x: None if x == 'none' else x)
     @mock.patch.object(proxy.LOG, 'warn')
-    @mock.patch.object(proxy, 'Proxy', side_effect=lambda *args: args)
+    @mock.patch.object(proxy, 'Proxy',
+                       side_effect=lambda *args: mock.Mock(args=args))
     def test_init_proxies_basic(self, mock_Proxy, mock_warn):
         config = dict(
             header='x-forwarded-for',
@@ -191,16 +719,20 @@ class ProxyConfigTest(unittest2.TestCase):
             mock.call('10.0.0.4', False, False),
         ])
         self.assertEqual(pc.header, 'x-forwarded-for')
-        self.assertEqual(pc.proxies, {
+        self.assertEqual(dict((addr, pxy.args)
+                              for addr, pxy in pc.proxies.items()), {
             '10.0.0.1': ('10.0.0.1', False, True),
             '10.0.0.2': ('10.0.0.2', False, True),
             '10.0.0.3': ('10.0.0.3', True, True),
             '10.0.0.4': ('10.0.0.4', False, False),
         })
+        for pxy in pc.proxies.values():
+            pxy.compile.assert_called_once_with()
         self.assertEqual(pc.pseudo_proxy, None)
         mock_warn.assert_called_once_with(
             "Cannot understand proxy IP address 'none'")
 
+    @mock.patch.object(proxy, '_format_ip', lambda x: x)
     @mock.patch.object(proxy, '_parse_ip', lambda x: x)
     @mock.patch.object(proxy, 'Proxy')
     def test_init_proxies_rules(self, mock_Proxy):
@@ -220,6 +752,147 @@ class ProxyConfigTest(unittest2.TestCase):
             mock.call().restrict('10.0.1.4'),
         ])
 
+    @mock.patch.object(proxy, 'Proxy')
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_init_rules_file_only(self, mock_warn, mock_Proxy):
+        pc = proxy.ProxyConfig(dict(header='x-forwarded-for',
+                                    rules_file='rules.txt'))
+
+        self.assertEqual(pc.proxies, None)
+        self.assertEqual(pc.ranges, None)
+        self.assertEqual(pc.pseudo_proxy, mock_Proxy.return_value)
+        mock_warn.assert_called_once_with(
+            "Ignoring 'rules_file' option for proxies: no 'proxies_file' "
+            "option is set")
+
+    @mock.patch.object(proxy.ProxyConfig, 'load')
+    def test_init_proxies_file(self, mock_load):
+        pc = proxy.ProxyConfig(dict(header='x-forwarded-for',
+                                    proxies_file='proxies.txt',
+                                    rules_file='rules.txt'))
+
+        self.assertEqual(pc.proxies, {})
+        self.assertEqual(pc.ranges, None)
+        self.assertEqual(pc.pseudo_proxy, None)
+        mock_load.assert_called_once_with('proxies.txt', 'rules.txt')
+
+    @mock.patch.object(proxy.ProxyConfig, 'load')
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_init_rules_file_ignored(self, mock_warn, mock_load):
+        pc = proxy.ProxyConfig(dict(header='x-forwarded-for',
+                                    proxies='10.0.0.1',
+                                    rules_file='rules.txt'))
+
+        self.assertEqual(pc.proxies.keys(), [(4, 0x0a000001)])
+        self.assertFalse(mock_load.called)
+        mock_warn.assert_called_once_with(
+            "Ignoring 'rules_file' option for proxies: no 'proxies_file' "
+            "option is set")
+
+    @mock.patch.object(proxy, '_read_list', side_effect=lambda x: {
+        'proxies.txt': ['203.0.113.0/24', 'restrict(203.0.113.128/25)',
+                        'internal(10.0.0.0/8)', '2001:db8::/32', 'bogus'],
+        'rules.txt': ['198.51.100.0/24', 'accept(10.5.0.0/16)',
+                      'restrict(192.0.2.0/24)', 'restrict(bogus)'],
+    }[x])
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_load(self, mock_warn, mock_read_list):
+        pc = proxy.ProxyConfig(dict(header='x-forwarded-for',
+                                    proxies='10.0.0.1'))
+
+        pc.load('proxies.txt', 'rules.txt')
+
+        self.assertEqual(mock_warn.call_args_list, [
+            mock.call("Cannot understand proxy IP address 'bogus' in "
+                      "'proxies.txt'"),
+            mock.call("Cannot understand rule 'bogus' in 'rules.txt'"),
+        ])
+        self.assertEqual(pc.proxies.keys(), [(4, 0x0a000001)])
+
+        # Look up the shared proxies
+        def lookup(addr):
+            version, value = proxy._parse_ip(addr)
+            starts, proxies = pc.ranges[version]
+            return proxies[bisect.bisect_right(starts, value) - 1]
+
+        normal = lookup('203.0.113.1')
+        restrictive = lookup('203.0.113.129')
+        internal = lookup('10.0.0.2')
+
+        self.assertEqual(len(set([normal, restrictive, internal])), 3)
+        self.assertIs(lookup('2001:db8::1'), normal)
+        self.assertIs(lookup('10.0.0.1'), internal)
+        self.assertIs(lookup('192.0.2.1'), None)
+        self.assertIs(lookup('2001:db9::1'), None)
+        self.assertEqual(normal.address, 'proxies.txt')
+        for pxy in (normal, restrictive, internal):
+            self.assertNotEqual(pxy._index, None)
+
+        # The rules are shared
+        self.assertTrue('198.51.100.1' in normal)
+        self.assertFalse('192.0.2.1' in normal)
+        self.assertTrue('198.51.100.1' in restrictive)
+        self.assertFalse('207.97.209.147' in restrictive)
+        self.assertTrue('10.5.0.1' in internal)
+        self.assertTrue('10.6.0.1' in internal)
+        self.assertFalse('192.0.2.1' in internal)
+
+    @mock.patch.object(proxy, '_read_list', return_value=['203.0.113.0/24'])
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_load_no_rules(self, mock_warn, mock_read_list):
+        pc = proxy.ProxyConfig(dict(header='x-forwarded-for',
+                                    proxies_file='proxies.txt'))
+
+        mock_read_list.assert_called_once_with('proxies.txt')
+        self.assertFalse(mock_warn.called)
+        self.assertTrue(pc.validate((4, 0xcb007101), (4, 0xcf61d193)))
+        self.assertFalse(pc.validate((4, 0xcb007101), (4, 0x0a000001)))
+
+    @mock.patch.object(proxy, '_read_list', side_effect=IOError('oops'))
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_load_unreadable_proxies(self, mock_warn, mock_read_list):
+        pc = proxy.ProxyConfig(dict(header='x-forwarded-for',
+                                    proxies_file='proxies.txt',
+                                    rules_file='rules.txt'))
+
+        mock_read_list.assert_called_once_with('proxies.txt')
+        mock_warn.assert_called_once_with(
+            "Cannot read proxies file 'proxies.txt': oops")
+        self.assertEqual(pc.ranges, None)
+        self.assertFalse(pc.validate((4, 0xcb007101), (4, 0xcf61d193)))
+
+    @mock.patch.object(proxy.LOG, 'warn')
+    def test_load_unreadable_rules(self, mock_warn):
+        def read_list(filename):
+            if filename == 'rules.txt':
+                raise IOError('oops')
+            return ['restrict(203.0.113.0/24)']
+
+        with mock.patch.object(proxy, '_read_list', side_effect=read_list):
+            pc = proxy.ProxyConfig(dict(header='x-forwarded-for',
+                                        proxies_file='proxies.txt',
+                                        rules_file='rules.txt'))
+
+        mock_warn.assert_called_once_with(
+            "Cannot read rules file 'rules.txt': oops")
+        self.assertFalse(pc.validate((4, 0xcb007101), (4, 0xcf61d193)))
+
+    def test_validate_range(self):
+        pc = proxy.ProxyConfig(dict(header=''))
+        pc.pseudo_proxy = None
+        pc.proxies = {
+            (4, 15): ('exact',),
+        }
+        pc.ranges = {
+            4: ((0, 10, 20), (None, ('range',), None)),
+        }
+
+        self.assertEqual(pc.validate((4, 15), 'exact'), True)
+        self.assertEqual(pc.validate((4, 15), 'range'), False)
+        self.assertEqual(pc.validate((4, 16), 'range'), True)
+        self.assertEqual(pc.validate((4, 20), 'range'), False)
+        self.assertEqual(pc.validate((4, 9), 'range'), False)
+
     def test_validate_noproxy(self):
         pc = proxy.ProxyConfig(dict(header=''))
         pc.pseudo_proxy = None
@@ -264,66 +937,65 @@ class ProxyConfigTest(unittest2.TestCase):
     @mock.patch.object(proxy, '_parse_ip')
     def test_call_noheader(self, mock_parse_ip):
         pc = proxy.ProxyConfig(dict(header='header'))
-        request = mock.Mock(headers={}, environ=dict(REMOTE_ADDR='10.0.0.1'))
+        request = mock.Mock(environ=dict(REMOTE_ADDR='10.0.0.1'))
 
         result = pc(request)
 
         self.assertEqual(result, False)
         self.assertFalse(mock_parse_ip.called)
-        self.assertEqual(request.headers, {})
         self.assertEqual(request.environ, dict(REMOTE_ADDR='10.0.0.1'))
 
     @mock.patch.object(proxy, '_parse_ip')
     def test_call_noremote(self, mock_parse_ip):
         pc = proxy.ProxyConfig(dict(header='header'))
-        request = mock.Mock(headers=dict(header='10.0.1.1'), environ={})
+        request = mock.Mock(environ=dict(HTTP_HEADER='10.0.1.1'))
 
         result = pc(request)
 
         self.assertEqual(result, False)
         self.assertFalse(mock_parse_ip.called)
-        self.assertEqual(request.headers, dict(header='10.0.1.1'))
-        self.assertEqual(request.environ, {})
+        self.assertEqual(request.environ, dict(HTTP_HEADER='10.0.1.1'))
 
     @mock.patch.object(proxy, '_parse_ip', return_value=None)
     def test_call_badremote(self, mock_parse_ip):
         pc = proxy.ProxyConfig(dict(header='header'))
-        request = mock.Mock(
-            headers=dict(header='10.0.1.1'),
-            environ=dict(REMOTE_ADDR='10.0.0.1'),
-        )
+        request = mock.Mock(environ=dict(
+            HTTP_HEADER='10.0.1.1',
+            REMOTE_ADDR='10.0.0.1',
+        ))
 
         result = pc(request)
 
         self.assertEqual(result, False)
         mock_parse_ip.assert_called_once_with('10.0.0.1')
-        self.assertEqual(request.headers, dict(header='10.0.1.1'))
-        self.assertEqual(request.environ, dict(REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(request.environ, dict(HTTP_HEADER='10.0.1.1',
+                                               REMOTE_ADDR='10.0.0.1'))
 
     @mock.patch.object(proxy, '_parse_ip', side_effect=lambda x: x)
     def test_call_noagents(self, mock_parse_ip):
         pc = proxy.ProxyConfig(dict(header='header'))
-        request = mock.Mock(
-            headers=dict(header=',,'),
-            environ=dict(REMOTE_ADDR='10.0.0.1'),
-        )
+        request = mock.Mock(environ=dict(
+            HTTP_HEADER=',,',
+            REMOTE_ADDR='10.0.0.1',
+        ))
 
         result = pc(request)
 
         self.assertEqual(result, False)
         mock_parse_ip.assert_called_once_with('10.0.0.1')
-        self.assertEqual(request.headers, dict(header=',,'))
-        self.assertEqual(request.environ, dict(REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(request.environ, dict(HTTP_HEADER=',,',
+                                               REMOTE_ADDR='10.0.0.1'))
 
+    @mock.patch.object(proxy, '_format_ip', lambda x: x)
     @mock.patch.object(proxy.ProxyConfig, 'validate', return_value=True)
     @mock.patch.object(proxy, '_parse_ip',
                        side_effect=lambda x: None if x == 'none' else x)
     def test_call_bad_agent(self, mock_parse_ip, mock_validate):
         pc = proxy.ProxyConfig(dict(header='header'))
-        request = mock.Mock(
-            headers=dict(header='10.0.1.1 , 10.0.1.2,none,10.0.1.3,10.0.1.4,'),
-            environ=dict(REMOTE_ADDR='10.0.0.1'),
-        )
+        request = mock.Mock(environ=dict(
+            HTTP_HEADER='10.0.1.1 , 10.0.1.2,none,10.0.1.3,10.0.1.4,',
+            REMOTE_ADDR='10.0.0.1',
+        ))
 
         result = pc(request)
 
@@ -340,9 +1012,8 @@ class ProxyConfigTest(unittest2.TestCase):
             mock.call('10.0.0.1', '10.0.1.4'),
             mock.call('10.0.1.4', '10.0.1.3'),
         ])
-        self.assertEqual(request.headers,
-                         dict(header='10.0.1.1,10.0.1.2,none'))
         self.assertEqual(request.environ, {
+            'HTTP_HEADER': '10.0.1.1,10.0.1.2,none',
             'REMOTE_ADDR': '10.0.0.1',
             'bark.useragent_ip': '10.0.1.3',
             'bark.notes': {
@@ -350,17 +1021,18 @@ class ProxyConfigTest(unittest2.TestCase):
             },
         })
 
+    @mock.patch.object(proxy, '_format_ip', lambda x: x)
     @mock.patch.object(proxy.ProxyConfig, 'validate',
                        side_effect=lambda x, y: (False if y == 'invalid'
                                                  else True))
     @mock.patch.object(proxy, '_parse_ip', side_effect=lambda x: x)
     def test_call_invalid_agent(self, mock_parse_ip, mock_validate):
         pc = proxy.ProxyConfig(dict(header='header'))
-        request = mock.Mock(
-            headers=dict(header=('10.0.1.1 , 10.0.1.2,invalid,'
-                                 '10.0.1.3,10.0.1.4,')),
-            environ=dict(REMOTE_ADDR='10.0.0.1'),
-        )
+        request = mock.Mock(environ=dict(
+            HTTP_HEADER=('10.0.1.1 , 10.0.1.2,invalid,'
+                         '10.0.1.3,10.0.1.4,'),
+            REMOTE_ADDR='10.0.0.1',
+        ))
 
         result = pc(request)
 
@@ -378,9 +1050,8 @@ class ProxyConfigTest(unittest2.TestCase):
             mock.call('10.0.1.4', '10.0.1.3'),
             mock.call('10.0.1.3', 'invalid'),
         ])
-        self.assertEqual(request.headers,
-                         dict(header='10.0.1.1,10.0.1.2,invalid'))
         self.assertEqual(request.environ, {
+            'HTTP_HEADER': '10.0.1.1,10.0.1.2,invalid',
             'REMOTE_ADDR': '10.0.0.1',
             'bark.useragent_ip': '10.0.1.3',
             'bark.notes': {
@@ -388,14 +1059,15 @@ class ProxyConfigTest(unittest2.TestCase):
             },
         })
 
+    @mock.patch.object(proxy, '_format_ip', lambda x: x)
     @mock.patch.object(proxy.ProxyConfig, 'validate', return_value=True)
     @mock.patch.object(proxy, '_parse_ip', side_effect=lambda x: x)
     def test_call_valid(self, mock_parse_ip, mock_validate):
         pc = proxy.ProxyConfig(dict(header='header'))
-        request = mock.Mock(
-            headers=dict(header=('10.0.1.1 , 10.0.1.2, 10.0.1.3,10.0.1.4,')),
-            environ=dict(REMOTE_ADDR='10.0.0.1'),
-        )
+        request = mock.Mock(environ=dict(
+            HTTP_HEADER=('10.0.1.1 , 10.0.1.2, 10.0.1.3,10.0.1.4,'),
+            REMOTE_ADDR='10.0.0.1',
+        ))
 
         result = pc(request)
 
@@ -415,7 +1087,6 @@ class ProxyConfigTest(unittest2.TestCase):
             mock.call('10.0.1.3', '10.0.1.2'),
             mock.call('10.0.1.2', '10.0.1.1'),
         ])
-        self.assertEqual(request.headers, {})
         self.assertEqual(request.environ, {
             'REMOTE_ADDR': '10.0.0.1',
             'bark.useragent_ip': '10.0.1.1',
@@ -424,3 +1095,157 @@ class ProxyConfigTest(unittest2.TestCase):
                                            '10.0.1.4,10.0.0.1'),
             },
         })
+
+    def test_call_canonical(self):
+        pc = proxy.ProxyConfig({
+            'header': 'x-forwarded-for',
+            'proxies': 'internal(::ffff:10.0.0.1), restrict(10.0.0.2)',
+            '10.0.0.2': '2001:db8::/32',
+        })
+        environ = {
+            'HTTP_X_FORWARDED_FOR': '2001:db8::7, ::ffff:10.0.0.2',
+            'REMOTE_ADDR': '::ffff:10.0.0.1',
+        }
+
+        result = pc(mock.Mock(environ=environ))
+
+        self.assertEqual(result, True)
+        self.assertEqual(set(pc.proxies), set([(4, 0x0a000001),
+                                               (4, 0x0a000002)]))
+        self.assertEqual(pc.proxies[(4, 0x0a000001)].address, '10.0.0.1')
+        self.assertEqual(environ, {
+            'REMOTE_ADDR': '::ffff:10.0.0.1',
+            'bark.useragent_ip': '2001:db8::7',
+            'bark.notes': {
+                'remoteip-proxy-ip-list': '10.0.0.2,10.0.0.1',
+            },
+        })
+
+    @mock.patch.object(proxy.ProxyConfig, 'resolve',
+                       return_value=('10.0.1.3', '10.0.0.1', '10.0.1.2',
+                                     None))
+    def test_call_cache_miss(self, mock_resolve):
+        pc = proxy.ProxyConfig(dict(header='header', cache_size='10'))
+        request = mock.Mock(environ=dict(
+            HTTP_HEADER='10.0.1.2,10.0.1.3',
+            REMOTE_ADDR='10.0.0.1',
+        ))
+
+        result = pc(request)
+
+        self.assertEqual(result, True)
+        mock_resolve.assert_called_once_with('10.0.0.1', '10.0.1.2,10.0.1.3')
+        self.assertEqual(pc.cache.misses, 1)
+        self.assertEqual(pc.cache.get(('10.0.0.1', '10.0.1.2,10.0.1.3')),
+                         ('10.0.1.3', '10.0.0.1', '10.0.1.2', None))
+        self.assertEqual(request.environ, {
+            'HTTP_HEADER': '10.0.1.2',
+            'REMOTE_ADDR': '10.0.0.1',
+            'bark.useragent_ip': '10.0.1.3',
+            'bark.notes': {
+                'remoteip-proxy-ip-list': '10.0.0.1',
+            },
+        })
+
+    @mock.patch.object(proxy.ProxyConfig, 'resolve')
+    def test_call_cache_hit(self, mock_resolve):
+        pc = proxy.ProxyConfig(dict(header='header', cache_size='10'))
+        pc.cache.put(('10.0.0.1', '10.0.1.2,10.0.1.3'),
+                     ('10.0.1.2', '10.0.1.3,10.0.0.1', '',
+                      {'forwarded-proto': 'https'}))
+        request = mock.Mock(environ=dict(
+            HTTP_HEADER='10.0.1.2,10.0.1.3',
+            REMOTE_ADDR='10.0.0.1',
+        ))
+
+        result = pc(request)
+
+        self.assertEqual(result, True)
+        self.assertFalse(mock_resolve.called)
+        self.assertEqual(pc.cache.hits, 1)
+        self.assertEqual(request.environ, {
+            'REMOTE_ADDR': '10.0.0.1',
+            'bark.useragent_ip': '10.0.1.2',
+            'bark.notes': {
+                'remoteip-proxy-ip-list': '10.0.1.3,10.0.0.1',
+                'forwarded-proto': 'https',
+            },
+        })
+
+    @mock.patch.object(proxy.ProxyConfig, 'resolve', return_value=None)
+    def test_call_cache_failure(self, mock_resolve):
+        pc = proxy.ProxyConfig(dict(header='header', cache_size='10'))
+        environ = dict(HTTP_HEADER=',,', REMOTE_ADDR='10.0.0.1')
+
+        for i in range(2):
+            result = pc(mock.Mock(environ=environ))
+
+            self.assertEqual(result, False)
+
+        mock_resolve.assert_called_once_with('10.0.0.1', ',,')
+        self.assertEqual(pc.cache.hits, 1)
+        self.assertEqual(pc.cache.misses, 1)
+        self.assertEqual(environ, dict(HTTP_HEADER=',,',
+                                       REMOTE_ADDR='10.0.0.1'))
+
+    def test_resolve_forwarded(self):
+        pc = proxy.ProxyConfig(dict(
+            header='Forwarded',
+            proxies='internal(10.0.0.1), internal(10.0.0.2)',
+        ))
+
+        result = pc.resolve(
+            '10.0.0.1', 'for="[2001:db8::7]:4711";proto=https;'
+            'host=example.com, for=10.0.0.2:8080;proto=http')
+
+        self.assertEqual(result, (
+            '2001:db8::7', '10.0.0.2,10.0.0.1', '', {
+                'forwarded-proto': 'https',
+                'forwarded-host': 'example.com',
+            }))
+
+    def test_resolve_forwarded_partial(self):
+        pc = proxy.ProxyConfig(dict(
+            header='Forwarded',
+            proxies='internal(10.0.0.1)',
+        ))
+
+        result = pc.resolve(
+            '10.0.0.1', 'for=unknown;proto=https , '
+            'for=203.0.113.7;proto=http;by=10.0.0.1;host=example.com')
+
+        self.assertEqual(result, (
+            '203.0.113.7', '10.0.0.1', 'for=unknown;proto=https', {
+                'forwarded-by': '10.0.0.1',
+                'forwarded-host': 'example.com',
+                'forwarded-proto': 'http',
+            }))
+
+    def test_resolve_forwarded_invalid(self):
+        pc = proxy.ProxyConfig(dict(
+            header='Forwarded',
+            proxies='internal(10.0.0.1)',
+        ))
+
+        result = pc.resolve('10.0.0.1',
+                            'for=203.0.113.7, proto=https;for=_hidden')
+
+        self.assertEqual(result, (
+            '10.0.0.1', '', 'for=203.0.113.7, proto=https;for=_hidden',
+            None))
+
+    def test_resolve_forwarded_empty(self):
+        pc = proxy.ProxyConfig(dict(header='Forwarded'))
+
+        self.assertEqual(pc.resolve('10.0.0.1', ' , '), None)
+        self.assertEqual(pc.resolve('bogus', 'for=203.0.113.7'), None)
+
+    @mock.patch.object(proxy, '_parse_forwarded')
+    def test_resolve_x_forwarded_for(self, mock_parse_forwarded):
+        pc = proxy.ProxyConfig(dict(header='X-Forwarded-For'))
+
+        result = pc.resolve('10.0.0.1', 'for=203.0.113.7, 203.0.113.7')
+
+        self.assertEqual(result, ('203.0.113.7', '10.0.0.1',
+                                  'for=203.0.113.7', None))
+        self.assertFalse(mock_parse_forwarded.called)
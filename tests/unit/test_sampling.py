@@ -0,0 +1,137 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import unittest2
+
+from bark import sampling
+
+
+class RateTest(unittest2.TestCase):
+    def test_fraction(self):
+        self.assertEqual(sampling.rate('0.25'), 0.25)
+        self.assertEqual(sampling.rate(' 1 '), 1.0)
+        self.assertEqual(sampling.rate('0'), 0.0)
+
+    def test_percentage(self):
+        self.assertEqual(sampling.rate('1%'), 0.01)
+        self.assertEqual(sampling.rate('100%'), 1.0)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, sampling.rate, 'often')
+        self.assertRaises(ValueError, sampling.rate, '1.5')
+        self.assertRaises(ValueError, sampling.rate, '-1%')
+
+
+class SamplerTest(unittest2.TestCase):
+    def test_init(self):
+        sampler = sampling.Sampler(0.25)
+
+        self.assertEqual(sampler.rate, 0.25)
+        self.assertEqual(sampler.threshold, 1 << 30)
+        self.assertEqual(sampler.header_key, None)
+        self.assertEqual(sampler.note, None)
+        self.assertEqual(sampler.kept, 0)
+        self.assertEqual(sampler.dropped, 0)
+
+    def test_init_header(self):
+        sampler = sampling.Sampler(1.0, 'X-Request-Id', 'request-id')
+
+        self.assertEqual(sampler.threshold, 1 << 32)
+        self.assertEqual(sampler.header_key, 'HTTP_X_REQUEST_ID')
+        self.assertEqual(sampler.note, None)
+
+    def test_init_note(self):
+        sampler = sampling.Sampler(0.0, note='request-id')
+
+        self.assertEqual(sampler.threshold, 0)
+        self.assertEqual(sampler.header_key, None)
+        self.assertEqual(sampler.note, 'request-id')
+
+    def test_init_invalid(self):
+        self.assertRaises(ValueError, sampling.Sampler, 1.5)
+
+    @mock.patch('random.getrandbits', return_value=(1 << 30) - 1)
+    def test_call_random_kept(self, mock_getrandbits):
+        sampler = sampling.Sampler(0.25)
+        draws = {}
+
+        self.assertEqual(sampler({}, draws), True)
+        mock_getrandbits.assert_called_once_with(32)
+        self.assertEqual(draws, {None: (1 << 30) - 1})
+        self.assertEqual((sampler.kept, sampler.dropped), (1, 0))
+
+    @mock.patch('random.getrandbits', return_value=1 << 30)
+    def test_call_random_dropped(self, mock_getrandbits):
+        sampler = sampling.Sampler(0.25)
+
+        self.assertEqual(sampler({}, {}), False)
+        self.assertEqual((sampler.kept, sampler.dropped), (0, 1))
+
+    @mock.patch('random.getrandbits')
+    def test_call_shared(self, mock_getrandbits):
+        sampler1 = sampling.Sampler(0.25)
+        sampler2 = sampling.Sampler(0.5)
+        draws = {None: 3 << 29}
+
+        self.assertEqual(sampler1({}, draws), False)
+        self.assertEqual(sampler2({}, draws), True)
+        self.assertFalse(mock_getrandbits.called)
+
+    @mock.patch('zlib.crc32', return_value=-1)
+    def test_call_header(self, mock_crc32):
+        sampler = sampling.Sampler(0.5, 'X-Request-Id')
+        draws = {}
+
+        result = sampler({'HTTP_X_REQUEST_ID': 'abc'}, draws)
+
+        self.assertEqual(result, False)
+        mock_crc32.assert_called_once_with('abc')
+        self.assertEqual(draws, {'abc': 0xffffffff})
+
+    @mock.patch('zlib.crc32', return_value=5)
+    def test_call_note(self, mock_crc32):
+        sampler = sampling.Sampler(0.5, note='request-id')
+        draws = {}
+
+        result = sampler({'bark.notes': {'request-id': u'abc'}}, draws)
+
+        self.assertEqual(result, True)
+        mock_crc32.assert_called_once_with('abc')
+        self.assertEqual(draws, {u'abc': 5})
+
+    @mock.patch('random.getrandbits', return_value=0)
+    def test_call_missing_key(self, mock_getrandbits):
+        sampler = sampling.Sampler(0.5, 'X-Request-Id')
+        draws = {}
+
+        self.assertEqual(sampler({}, draws), True)
+        self.assertEqual(draws, {None: 0})
+
+    def test_consistent(self):
+        sampler1 = sampling.Sampler(0.5, 'X-Request-Id')
+        sampler2 = sampling.Sampler(0.5, note='request-id')
+
+        for i in range(100):
+            environ = {
+                'HTTP_X_REQUEST_ID': 'req-%d' % i,
+                'bark.notes': {'request-id': 'req-%d' % i},
+            }
+
+            self.assertEqual(sampler1(environ, {}), sampler2(environ, {}))
+
+        self.assertEqual(sampler1.kept, sampler2.kept)
+        self.assertTrue(0 < sampler1.kept < 100)
+        self.assertEqual(sampler1.kept + sampler1.dropped, 100)
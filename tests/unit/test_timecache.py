@@ -0,0 +1,118 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import mock
+import unittest2
+
+from bark import timecache
+
+
+class GranularityTest(unittest2.TestCase):
+    def test_granularity(self):
+        tests = [
+            ('', 86400),
+            ('static text', 86400),
+            ('%Y-%m-%d', 86400),
+            ('%%H %%M %%S', 86400),
+            ('%Y-%m-%dT%H', 3600),
+            ('%I %p', 3600),
+            ('%Y-%m-%dT%H:%M', 60),
+            ('%R', 60),
+            ('%Y-%m-%dT%H:%M:%SZ', 1),
+            ('[%d/%b/%Y:%H:%M:%S +0000]', 1),
+            ('%c', 1),
+            ('%s', 1),
+            ('%T', 1),
+            ('%-d %_H %02M', 60),
+            ('%Ey %OS', 1),
+            ('%Q', 1),
+        ]
+
+        for fmtstr, expected in tests:
+            self.assertEqual(timecache.granularity(fmtstr), expected,
+                             'granularity of %r' % fmtstr)
+
+
+class TimeCacheTest(unittest2.TestCase):
+    def test_init(self):
+        cache = timecache.TimeCache(5)
+
+        self.assertEqual(cache.maxsize, 5)
+        self.assertEqual(cache.cache, {})
+        self.assertEqual(cache.granularities, {})
+
+    def test_strftime(self):
+        cache = timecache.TimeCache()
+        fmtstr = '[%d/%b/%Y:%H:%M:%S +0000]'
+
+        with mock.patch('time.strftime', wraps=time.strftime) as strftime:
+            result1 = cache.strftime(fmtstr, 1355786023.072341)
+            result2 = cache.strftime(fmtstr, 1355786023.972341)
+            result3 = cache.strftime(fmtstr, 1355786024.072341)
+
+        self.assertEqual(result1, '[17/Dec/2012:23:13:43 +0000]')
+        self.assertEqual(result2, '[17/Dec/2012:23:13:43 +0000]')
+        self.assertEqual(result3, '[17/Dec/2012:23:13:44 +0000]')
+        self.assertEqual(strftime.call_count, 2)
+        self.assertEqual(cache.granularities, {fmtstr: 1})
+
+    def test_strftime_granularity(self):
+        cache = timecache.TimeCache()
+
+        with mock.patch('time.strftime', wraps=time.strftime) as strftime:
+            result1 = cache.strftime('%Y-%m-%d', 1355786023.072341)
+            result2 = cache.strftime('%Y-%m-%d', 1355788799.9)
+            result3 = cache.strftime('%Y-%m-%d', 1355788800.0)
+
+        self.assertEqual(result1, '2012-12-17')
+        self.assertEqual(result2, '2012-12-17')
+        self.assertEqual(result3, '2012-12-18')
+        self.assertEqual(strftime.call_count, 2)
+
+    def test_strftime_maxsize(self):
+        cache = timecache.TimeCache(2)
+
+        cache.strftime('%S', 1)
+        cache.strftime('%S', 2)
+
+        self.assertEqual(len(cache.cache), 2)
+
+        result = cache.strftime('%S', 3)
+
+        self.assertEqual(result, '03')
+        self.assertEqual(cache.cache, {('%S', 3): '03'})
+
+    def test_strftime_matches(self):
+        cache = timecache.TimeCache()
+        fmtstrs = ['%Y-%m-%dT%H:%M:%SZ', '%a %b %d %H', '%M', '%j']
+
+        for timestamp in range(1355786023, 1355800000, 37):
+            for fmtstr in fmtstrs:
+                self.assertEqual(cache.strftime(fmtstr, timestamp + 0.5),
+                                 time.strftime(fmtstr,
+                                               time.gmtime(timestamp + 0.5)))
+
+
+class StrftimeTest(unittest2.TestCase):
+    @mock.patch.object(timecache, '_cache')
+    def test_strftime(self, mock_cache):
+        mock_cache.strftime.return_value = 'formatted'
+
+        result = timecache.strftime('fmtstr', 1234.5)
+
+        self.assertEqual(result, 'formatted')
+        mock_cache.strftime.assert_called_once_with('fmtstr', 1234.5)
@@ -0,0 +1,330 @@
+# Copyright 2012 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import unittest2
+import webob
+
+from bark import wsgi
+
+
+class HeaderKeyTest(unittest2.TestCase):
+    def test_header_key(self):
+        self.assertEqual(wsgi.header_key('User-Agent'), 'HTTP_USER_AGENT')
+        self.assertEqual(wsgi.header_key('x-forwarded-for'),
+                         'HTTP_X_FORWARDED_FOR')
+
+    def test_header_key_content(self):
+        self.assertEqual(wsgi.header_key('Content-Type'), 'CONTENT_TYPE')
+        self.assertEqual(wsgi.header_key('content-length'), 'CONTENT_LENGTH')
+
+    def test_matches_webob(self):
+        req = webob.Request.blank('/')
+        for name in ('User-Agent', 'Content-Type', 'Content-Length',
+                     'Content_Type', 'X-Audit'):
+            req.headers[name] = 'value'
+            self.assertEqual(req.environ.get(wsgi.header_key(name)), 'value')
+
+
+class RequestURLTest(unittest2.TestCase):
+    environs = [
+        {},
+        {'HTTP_HOST': 'example.com'},
+        {'HTTP_HOST': 'example.com:80'},
+        {'HTTP_HOST': 'example.com:8080'},
+        {'HTTP_HOST': '[::1]'},
+        {'HTTP_HOST': '[::1]:8080'},
+        {'HTTP_HOST': 'example.com:443', 'wsgi.url_scheme': 'https'},
+        {'SERVER_NAME': 'example.com', 'SERVER_PORT': '8080'},
+        {'SERVER_NAME': 'example.com', 'SERVER_PORT': '443',
+         'wsgi.url_scheme': 'https'},
+        {'SCRIPT_NAME': '/app', 'PATH_INFO': '/a b/~c;d'},
+        {'PATH_INFO': '/caf\xc3\xa9/%zz'},
+        {'QUERY_STRING': ''},
+        {'QUERY_STRING': 'a=b&c=%20d'},
+    ]
+
+    def _environ(self, extra):
+        environ = webob.Request.blank('/sample/path?i=j').environ
+        del environ['HTTP_HOST']
+        environ.update(extra)
+        return environ
+
+    def test_request_path(self):
+        for extra in self.environs:
+            environ = self._environ(extra)
+
+            self.assertEqual(wsgi.request_path(environ),
+                             webob.Request(environ).path)
+
+    def test_request_url(self):
+        for extra in self.environs:
+            environ = self._environ(extra)
+
+            self.assertEqual(wsgi.request_url(environ),
+                             webob.Request(environ).url)
+
+
+class RequestCookieTest(unittest2.TestCase):
+    headers = [
+        '',
+        'a=1',
+        'a=1; b=2; c=3',
+        'a=1;b=2;c=3',
+        'a = 1 ; b= 2',
+        'ab=1; b=2',
+        'b=x=a=1; a=3',
+        'a=1; a=2',
+        'a=; b=2',
+        'a',
+        'xa=1',
+        'a-b=1; a=2',
+        'a=http://example.com/?q=1',
+        'a=\xc3\xa9; b=2',
+        'e=Wed, 09-Jun-2021 10:18:14 GMT; a=1',
+        'a=Wed, 09-Jun-2021 10:18:14 GMT',
+        'b="x; a=1"; c=3',
+        'b="x; a=1"; a=2',
+        'a="quoted"',
+        'a="\\"esc\\""',
+        'a=esc\\073aped',
+        'a=1, b=2',
+        'aa= b=bb',
+        'a=1 ,c= b=2',
+        'a =\tb=2',
+        'e=Wed, 09-Jun-2021 10:18:14 GMTa=1',
+        'e=Wed, 09-Jun-2021 10:18:14 GMT; a=1',
+        'a b=1; a=2',
+        '=1; a=2',
+    ]
+
+    def test_matches_webob(self):
+        for header in self.headers:
+            for name in ('a', 'b', 'c', 'e', 'aa', 'a-b', 'a b', 'a=b',
+                         '', 'missing'):
+                expected = webob.Request.blank(
+                    '/', headers={'Cookie': header}).cookies.get(name)
+
+                result = wsgi.request_cookie({'HTTP_COOKIE': header}, name)
+
+                self.assertEqual(result, expected,
+                                 'cookie %r in %r' % (name, header))
+
+    def test_no_header(self):
+        environ = {}
+
+        self.assertEqual(wsgi.request_cookie(environ, 'a'), None)
+        self.assertEqual(environ, {'bark.cookies': ('', {'a': None}, None)})
+
+    def test_memoized(self):
+        environ = {'HTTP_COOKIE': 'a=1; b=2'}
+
+        self.assertEqual(wsgi.request_cookie(environ, 'a'), '1')
+        self.assertEqual(wsgi.request_cookie(environ, 'b'), '2')
+        self.assertEqual(environ['bark.cookies'],
+                         ('a=1; b=2', {'a': '1', 'b': '2'}, False))
+
+        with mock.patch.object(wsgi, '_cookie_re') as mock_cookie_re:
+            self.assertEqual(wsgi.request_cookie(environ, 'a'), '1')
+            self.assertEqual(wsgi.request_cookie(environ, 'b'), '2')
+
+        self.assertFalse(mock_cookie_re.called)
+
+    def test_memoized_header_changed(self):
+        environ = {
+            'HTTP_COOKIE': 'a=2',
+            'bark.cookies': ('a=1', {'a': '1'}, False),
+        }
+
+        self.assertEqual(wsgi.request_cookie(environ, 'a'), '2')
+        self.assertEqual(environ['bark.cookies'], ('a=2', {'a': '2'}, False))
+
+    def test_memoized_complex(self):
+        environ = {'HTTP_COOKIE': 'aa= b=bb'}
+
+        with mock.patch.object(wsgi, '_cookie_complex',
+                               return_value=True) as mock_complex:
+            self.assertEqual(wsgi.request_cookie(environ, 'aa'), 'b=bb')
+            self.assertEqual(wsgi.request_cookie(environ, 'b'), None)
+
+        mock_complex.assert_called_once_with('aa= b=bb')
+        self.assertEqual(environ['bark.cookies'],
+                         ('aa= b=bb', {'aa': 'b=bb', 'b': None}, True))
+
+    @mock.patch('webob.cookies.RequestCookies')
+    def test_quoted_fallback(self, mock_RequestCookies):
+        environ = {'HTTP_COOKIE': 'a="1"'}
+
+        result = wsgi.request_cookie(environ, 'a')
+
+        cookies = mock_RequestCookies.return_value
+        self.assertEqual(result, cookies.get.return_value)
+        mock_RequestCookies.assert_called_once_with(environ)
+        cookies.get.assert_called_once_with('a')
+
+    @mock.patch('webob.cookies.RequestCookies')
+    def test_complex_fallback(self, mock_RequestCookies):
+        for header, name in [('aa= b=bb', 'b'),
+                             ('e=Wed, 09-Jun-2021 10:18:14 GMTa=1', 'a'),
+                             ('a=b=1', 'a=b'),
+                             ('a b=1', 'a b')]:
+            mock_RequestCookies.reset_mock()
+            environ = {'HTTP_COOKIE': header}
+
+            result = wsgi.request_cookie(environ, name)
+
+            cookies = mock_RequestCookies.return_value
+            self.assertEqual(result, cookies.get.return_value)
+            mock_RequestCookies.assert_called_once_with(environ)
+            cookies.get.assert_called_once_with(name)
+
+    @mock.patch('webob.cookies.RequestCookies')
+    def test_simple_scanned(self, mock_RequestCookies):
+        for header in ['e=Wed, 09-Jun-2021 10:18:14 GMT; a=1',
+                       'GMT=1; e=x+GMT%2B; a=1']:
+            environ = {'HTTP_COOKIE': header}
+
+            self.assertEqual(wsgi.request_cookie(environ, 'a'), '1')
+
+        self.assertFalse(mock_RequestCookies.called)
+
+    @mock.patch.dict(wsgi._cookie_res, clear=True)
+    def test_cookie_re_cached(self):
+        regex = wsgi._cookie_re('a')
+
+        self.assertEqual(wsgi._cookie_res, {'a': regex})
+        self.assertTrue(wsgi._cookie_re('a') is regex)
+
+
+class RequestTest(unittest2.TestCase):
+    def test_init(self):
+        req = wsgi.Request('environ')
+
+        self.assertEqual(req.environ, 'environ')
+        self.assertEqual(req._request, None)
+
+    @mock.patch('webob.Request')
+    def test_getattr(self, mock_Request):
+        req = wsgi.Request('environ')
+
+        self.assertEqual(req.path_qs, mock_Request.return_value.path_qs)
+        self.assertEqual(req.method, mock_Request.return_value.method)
+        mock_Request.assert_called_once_with('environ')
+
+    @mock.patch('webob.Request')
+    def test_getattr_private(self, mock_Request):
+        req = wsgi.Request('environ')
+
+        self.assertRaises(AttributeError, getattr, req, '_spam')
+        self.assertFalse(mock_Request.called)
+
+
+class ResponseHeadersTest(unittest2.TestCase):
+    def test_mapping(self):
+        headers = wsgi.ResponseHeaders([
+            ('Content-Type', 'text/plain'),
+            ('X-Spam', 'first'),
+            ('x-spam', 'last'),
+        ])
+
+        self.assertEqual(len(headers), 2)
+        self.assertEqual(sorted(headers), ['content-type', 'x-spam'])
+        self.assertTrue('CONTENT-TYPE' in headers)
+        self.assertFalse('Content-Length' in headers)
+        self.assertEqual(headers['X-SPAM'], 'last')
+        self.assertEqual(headers.get('content-type'), 'text/plain')
+        self.assertEqual(headers.get('content-length'), None)
+
+
+class ResponseTest(unittest2.TestCase):
+    def test_init(self):
+        resp = wsgi.Response('200 OK', 'headerlist', 'app_iter')
+
+        self.assertEqual(resp.status, '200 OK')
+        self.assertEqual(resp.headerlist, 'headerlist')
+        self.assertEqual(resp.app_iter, 'app_iter')
+        self.assertEqual(resp._response, None)
+
+    def test_status_code(self):
+        resp = wsgi.Response('404 Not Found', [])
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_headers(self):
+        resp = wsgi.Response('200 OK', [('X-Spam', 'spam')])
+
+        self.assertEqual(resp.headers['x-spam'], 'spam')
+        self.assertTrue(resp.headers is resp.headers)
+
+    def test_content_length(self):
+        for headerlist, expected in [
+                ([], None),
+                ([('Content-Length', '')], None),
+                ([('Content-Length', 'spam')], None),
+                ([('content-length', '19')], 19),
+                ([('Content-Length', '19'), ('Content-Length', '5')], 5),
+                ([('Content-Length', '19'), ('content-length', '')], None),
+                ([('Content-Length', '19'), ('X-Spam', 'spam')], 19)]:
+            resp = wsgi.Response('200 OK', headerlist)
+
+            self.assertEqual(resp.content_length, expected)
+
+    @mock.patch('webob.Response')
+    def test_getattr(self, mock_Response):
+        headerlist = [('X-Spam', 'spam')]
+        resp = wsgi.Response('200 OK', headerlist)
+
+        self.assertEqual(resp.charset, mock_Response.return_value.charset)
+        self.assertEqual(resp.body, mock_Response.return_value.body)
+        self.assertEqual(resp.app_iter, mock_Response.return_value.app_iter)
+        mock_Response.assert_called_once_with(
+            status='200 OK', headerlist=headerlist, app_iter=[])
+        self.assertFalse(
+            mock_Response.call_args[1]['headerlist'] is headerlist)
+
+    @mock.patch('webob.Response')
+    def test_getattr_private(self, mock_Response):
+        resp = wsgi.Response('200 OK', [])
+
+        self.assertRaises(AttributeError, getattr, resp, '_spam')
+        self.assertFalse(mock_Response.called)
+
+    def test_matches_webob(self):
+        headerlist = [('Content-Type', 'text/plain'),
+                      ('Content-Length', '5')]
+        resp = wsgi.Response('201 Created', headerlist, ['hello'])
+        expected = webob.Response(status='201 Created',
+                                  headerlist=list(headerlist),
+                                  app_iter=['hello'])
+
+        self.assertEqual(resp.status_code, expected.status_code)
+        self.assertEqual(resp.content_length, expected.content_length)
+        self.assertEqual(resp.headers['content-type'],
+                         expected.headers['content-type'])
+        self.assertEqual(resp.body, expected.body)
+
+    def test_matches_webob_repeated(self):
+        headerlist = [('Content-Length', '19'),
+                      ('Content-Type', 'text/plain'),
+                      ('content-length', '5')]
+        resp = wsgi.Response('200 OK', headerlist, ['hello'])
+        expected = webob.Response(status='200 OK',
+                                  headerlist=list(headerlist),
+                                  app_iter=['hello'])
+
+        self.assertEqual(resp.content_length,
+                         int(expected.headers['content-length']))
+        self.assertEqual(resp.content_length,
+                         int(resp.headers['content-length']))